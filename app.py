@@ -1,15 +1,34 @@
 # app.py
+import time
+from utils.startup import startup_timer
+run_started = time.perf_counter()
+
 import streamlit as st
-from utils.code_generator import generate_code
-from utils.explainer import explain_code
-from utils.test_generator import generate_tests
+from utils.code_generator import stream_code
+from utils.explainer import stream_explanation
+from utils.test_generator import stream_tests
 from utils.agents import run_agent
 from utils.github_api import GitHubAPI
-from utils.pr_reviewer import generate_pr_review, extract_line_comments
-from utils.simple_vector_store import vector_store  # Use the simple vector store
-from utils.config import APP_TITLE, APP_ICON
+from utils.pr_reviewer import stream_pr_review, extract_line_comments, build_review_comments
+from utils.simple_vector_store import get_vector_store  # Use the simple vector store
+from utils.llm_cache import get_llm_cache
+from utils.background_jobs import JobGroup
+from utils.model_router import Restart
+from utils.metrics import registry, summary, start_metrics_server
+from utils.review_queue import get_review_queue, start_review_workers
+from utils.test_runner import get_test_runner, FRAMEWORKS as RUNNABLE_FRAMEWORKS
+from utils.config import (
+    APP_TITLE,
+    APP_ICON,
+    PREFETCH_AGENTS,
+    ADMIN_VIEW,
+    METRICS_HOST,
+    METRICS_PORT,
+    REVIEW_QUEUE_IN_APP,
+    REVIEW_QUEUE_POST,
+    get_openai_api_key
+)
 import uuid
-import time
 
 # Set page config
 st.set_page_config(
@@ -18,6 +37,137 @@ st.set_page_config(
     layout="wide"
 )
 
+# Stop with an error right away if the OpenAI API key is missing
+get_openai_api_key()
+
+# Prometheus endpoint for the metrics registry; starts once per process
+start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+def render_stream(stream, language=None, placeholder=None):
+    """Render a stream of text chunks incrementally and return the full text."""
+    placeholder = placeholder or st.empty()
+    text = ""
+    last_render = 0.0
+    for chunk in stream:
+        if isinstance(chunk, Restart):
+            # The response failed validation and a stronger model's replaces it
+            text = ""
+            continue
+        text += chunk
+        # Re-rendering sends the whole text, so throttle updates for long outputs
+        if time.monotonic() - last_render > 0.1:
+            if language:
+                placeholder.code(text, language=language)
+            else:
+                placeholder.markdown(text)
+            last_render = time.monotonic()
+    if language:
+        placeholder.code(text, language=language)
+    else:
+        placeholder.markdown(text)
+    return text
+
+def render_prefetched(name, fallback_stream, language=None):
+    """
+    Render the output of a prefetch job as it streams in.
+    
+    Falls back to streaming in the foreground when there is no job for this
+    code or the job failed.
+    """
+    job = st.session_state.prefetch.get(name) if st.session_state.prefetch else None
+    if job is None:
+        return render_stream(fallback_stream(), language)
+    
+    def job_chunks():
+        sent = 0
+        restarts = 0
+        while True:
+            # Check for completion before reading, so the final read sees all the text
+            done = job.done()
+            if job.restarts != restarts:
+                restarts = job.restarts
+                sent = 0
+                yield Restart()
+            text = job.text
+            if len(text) > sent:
+                yield text[sent:]
+                sent = len(text)
+            if done:
+                break
+            time.sleep(0.05)
+    
+    placeholder = st.empty()
+    try:
+        text = render_stream(job_chunks(), language, placeholder)
+        job.result()
+        return text
+    except Exception:
+        return render_stream(fallback_stream(), language, placeholder)
+
+def collect_prefetched(state_key, name):
+    """Copy a finished prefetch job's result into session state."""
+    job = st.session_state.prefetch.get(name) if st.session_state.prefetch else None
+    if st.session_state[state_key] or job is None or not job.done():
+        return
+    if not job.future.cancelled() and job.future.exception() is None:
+        st.session_state[state_key] = job.result()
+
+def run_agent_or_prefetched(name, request, default_request, code, language, tool):
+    """Reuse the prefetched agent analysis when the request is unchanged, otherwise call the tab's tool."""
+    job = st.session_state.prefetch.get(name) if st.session_state.prefetch else None
+    if job is not None and request == default_request:
+        try:
+            return job.result()
+        except Exception:
+            pass
+    return run_agent(request, code, language, tool=tool)
+
+def test_run_future(runner, code, tests, framework, start=False):
+    """
+    The sandboxed run of these tests against this code, or None when it has
+    not been started. With `start`, the run is submitted to the runner's pool.
+    """
+    key = (code, tests, framework)
+    if start:
+        st.session_state.test_run = (key, runner.submit(code, tests, framework))
+    if st.session_state.test_run is None or st.session_state.test_run[0] != key:
+        return None
+    return st.session_state.test_run[1]
+
+def show_test_run_result(future):
+    """Show the pass/fail/error counts of a finished test run."""
+    try:
+        result = future.result()
+    except Exception as e:
+        st.error(f"Could not run the tests: {e}")
+        return
+    passed_col, failed_col, errors_col, skipped_col = st.columns(4)
+    passed_col.metric("Passed", result.passed)
+    failed_col.metric("Failed", result.failed)
+    errors_col.metric("Errors", result.errors)
+    skipped_col.metric("Skipped", result.skipped)
+    message = f"Test run {result.status} in {result.duration:.1f}s" + (" (cached)" if result.cached else "")
+    if result.status == "passed":
+        st.success(message)
+    elif result.status == "failed":
+        st.warning(message)
+    else:
+        st.error(message)
+    with st.expander("Test output"):
+        st.code(result.output or "(no output)", language="text")
+
+@st.fragment(run_every=1.0)
+def poll_test_run(future):
+    """Wait for a test run without blocking the page, rerunning the app once it finishes."""
+    if future.done():
+        st.rerun()
+    st.info("Running the tests in a sandbox...")
+
+# Default agent requests, also used when prefetching the agent analyses
+DEFAULT_BUG_REQUEST = "Check for any bugs in this code"
+DEFAULT_OPT_REQUEST = "Optimize this code for performance and readability"
+DEFAULT_DOC_REQUEST = "Generate comprehensive documentation for this code"
+
 st.title(f"{APP_ICON} {APP_TITLE}")
 st.markdown("### AI-Powered Code Generation Assistant")
 
@@ -38,15 +188,41 @@ if 'documentation' not in st.session_state:
     st.session_state.documentation = ""
 if 'pr_review' not in st.session_state:
     st.session_state.pr_review = ""
+if 'pr_submission' not in st.session_state:
+    st.session_state.pr_submission = None
 if 'github_token' not in st.session_state:
     st.session_state.github_token = ""
+if 'prefetch' not in st.session_state:
+    st.session_state.prefetch = None
+if 'test_run' not in st.session_state:
+    st.session_state.test_run = None
+if 'queued_jobs' not in st.session_state:
+    st.session_state.queued_jobs = []
 
 # Sidebar for GitHub settings
 st.sidebar.header("GitHub Settings")
 st.session_state.github_token = st.sidebar.text_input("GitHub Token", type="password", value=st.session_state.github_token)
 
+# Background analysis settings
+st.sidebar.header("Analysis Settings")
+prefetch_agents = st.sidebar.checkbox(
+    "Prefetch agent analyses",
+    value=PREFETCH_AGENTS,
+    help="Run bug detection, optimization and documentation in the background as soon as code is generated."
+)
+
+# LLM response cache statistics
+llm_cache = get_llm_cache()
+if llm_cache is not None:
+    cache_stats = llm_cache.stats()
+    st.sidebar.caption(
+        f"LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+        f"{cache_stats['entries']} entries ({cache_stats['size_bytes'] / 1024 / 1024:.1f} MB)"
+    )
+
 # Main tabs
-tab1, tab2 = st.tabs(["Code Generation", "GitHub PR Review"])
+tab_names = ["Code Generation", "GitHub PR Review"] + (["Metrics"] if ADMIN_VIEW else [])
+tab1, tab2, *admin_tabs = st.tabs(tab_names)
 
 with tab1:
     # Input fields
@@ -60,10 +236,27 @@ with tab1:
     # Search for similar snippets
     st.subheader("Search for Similar Code Snippets")
     search_query = st.text_input("Enter a query to search for similar snippets:")
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    with filter_col1:
+        search_mode = st.selectbox("Search mode", ["Semantic", "Keyword"])
+    with filter_col2:
+        search_language = st.selectbox("Filter by language", ["Any", "Python", "JavaScript", "Java", "C++"])
+    with filter_col3:
+        search_window = st.selectbox("Created within", ["Any time", "Last day", "Last week", "Last month"],
+                                     disabled=search_mode == "Semantic")
     if st.button("Search"):
         if search_query:
             with st.spinner("Searching..."):
-                results = vector_store.search_snippets(search_query)
+                search_language = None if search_language == "Any" else search_language
+                if search_mode == "Semantic":
+                    results = get_vector_store().search_similar(search_query, language=search_language)
+                else:
+                    window_seconds = {"Last day": 86400, "Last week": 7 * 86400, "Last month": 30 * 86400}
+                    results = get_vector_store().search_snippets(
+                        search_query,
+                        language=search_language,
+                        since=time.time() - window_seconds[search_window] if search_window in window_seconds else None
+                    )
                 if results['documents']:
                     st.write("Found similar snippets:")
                     for i, doc in enumerate(results['documents']):
@@ -78,16 +271,20 @@ with tab1:
     # Generate code button
     if st.button("Generate Code", type="primary"):
         if task:
+            # Analyses of the previous code are no longer needed
+            if st.session_state.prefetch:
+                st.session_state.prefetch.cancel()
+                st.session_state.prefetch = None
+            
             with st.spinner("Generating code..."):
-                # Generate code
-                generated_code = generate_code(language, task)
+                # Stream the generated code as it arrives
+                stream_placeholder = st.empty()
+                generated_code = render_stream(stream_code(language, task), language.lower(), stream_placeholder)
                 st.session_state.generated_code = generated_code
                 
-                # Store in vector store
-                snippet_id = str(uuid.uuid4())
-                st.session_state.snippet_id = snippet_id
-                vector_store.add_snippet(
-                    snippet_id=snippet_id,
+                # Store in vector store; a near-duplicate of a stored snippet is merged into it
+                st.session_state.snippet_id = get_vector_store().add_snippet(
+                    snippet_id=str(uuid.uuid4()),
                     code=generated_code,
                     metadata={
                         "language": language,
@@ -95,6 +292,20 @@ with tab1:
                         "timestamp": time.time()
                     }
                 )
+                stream_placeholder.empty()
+                
+                # Drop analyses of the previous code and start the new ones in the background
+                for key in ["explanation", "tests", "bug_analysis", "optimized_code", "documentation"]:
+                    st.session_state[key] = ""
+                prefetch = JobGroup()
+                prefetch.submit_stream("explanation", stream_explanation, generated_code)
+                prefetch.submit_stream("tests", stream_tests, generated_code, testing_framework)
+                if prefetch_agents:
+                    prefetch.submit("bugs", run_agent, DEFAULT_BUG_REQUEST, generated_code, language, tool="detect_and_fix_bugs")
+                    prefetch.submit("optimization", run_agent, DEFAULT_OPT_REQUEST, generated_code, language, tool="optimize_code")
+                    prefetch.submit("documentation", run_agent, DEFAULT_DOC_REQUEST, generated_code, language, tool="generate_documentation")
+                st.session_state.prefetch = prefetch
+                
                 st.success("Code generated and stored successfully!")
         else:
             st.error("Please enter a task description.")
@@ -125,9 +336,12 @@ with tab1:
         with subtab2:
             st.subheader("Code Explanation")
             if not st.session_state.explanation:
-                with st.spinner("Generating explanation..."):
-                    st.session_state.explanation = explain_code(st.session_state.generated_code)
-            st.markdown(st.session_state.explanation)
+                st.session_state.explanation = render_prefetched(
+                    "explanation",
+                    lambda: stream_explanation(st.session_state.generated_code)
+                )
+            else:
+                st.markdown(st.session_state.explanation)
             
             # Download button for explanation
             st.download_button(
@@ -140,9 +354,29 @@ with tab1:
         with subtab3:
             st.subheader("Test Cases")
             if not st.session_state.tests:
-                with st.spinner("Generating tests..."):
-                    st.session_state.tests = generate_tests(st.session_state.generated_code, testing_framework)
-            st.code(st.session_state.tests, language=language.lower())
+                st.session_state.tests = render_prefetched(
+                    "tests",
+                    lambda: stream_tests(st.session_state.generated_code, testing_framework),
+                    language.lower()
+                )
+            else:
+                st.code(st.session_state.tests, language=language.lower())
+            
+            # Run Python tests against the generated code in the background
+            test_runner = get_test_runner()
+            if test_runner is not None and language == "Python" and testing_framework in RUNNABLE_FRAMEWORKS \
+                    and st.session_state.tests:
+                st.markdown("#### Test Run")
+                future = test_run_future(
+                    test_runner, st.session_state.generated_code, st.session_state.tests, testing_framework,
+                    start=st.button("Run tests")
+                )
+                if future is None:
+                    st.info("Runs the tests against the generated code in a sandboxed subprocess.")
+                elif future.done():
+                    show_test_run_result(future)
+                else:
+                    poll_test_run(future)
             
             # Download button for tests
             st.download_button(
@@ -155,15 +389,20 @@ with tab1:
         with subtab4:
             st.subheader("Bug Detection")
             bug_request = st.text_area("Describe what you want to check for bugs:", 
-                                       value="Check for any bugs in this code", height=100)
+                                       value=DEFAULT_BUG_REQUEST, height=100)
             
             if st.button("Detect Bugs", key="bug_button"):
                 with st.spinner("Analyzing for bugs..."):
-                    st.session_state.bug_analysis = run_agent(
-                        bug_request, 
-                        st.session_state.generated_code, 
-                        language
+                    st.session_state.bug_analysis = run_agent_or_prefetched(
+                        "bugs",
+                        bug_request,
+                        DEFAULT_BUG_REQUEST,
+                        st.session_state.generated_code,
+                        language,
+                        "detect_and_fix_bugs"
                     )
+            else:
+                collect_prefetched("bug_analysis", "bugs")
             
             if st.session_state.bug_analysis:
                 st.markdown(st.session_state.bug_analysis)
@@ -179,15 +418,20 @@ with tab1:
         with subtab5:
             st.subheader("Code Optimization")
             opt_request = st.text_area("Describe optimization goals:", 
-                                       value="Optimize this code for performance and readability", height=100)
+                                       value=DEFAULT_OPT_REQUEST, height=100)
             
             if st.button("Optimize Code", key="opt_button"):
                 with st.spinner("Optimizing code..."):
-                    st.session_state.optimized_code = run_agent(
-                        opt_request, 
-                        st.session_state.generated_code, 
-                        language
+                    st.session_state.optimized_code = run_agent_or_prefetched(
+                        "optimization",
+                        opt_request,
+                        DEFAULT_OPT_REQUEST,
+                        st.session_state.generated_code,
+                        language,
+                        "optimize_code"
                     )
+            else:
+                collect_prefetched("optimized_code", "optimization")
             
             if st.session_state.optimized_code:
                 st.markdown(st.session_state.optimized_code)
@@ -203,15 +447,20 @@ with tab1:
         with subtab6:
             st.subheader("Documentation")
             doc_request = st.text_area("Describe documentation needs:", 
-                                       value="Generate comprehensive documentation for this code", height=100)
+                                       value=DEFAULT_DOC_REQUEST, height=100)
             
             if st.button("Generate Documentation", key="doc_button"):
                 with st.spinner("Generating documentation..."):
-                    st.session_state.documentation = run_agent(
-                        doc_request, 
-                        st.session_state.generated_code, 
-                        language
+                    st.session_state.documentation = run_agent_or_prefetched(
+                        "documentation",
+                        doc_request,
+                        DEFAULT_DOC_REQUEST,
+                        st.session_state.generated_code,
+                        language,
+                        "generate_documentation"
                     )
+            else:
+                collect_prefetched("documentation", "documentation")
             
             if st.session_state.documentation:
                 st.markdown(st.session_state.documentation)
@@ -255,44 +504,38 @@ with tab2:
                     # Get PR files
                     pr_files = github_api.get_pull_request_files(repo_owner, repo_name, pr_number)
                     
-                    # Generate review
-                    review = generate_pr_review(
+                    # Stream the review as it is generated
+                    stream_placeholder = st.empty()
+                    review_stats = {}
+                    review = render_stream(stream_pr_review(
                         f"{repo_owner}/{repo_name}",
                         pr_number,
                         pr_title,
                         pr_description,
-                        pr_files
-                    )
+                        pr_files,
+                        stats=review_stats
+                    ), placeholder=stream_placeholder)
+                    stream_placeholder.empty()
                     
                     st.session_state.pr_review = review
                     
-                    # Extract line comments
-                    line_comments = extract_line_comments(review)
-                    
-                    # Post line comments to GitHub (optional)
-                    if line_comments and st.checkbox("Post comments to GitHub"):
-                        for comment in line_comments:
-                            try:
-                                # Find the file in PR files
-                                file_info = next((f for f in pr_files if f['filename'] == comment['file']), None)
-                                if file_info:
-                                    # Get the commit ID
-                                    commit_id = file_info.get('sha', '')
-                                    
-                                    # Post the comment
-                                    github_api.create_pull_request_review_comment(
-                                        repo_owner,
-                                        repo_name,
-                                        pr_number,
-                                        commit_id,
-                                        comment['file'],
-                                        comment['line'],
-                                        comment['comment']
-                                    )
-                            except Exception as e:
-                                st.warning(f"Failed to post comment: {str(e)}")
+                    # Map line comments to diff positions so they can be posted as one review
+                    comments, unmapped = build_review_comments(extract_line_comments(review), pr_files)
+                    st.session_state.pr_submission = {
+                        "owner": repo_owner,
+                        "repo": repo_name,
+                        "pr_number": pr_number,
+                        "commit_id": pr_details["head"]["sha"],
+                        "comments": comments,
+                        "unmapped": unmapped
+                    }
                     
                     st.success("Pull request review completed successfully!")
+                    if review_stats.get("files_reused"):
+                        st.caption(
+                            f"Reviewed {review_stats['files_reviewed']} new or changed files; "
+                            f"reused findings for {review_stats['files_reused']} unchanged files."
+                        )
                     
                 except Exception as e:
                     st.error(f"Error reviewing pull request: {str(e)}")
@@ -309,6 +552,102 @@ with tab2:
             file_name=f"pr_{pr_number}_review.md",
             mime="text/markdown"
         )
+        
+        # Post every line comment to GitHub in a single review
+        submission = st.session_state.pr_submission
+        if submission and (submission["comments"] or submission["unmapped"]):
+            total = len(submission["comments"]) + len(submission["unmapped"])
+            if st.button(f"Post {total} comments to GitHub"):
+                # Comments on lines outside the diff cannot be attached to a line
+                body = "\n".join(
+                    f"- `{comment['file']}` line {comment['line']}: {comment['comment']}"
+                    for comment in submission["unmapped"]
+                )
+                try:
+                    github_api = GitHubAPI(token=st.session_state.github_token)
+                    github_api.submit_pull_request_review(
+                        submission["owner"],
+                        submission["repo"],
+                        submission["pr_number"],
+                        submission["commit_id"],
+                        submission["comments"],
+                        body=body
+                    )
+                    st.success(f"Posted a review with {len(submission['comments'])} line comments.")
+                    st.session_state.pr_submission = None
+                except Exception as e:
+                    st.error(f"Failed to post review: {str(e)}")
+    
+    # Reviews queued here run in the background with the server's GitHub token, so the
+    # in-app queue is opt-in and each session only sees the jobs it queued
+    if REVIEW_QUEUE_IN_APP:
+        st.subheader("Background Review Queue")
+        start_review_workers()
+        review_queue = get_review_queue()
+        st.caption(
+            "Queued reviews run with the server's GitHub token"
+            + (" and are posted to the pull request when done." if REVIEW_QUEUE_POST else ".")
+        )
+        if st.button("Queue Review"):
+            if not all([repo_owner, repo_name, pr_number]):
+                st.error("Please fill in all repository and PR details.")
+            else:
+                job_id = review_queue.enqueue(repo_owner, repo_name, int(pr_number), delay=0)
+                st.session_state.queued_jobs.append(job_id)
+                st.success(f"Queued review job {job_id}.")
+        
+        queued_jobs = review_queue.jobs(limit=20, ids=st.session_state.queued_jobs)
+        if queued_jobs:
+            st.dataframe([
+                {
+                    "job": job["id"],
+                    "pull request": f"{job['owner']}/{job['repo']}#{job['pr_number']}",
+                    "head": (job["head_sha"] or "")[:7],
+                    "trigger": job["action"],
+                    "priority": job["priority"],
+                    "status": job["status"],
+                    "comments": job["comments"],
+                    "error": job["error"],
+                }
+                for job in queued_jobs
+            ], use_container_width=True, hide_index=True)
+            reviewed_jobs = {job["id"]: job for job in queued_jobs if job["review"]}
+            if reviewed_jobs:
+                job_id = st.selectbox("Show review of job", list(reviewed_jobs))
+                with st.expander("Review", expanded=False):
+                    st.markdown(reviewed_jobs[job_id]["review"])
+        else:
+            st.caption("No queued reviews yet.")
+
+if admin_tabs:
+    with admin_tabs[0]:
+        st.header("Metrics")
+        st.caption(
+            "Recorded since this process started, across every session. "
+            "Percentiles cover the last 1000 calls of each series."
+        )
+        tables = summary()
+        for title, key, empty in [
+            ("Features", "features", "No feature calls yet."),
+            ("LLM calls", "models", "No LLM calls have reached the model yet."),
+            ("LLM response cache", "cache", "No cache lookups yet."),
+            ("Coalesced calls", "coalescing", "No LLM or GitHub calls yet."),
+            ("Model routes", "routes", "No routed LLM calls yet."),
+            ("HTTP (rate limiter)", "http", "No OpenAI or GitHub requests yet."),
+            ("GitHub API", "github", "No GitHub requests yet."),
+        ]:
+            st.subheader(title)
+            if tables[key]:
+                st.dataframe(tables[key], use_container_width=True, hide_index=True)
+            else:
+                st.caption(empty)
+        
+        metrics_text = registry.render()
+        with st.expander("Prometheus text"):
+            if METRICS_PORT:
+                st.caption(f"Also served at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+            st.code(metrics_text, language="text")
+        st.download_button("Download metrics", data=metrics_text, file_name="metrics.prom", mime="text/plain")
 
 # Add footer
 st.markdown("---")
@@ -321,4 +660,12 @@ st.markdown(
     </div>
     """,
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+# Startup timing: the first run includes importing the app's modules
+startup_timer.run_finished(run_started)
+startup_stats = startup_timer.stats()
+st.sidebar.caption(
+    f"Cold start {startup_stats['cold_start']:.2f}s, this run {startup_stats['last_run'] * 1000:.0f} ms "
+    f"(average {startup_stats['average_run'] * 1000:.0f} ms over {startup_stats['runs']} runs)"
+)
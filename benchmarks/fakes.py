@@ -0,0 +1,161 @@
+# benchmarks/fakes.py
+import re
+import time
+from contextlib import contextmanager
+from typing import List
+from langchain_core.language_models.llms import LLM
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, GenerationChunk
+
+FILE_HEADER_PATTERN = re.compile(r"(?m)^#+\s*File:\s*`?([^`\s(]+)")
+
+def fake_response(prompt, tokens):
+    """
+    Build a deterministic response of about `tokens` tokens for a prompt.
+
+    Review prompts get a "### File:" section with a "File: <path>, Line: 1"
+    comment for each file they mention, so that the per-file split and the
+    line comment extraction downstream have something to work on. Other
+    prompts get Python code, padded with a comment so that it still parses.
+    """
+    files = list(dict.fromkeys(FILE_HEADER_PATTERN.findall(prompt)))
+    if files:
+        sections = [f"### File: {path}\n- File: {path}, Line: 1: Consider a clearer name here.\n" for path in files]
+        text = "## Summary\nLooks reasonable overall.\n\n" + "\n".join(sections) + "\n"
+    else:
+        text = "def solution(values):\n    \"\"\"Return the sorted values.\"\"\"\n    return sorted(values)\n# "
+    words = text.split(" ")
+    filler = max(0, tokens - len(words))
+    return text + " ".join(["token"] * filler)
+
+def split_tokens(text):
+    """Split text into word-sized chunks that join back to the original."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+class LatencyModel:
+    """Mixin that spaces out tokens like a real model: a fixed delay, then a steady token rate."""
+
+    def wait_first_token(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def wait_token(self):
+        if self.tokens_per_second:
+            time.sleep(1 / self.tokens_per_second)
+
+class FakeCompletionLLM(LatencyModel, LLM):
+    """Completion model stand-in with configurable latency and token rate."""
+
+    latency: float = 0.2
+    tokens_per_second: float = 0.0
+    response_tokens: int = 200
+    model_name: str = "gpt-3.5-turbo-instruct"
+
+    @property
+    def _llm_type(self):
+        return "fake-completion"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name, "latency": self.latency, "tokens_per_second": self.tokens_per_second}
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.wait_first_token()
+        for i, token in enumerate(split_tokens(fake_response(prompt, self.response_tokens))):
+            if i:
+                self.wait_token()
+            yield GenerationChunk(text=token)
+
+class FakeChatModel(LatencyModel, BaseChatModel):
+    """
+    Chat model stand-in with configurable latency and token rate.
+
+    When tools are bound, as the agent does, the first turn calls up to
+    `tool_calls_per_turn` of them and the turn after the tool results
+    returns a final answer.
+    """
+
+    latency: float = 0.2
+    tokens_per_second: float = 0.0
+    response_tokens: int = 200
+    # Read by the PR reviewer to pick a tokenizer
+    model_name: str = "gpt-3.5-turbo"
+    tool_calls_per_turn: int = 2
+    tool_names: List[str] = []
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tool_names": [tool.name for tool in tools]})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.tool_names and not any(isinstance(message, ToolMessage) for message in messages):
+            self.wait_first_token()
+            calls = [
+                {"name": name, "args": {"code": "pass", "language": "Python"}, "id": f"call_{i}"}
+                for i, name in enumerate(self.tool_names[:self.tool_calls_per_turn])
+            ]
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content="", tool_calls=calls))])
+        text = "".join(chunk.text for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.wait_first_token()
+        for i, token in enumerate(split_tokens(fake_response(prompt, self.response_tokens))):
+            if i:
+                self.wait_token()
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+@contextmanager
+def fake_llms(latency=0.2, tokens_per_second=0.0, response_tokens=200):
+    """
+    Swap every module's LLM for a fake one while the block runs.
+
+    Modules get their clients through utils.model_router, which calls
+    utils.llms.get_llm, and build chains on first use, so this replaces
+    get_llm in the router and clears the cached chains on the way in and
+    out. Each routed model gets its own fake, named after it.
+    """
+    from utils import code_generator, pr_reviewer, agents, model_router
+    from utils.config import COALESCE_CALLS
+    from utils.llms import coalescing
+
+    fakes = {}
+
+    def get_fake_llm(chat=False, temperature=0.3, model=None):
+        key = (chat, temperature, model)
+        if key not in fakes:
+            llm_class = FakeChatModel if chat else FakeCompletionLLM
+            if COALESCE_CALLS:
+                llm_class = coalescing(llm_class)
+            settings = {"model_name": model} if model else {}
+            fakes[key] = llm_class(
+                latency=latency, tokens_per_second=tokens_per_second, response_tokens=response_tokens, **settings
+            )
+        return fakes[key]
+
+    modules = [model_router]
+    chain_getters = [
+        code_generator.get_code_chain,
+        pr_reviewer.get_review_chain,
+        agents.get_agent_executor,
+    ]
+    originals = [module.get_llm for module in modules]
+    for getter in chain_getters:
+        getter.cache_clear()
+    for module in modules:
+        module.get_llm = get_fake_llm
+    try:
+        yield get_fake_llm
+    finally:
+        for module, original in zip(modules, originals):
+            module.get_llm = original
+        for getter in chain_getters:
+            getter.cache_clear()
@@ -0,0 +1,164 @@
+# benchmarks/github_stub.py
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+def make_patch(lines):
+    """A single-hunk patch that adds `lines` lines."""
+    body = "\n".join(f"+    value_{i} = compute({i})" for i in range(lines))
+    return f"@@ -0,0 +1,{lines} @@\n{body}"
+
+def make_files(count, patch_lines=20):
+    """Changed files in the shape the pull request files endpoint returns."""
+    files = []
+    for i in range(count):
+        patch = make_patch(patch_lines)
+        files.append({
+            "sha": hashlib.sha1(f"{i}:{patch}".encode("utf-8")).hexdigest(),
+            "filename": f"src/module_{i}.py",
+            "status": "modified",
+            "additions": patch_lines,
+            "deletions": 0,
+            "changes": patch_lines,
+            "patch": patch
+        })
+    return files
+
+class GitHubStub:
+    """
+    Local stand-in for the GitHub REST endpoints GitHubAPI uses.
+
+    Serves the pull request, its files (paginated with Link headers and
+    revalidated with ETags), the repository languages, and accepts review
+    comments and reviews. `latency` is added to every response. Every pull
+    request starts at `head_sha`; push() moves one to a new head.
+    """
+
+    def __init__(self, file_count=10, patch_lines=20, latency=0.0):
+        self.files = make_files(file_count, patch_lines)
+        self.latency = latency
+        self.head_sha = hashlib.sha1(b"head").hexdigest()
+        self.heads = {}
+        self.pushes = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.comments = []
+        self.reviews = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def head(self, pr_number):
+        with self._lock:
+            return self.heads.get(pr_number, self.head_sha)
+
+    def push(self, pr_number):
+        """Move a pull request to a new head commit and return its SHA."""
+        with self._lock:
+            self.pushes += 1
+            sha = hashlib.sha1(f"push {self.pushes}".encode("utf-8")).hexdigest()
+            self.heads[pr_number] = sha
+            return sha
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    with stub._lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.send_header("X-RateLimit-Remaining", "4999")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def begin(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                url = urlparse(self.path)
+                return url.path, parse_qs(url.query)
+
+            def do_GET(self):
+                path, query = self.begin()
+                match = re.fullmatch(r"/repos/([^/]+)/([^/]+)/pulls/(\d+)(/files)?", path)
+                if match and not match.group(4):
+                    self.send_json(200, {
+                        "number": int(match.group(3)),
+                        "title": "Benchmark pull request",
+                        "body": "Changes generated for benchmarking.",
+                        "head": {"sha": stub.head(int(match.group(3)))}
+                    })
+                elif match:
+                    per_page = int(query.get("per_page", ["30"])[0])
+                    page = int(query.get("page", ["1"])[0])
+                    start = (page - 1) * per_page
+                    headers = {}
+                    if start + per_page < len(stub.files):
+                        headers["Link"] = f'<{stub.base_url}{path}?per_page={per_page}&page={page + 1}>; rel="next"'
+                    self.send_json(200, stub.files[start:start + per_page], headers)
+                elif re.fullmatch(r"/repos/[^/]+/[^/]+/languages", path):
+                    self.send_json(200, {"Python": 12345})
+                else:
+                    self.send_json(404, {"message": "Not Found"})
+
+            def do_POST(self):
+                path, _ = self.begin()
+                length = int(self.headers.get("Content-Length", "0"))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if re.fullmatch(r"/repos/[^/]+/[^/]+/pulls/\d+/comments", path):
+                    with stub._lock:
+                        stub.comments.append(body)
+                    self.send_json(201, dict(body, id=len(stub.comments)))
+                elif re.fullmatch(r"/repos/[^/]+/[^/]+/pulls/\d+/reviews", path):
+                    with stub._lock:
+                        stub.reviews.append(dict(body, path=path))
+                    self.send_json(200, {"id": len(stub.reviews), "state": "COMMENTED"})
+                else:
+                    self.send_json(404, {"message": "Not Found"})
+
+        return Handler
+
+@contextmanager
+def github_stub(**kwargs):
+    """Run a GitHubStub for the duration of the block."""
+    stub = GitHubStub(**kwargs).start()
+    try:
+        yield stub
+    finally:
+        stub.stop()
@@ -0,0 +1,419 @@
+# benchmarks/run.py
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmarks run offline against fakes: give config the secrets it expects and
+# keep the GitHub rate limiter and the disk caches out of the measurements
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("GITHUB_TOKEN", "benchmark")
+os.environ.setdefault("GITHUB_RATE_LIMIT", "100000")
+os.environ.setdefault("GITHUB_RATE_BURST", "100000")
+os.environ.setdefault("GITHUB_CACHE_DIR", "")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+import numpy as np
+from benchmarks.fakes import fake_llms
+from benchmarks.github_stub import github_stub
+
+SAMPLE_CODE = '''def find_max(values):
+    """Return the largest value in a list."""
+    best = values[0]
+    for value in values:
+        if value > best:
+            best = value
+    return best
+'''
+
+LLM_BENCHMARKS = ["generate_code", "generate_code_same", "explain_code", "generate_tests", "run_agent", "run_agent_fallback"]
+PR_BENCHMARKS = ["pr_review", "pr_review_incremental"]
+ALL_BENCHMARKS = LLM_BENCHMARKS + PR_BENCHMARKS + ["vector_store", "service", "review_queue", "test_runs"]
+
+def summarize(name, latencies, elapsed, units=None):
+    """
+    Summarize latencies (seconds) measured over `elapsed` wall-clock seconds.
+
+    Args:
+        units: Items processed per measurement, for throughput; defaults to 1
+    """
+    latencies = np.asarray(latencies, dtype=float)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    total_units = (units or 1) * len(latencies)
+    return {
+        "name": name,
+        "count": len(latencies),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(latencies.mean() * 1000), 3),
+        "throughput_per_s": round(total_units / elapsed, 2) if elapsed else None
+    }
+
+def measure(name, fn, iterations, concurrency=1, warmup=1, units=None):
+    """Call fn(i) `iterations` times with up to `concurrency` calls in flight."""
+    for i in range(warmup):
+        fn(-1 - i)
+
+    def timed(i):
+        started = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        latencies = [timed(i) for i in range(iterations)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(iterations)))
+    return summarize(name, latencies, time.perf_counter() - started, units)
+
+def run_llm_benchmarks(names, args):
+    from utils.code_generator import generate_code
+    from utils.explainer import explain_code
+    from utils.test_generator import generate_tests
+    from utils.agents import run_agent
+
+    calls = {
+        "generate_code": lambda i: generate_code("Python", f"returns the {i}th Fibonacci number"),
+        # Identical requests: with --concurrency above 1, calls in flight together share one model call
+        "generate_code_same": lambda i: generate_code("Python", "returns the nth Fibonacci number"),
+        "explain_code": lambda i: explain_code(SAMPLE_CODE),
+        "generate_tests": lambda i: generate_tests(SAMPLE_CODE),
+        "run_agent": lambda i: run_agent("Check for any bugs in this code", SAMPLE_CODE, "Python", tool="detect_and_fix_bugs"),
+        # Matches no single tool, so it goes through the agent, which calls two tools at once
+        "run_agent_fallback": lambda i: run_agent("Review this code", SAMPLE_CODE, "Python"),
+    }
+    results = []
+    with fake_llms(args.latency, args.tokens_per_second, args.response_tokens):
+        for name in names:
+            results.append(measure(name, calls[name], args.iterations, args.concurrency))
+    return results
+
+@contextmanager
+def review_cache_override(cache):
+    """Use `cache` as the per-file review cache while the block runs; None disables it."""
+    from utils import pr_reviewer
+
+    original = pr_reviewer.get_review_cache
+    pr_reviewer.get_review_cache = lambda: cache
+    try:
+        yield
+    finally:
+        pr_reviewer.get_review_cache = original
+
+def run_pr_benchmarks(names, args):
+    """Fetch a PR from the GitHub stub, review it, and post the comments as one review."""
+    from utils.github_api import GitHubAPI, ETagCache
+    from utils.pr_reviewer import generate_pr_review, extract_line_comments, build_review_comments
+    from utils.review_cache import FileReviewCache
+
+    results = []
+    directory = tempfile.mkdtemp(prefix="codecrafter-bench-")
+    try:
+        with fake_llms(args.latency, args.tokens_per_second, args.response_tokens), \
+                github_stub(file_count=args.pr_files, latency=args.github_latency) as stub:
+            api = GitHubAPI(token="benchmark", base_url=stub.base_url, cache=ETagCache())
+
+            def review_pr(i):
+                pr = api.get_pull_request("bench", "repo", 1)
+                files = api.get_pull_request_files("bench", "repo", 1)
+                review = generate_pr_review("bench/repo", 1, pr["title"], pr["body"], files)
+                comments, unmapped = build_review_comments(extract_line_comments(review), files)
+                api.submit_pull_request_review("bench", "repo", 1, pr["head"]["sha"], comments)
+
+            for name in names:
+                cache = FileReviewCache(os.path.join(directory, f"{name}.sqlite")) if name == "pr_review_incremental" else None
+                with review_cache_override(cache):
+                    # Warm-up fills the review cache, so incremental runs measure unchanged files
+                    results.append(measure(name, review_pr, args.iterations, args.concurrency))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+WORDS = [
+    "parse", "sort", "merge", "cache", "fetch", "token", "index", "vector", "matrix", "graph", "node", "edge",
+    "queue", "stack", "heap", "tree", "hash", "string", "buffer", "stream", "file", "path", "user", "order",
+    "price", "total", "count", "filter", "reduce", "search", "binary", "linear", "request", "response", "json",
+    "csv", "date", "time", "retry", "limit", "window", "batch", "chunk", "split", "join", "format", "validate",
+]
+
+def make_snippet(rng, i):
+    """A synthetic snippet: a small function built from random identifiers."""
+    words = rng.sample(WORDS, 4)
+    name = "_".join(words[:2])
+    code = (
+        f"def {name}_{i}({words[2]}, {words[3]}):\n"
+        f"    \"\"\"{words[0].title()} the {words[2]} by {words[3]}.\"\"\"\n"
+        f"    return [{words[1]}({words[2]}) for item in {words[3]}]\n"
+    )
+    metadata = {
+        "language": rng.choice(["Python", "JavaScript", "Java"]),
+        "task": f"{words[0]} {words[1]} of {words[2]} with {words[3]}",
+        "timestamp": 1700000000 + i
+    }
+    return f"bench-{i}", code, metadata
+
+def run_vector_store_benchmarks(args):
+    """Insert `size` snippets into a fresh store, then time keyword and similarity searches."""
+    from utils.simple_vector_store import SimpleVectorStore
+
+    results = []
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.sample(WORDS, 2)) for _ in range(args.queries)]
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix="codecrafter-bench-")
+        store = None
+        try:
+            path = os.path.join(directory, "snippets.json")
+            # The synthetic snippets share one template, so dedup would merge many of them
+            store = SimpleVectorStore(path, path + ".log", shared=False, dedup=args.dedup)
+            snippets = [make_snippet(rng, i) for i in range(size)]
+            batch = min(args.insert_batch, size)
+            batches = [snippets[i:i + batch] for i in range(0, size, batch)]
+            results.append(measure(
+                f"vector_store insert n={size} (per {batch})",
+                lambda i: store.add_snippets(batches[i]),
+                len(batches), warmup=0, units=batch
+            ))
+            results.append(measure(
+                f"vector_store search_snippets n={size}",
+                lambda i: store.search_snippets(queries[i % len(queries)]),
+                args.queries
+            ))
+            results.append(measure(
+                f"vector_store search_similar n={size}",
+                lambda i: store.search_similar(queries[i % len(queries)]),
+                args.queries
+            ))
+        finally:
+            if store is not None:
+                store.journal.close()
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def run_service_benchmarks(args):
+    """Load the HTTP service in-process with concurrent generate_code requests, plain and streamed."""
+    import asyncio
+    import threading
+    import http.client
+    from utils.service import CodeCrafterService
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    service = asyncio.run_coroutine_threadsafe(
+        CodeCrafterService(args.service_workers, args.service_queue).start("127.0.0.1", 0), loop
+    ).result()
+    local = threading.local()
+    rejected = []
+
+    def call(i, stream):
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=60)
+        body = json.dumps({"language": "Python", "task": f"returns the {i}th Fibonacci number", "stream": stream})
+        connection.request("POST", "/v1/generate_code", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        if response.status == 503:
+            rejected.append(i)
+
+    results = []
+    try:
+        with fake_llms(args.latency, args.tokens_per_second, args.response_tokens):
+            for stream in (False, True):
+                rejected.clear()
+                name = f"service generate_code{' stream' if stream else ''} c={args.concurrency}"
+                result = measure(name, lambda i: call(i, stream), args.iterations, args.concurrency)
+                if rejected:
+                    result["name"] += f" ({len(rejected)} x 503)"
+                results.append(result)
+    finally:
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+    return results
+
+def run_review_queue_benchmark(args):
+    """
+    Push to pull requests on the GitHub stub in bursts, with a signed webhook
+    per push, and time from each PR's last push to its posted review.
+
+    Fails if a PR is not reviewed exactly once, at its last head.
+    """
+    import hmac
+    import hashlib
+    import http.client
+    from utils.github_api import GitHubAPI, ETagCache
+    from utils.review_queue import ReviewQueue, ReviewWorkers, WebhookReceiver
+
+    secret = "benchmark"
+    directory = tempfile.mkdtemp(prefix="codecrafter-bench-")
+    try:
+        with fake_llms(args.latency, args.tokens_per_second, args.response_tokens), \
+                github_stub(file_count=args.pr_files, latency=args.github_latency) as stub, \
+                review_cache_override(None):
+            queue = ReviewQueue(os.path.join(directory, "queue.sqlite"), per_repo=0)
+            receiver = WebhookReceiver(queue, "127.0.0.1", 0, secret=secret, debounce=args.review_debounce).start()
+            workers = ReviewWorkers(
+                queue, args.review_workers, post=True, poll_interval=0.05,
+                github_api=lambda: GitHubAPI(token="benchmark", base_url=stub.base_url, cache=ETagCache())
+            ).start()
+            host, port = receiver.server.server_address[:2]
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+
+            def deliver(pr_number, head_sha):
+                body = json.dumps({
+                    "action": "synchronize",
+                    "number": pr_number,
+                    "pull_request": {"number": pr_number, "state": "open", "draft": False, "head": {"sha": head_sha}},
+                    "repository": {"name": "repo", "owner": {"login": "bench"}}
+                }).encode("utf-8")
+                signature = "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+                connection.request("POST", "/webhook", body, {
+                    "X-GitHub-Event": "pull_request", "X-Hub-Signature-256": signature,
+                    "Content-Type": "application/json"
+                })
+                response = connection.getresponse()
+                response.read()
+                if response.status != 202:
+                    raise RuntimeError(f"Webhook rejected: {response.status}")
+
+            started = time.perf_counter()
+            last_push = {}
+            for _ in range(args.review_pushes):
+                for pr_number in range(1, args.review_prs + 1):
+                    deliver(pr_number, stub.push(pr_number))
+                    last_push[pr_number] = time.perf_counter()
+
+            reviewed = {}
+            deadline = time.perf_counter() + 120
+            while len(reviewed) < args.review_prs and time.perf_counter() < deadline:
+                for review in list(stub.reviews):
+                    pr_number = int(review["path"].rstrip("/").split("/")[-2])
+                    reviewed.setdefault(pr_number, time.perf_counter())
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - started
+            workers.stop()
+            receiver.stop()
+
+            heads = {(int(review["path"].split("/")[-2]), review["commit_id"]) for review in stub.reviews}
+            expected = {(pr_number, stub.head(pr_number)) for pr_number in range(1, args.review_prs + 1)}
+            if len(stub.reviews) != args.review_prs or heads != expected:
+                raise RuntimeError(f"Expected one review per PR at its last head, got {len(stub.reviews)} reviews")
+            stats = queue.stats()
+            queue.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    latencies = [reviewed[pr_number] - last_push[pr_number] for pr_number in reviewed]
+    result = summarize(
+        f"review_queue {args.review_prs} PRs x {args.review_pushes} pushes ({stats.get('superseded', 0)} superseded)",
+        latencies, elapsed
+    )
+    return [result]
+
+def run_test_runs_benchmark(args):
+    """
+    Run distinct generated test files against SAMPLE_CODE in sandboxes,
+    one at a time and then on --test-workers processes, with the cache off.
+    """
+    from utils.test_runner import TestRunner
+
+    items = [
+        {"code": SAMPLE_CODE, "tests": (
+            f"def test_max_{i}():\n"
+            f"    assert find_max(list(range({i + 1}))) == {i}\n"
+            f"\n"
+            f"def test_single_{i}():\n"
+            f"    assert find_max([{i}]) == {i}\n"
+        )}
+        for i in range(args.test_runs)
+    ]
+    results = []
+    for workers in sorted({1, args.test_workers}):
+        runner = TestRunner(workers=workers)
+        started = time.perf_counter()
+        runs = runner.run_many(items)
+        elapsed = time.perf_counter() - started
+        runner.executor.shutdown()
+        failed = [run for run in runs if run.status != "passed"]
+        if failed:
+            raise RuntimeError(f"Expected every test run to pass, got {failed[0].status}:\n{failed[0].output}")
+        results.append(summarize(f"test_runs workers={workers}", [run.duration for run in runs], elapsed))
+    return results
+
+def format_report(results):
+    """Format benchmark summaries as a fixed-width table."""
+    header = f"{'benchmark':<44} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'mean ms':>10} {'per s':>10}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['name']:<44} {r['count']:>6} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} "
+            f"{r['p99_ms']:>10.2f} {r['mean_ms']:>10.2f} {r['throughput_per_s'] or 0:>10.1f}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run CodeCrafter's offline benchmarks against fake LLMs and a fake GitHub server.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"Benchmarks to run (default: all): {', '.join(ALL_BENCHMARKS)}")
+    parser.add_argument("--iterations", type=int, default=20, help="Measured calls per benchmark")
+    parser.add_argument("--concurrency", type=int, default=1, help="Calls in flight at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM time to first token, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Fake LLM token rate (0 for instant)")
+    parser.add_argument("--response-tokens", type=int, default=200, help="Fake LLM response length")
+    parser.add_argument("--pr-files", type=int, default=30, help="Changed files in the fake pull request")
+    parser.add_argument("--github-latency", type=float, default=0.0, help="Added latency of the fake GitHub server")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma-separated vector store sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--insert-batch", type=int, default=1000, help="Snippets per add_snippets call")
+    parser.add_argument("--queries", type=int, default=100, help="Searches per vector store size")
+    parser.add_argument("--dedup", action="store_true", help="Merge near-duplicate snippets on insert")
+    parser.add_argument("--service-workers", type=int, default=8, help="Workers of the HTTP service benchmark")
+    parser.add_argument("--service-queue", type=int, default=64, help="Queue size of the HTTP service benchmark")
+    parser.add_argument("--review-prs", type=int, default=10, help="Pull requests in the review queue benchmark")
+    parser.add_argument("--review-pushes", type=int, default=5, help="Pushes (webhooks) per pull request")
+    parser.add_argument("--review-workers", type=int, default=4, help="Review queue workers")
+    parser.add_argument("--review-debounce", type=float, default=0.2, help="Review queue debounce, in seconds")
+    parser.add_argument("--test-runs", type=int, default=16, help="Generated test files in the test runs benchmark")
+    parser.add_argument("--test-workers", type=int, default=os.cpu_count() or 2, help="Sandboxed test runs at once")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic snippets and queries")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    unknown = [name for name in args.benchmarks if name not in ALL_BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    names = args.benchmarks or ALL_BENCHMARKS
+    results = []
+    llm_names = [name for name in names if name in LLM_BENCHMARKS]
+    if llm_names:
+        results += run_llm_benchmarks(llm_names, args)
+    pr_names = [name for name in names if name in PR_BENCHMARKS]
+    if pr_names:
+        results += run_pr_benchmarks(pr_names, args)
+    if "vector_store" in names:
+        results += run_vector_store_benchmarks(args)
+    if "service" in names:
+        results += run_service_benchmarks(args)
+    if "review_queue" in names:
+        results += run_review_queue_benchmark(args)
+    if "test_runs" in names:
+        results += run_test_runs_benchmark(args)
+
+    print(format_report(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k != "json"}, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,37 @@
 # utils/agents.py
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_openai_tools_agent
+import re
+import asyncio
+import contextvars
+from functools import partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.tools import tool
-from utils.config import OPENAI_API_KEY
+from utils.config import AGENT_VERBOSE, AGENT_TOOL_WORKERS
+from utils.model_router import task_llm
+from utils.background_jobs import run_async
+from utils.metrics import tracked
 
-# Initialize the LLM for agents
-llm = ChatOpenAI(api_key=OPENAI_API_KEY, temperature=0.2)
+# LLM settings for agents; the client itself is created on first use
+TEMPERATURE = 0.2
+
+def get_agent_llm():
+    """Get the shared chat model of the agent's tier, used by the agent and its tools."""
+    return task_llm("agent", TEMPERATURE, chat=True)
+
+def user_request(instructions):
+    """Format the user's own request as a line of a tool prompt."""
+    return f"User request: {instructions}" if instructions else ""
 
 # Tool for bug detection and fixing
 @tool
-def detect_and_fix_bugs(code: str, language: str) -> str:
+def detect_and_fix_bugs(code: str, language: str, instructions: str = "") -> str:
     """
     Detect bugs in the code and provide fixes.
     
     Args:
         code: The source code to analyze
         language: The programming language of the code
+        instructions: Optional extra instructions from the user
     
     Returns:
         A string with bug analysis and fixed code
@@ -28,24 +43,26 @@ def detect_and_fix_bugs(code: str, language: str) -> str:
     - Identify potential runtime errors
     - Provide fixed code
     
+    {user_request(instructions)}
     Code:
     {code}
     
     Analysis and fixed code:
     """
     
-    response = llm.invoke(prompt)
+    response = get_agent_llm().invoke(prompt)
     return response.content
 
 # Tool for code optimization
 @tool
-def optimize_code(code: str, language: str) -> str:
+def optimize_code(code: str, language: str, instructions: str = "") -> str:
     """
     Optimize the code for performance, security, and readability.
     
     Args:
         code: The source code to optimize
         language: The programming language of the code
+        instructions: Optional extra instructions from the user
     
     Returns:
         A string with optimization suggestions and optimized code
@@ -60,24 +77,26 @@ def optimize_code(code: str, language: str) -> str:
     1. Optimization suggestions
     2. Optimized code
     
+    {user_request(instructions)}
     Code:
     {code}
     
     Optimization analysis and optimized code:
     """
     
-    response = llm.invoke(prompt)
+    response = get_agent_llm().invoke(prompt)
     return response.content
 
 # Tool for auto-documentation
 @tool
-def generate_documentation(code: str, language: str) -> str:
+def generate_documentation(code: str, language: str, instructions: str = "") -> str:
     """
     Generate documentation for the code including docstrings, comments, and markdown.
     
     Args:
         code: The source code to document
         language: The programming language of the code
+        instructions: Optional extra instructions from the user
     
     Returns:
         A string with documented code and markdown documentation
@@ -92,20 +111,41 @@ def generate_documentation(code: str, language: str) -> str:
        - Parameters and return values
        - Examples
     
+    {user_request(instructions)}
     Code:
     {code}
     
     Documented code and markdown documentation:
     """
     
-    response = llm.invoke(prompt)
+    response = get_agent_llm().invoke(prompt)
     return response.content
 
+# Bounded pool that runs the agent's tool calls, shared by every agent run
+tool_executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix="codecrafter-agent-tool")
+
+def with_async(agent_tool):
+    """
+    Give a tool a coroutine that runs it on the tool pool.
+    
+    The agent executor's async path gathers every tool call of a turn, so
+    a request that needs several tools waits for the slowest one rather
+    than for all of them in turn.
+    """
+    async def run(**kwargs):
+        loop = asyncio.get_running_loop()
+        # Executor threads do not inherit context variables, such as the metrics feature
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(tool_executor, partial(context.run, agent_tool.func, **kwargs))
+    
+    agent_tool.coroutine = run
+    return agent_tool
+
 # List of tools
 tools = [
-    detect_and_fix_bugs,
-    optimize_code,
-    generate_documentation
+    with_async(detect_and_fix_bugs),
+    with_async(optimize_code),
+    with_async(generate_documentation)
 ]
 
 # Create the prompt template for the agent
@@ -115,24 +155,62 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="agent_scratchpad"),
 ])
 
-# Create the agent
-agent = create_openai_tools_agent(llm, tools, prompt)
+@lru_cache(maxsize=None)
+def get_agent_executor():
+    """Create the agent and its executor on first use; set AGENT_VERBOSE to trace its steps on the console."""
+    from langchain.agents import AgentExecutor, create_openai_tools_agent
+    
+    agent = create_openai_tools_agent(get_agent_llm(), tools, prompt)
+    return AgentExecutor(agent=agent, tools=tools, verbose=AGENT_VERBOSE)
+
+tools_by_name = {t.name: t for t in tools}
+
+# Word prefixes that identify which single tool a free-form request is for
+INTENT_KEYWORDS = {
+    "detect_and_fix_bugs": ["bug", "fix", "error", "crash", "broken", "wrong", "fail", "exception", "debug", "incorrect"],
+    "optimize_code": ["optimi", "faster", "speed", "perform", "efficien", "slow", "refactor", "readab", "secur", "complexity"],
+    "generate_documentation": ["document", "docstring", "comment", "readme", "markdown", "usage", "docs"],
+}
 
-# Create the agent executor
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+def classify_intent(input_text):
+    """
+    Pick the tool a request asks for with a keyword match, without calling the LLM.
+    
+    Returns:
+        The tool name, or None when the request matches no tool or several
+    """
+    words = re.findall(r"[a-z]+", input_text.lower())
+    scores = {
+        name: sum(1 for word in words if any(word.startswith(keyword) for keyword in keywords))
+        for name, keywords in INTENT_KEYWORDS.items()
+    }
+    matched = [name for name, score in scores.items() if score > 0]
+    return matched[0] if len(matched) == 1 else None
 
-def run_agent(input_text, code, language):
+def run_agent(input_text, code, language, tool=None):
     """
     Run the agent with the given input, code, and language.
     
+    Requests for a single tool call that tool directly, which saves the
+    agent's planning and summarizing LLM calls. Only requests that the
+    keyword classifier cannot route go through the full agent, which runs
+    the tool calls of each turn concurrently.
+    
     Args:
         input_text: The user's request
         code: The code to analyze
         language: The programming language
+        tool: Name of the tool to use, when the caller already knows it
     
     Returns:
         The agent's response
     """
+    tool = tool or classify_intent(input_text)
+    if tool is not None:
+        with tracked(f"agent:{tool}"):
+            return tools_by_name[tool].invoke({"code": code, "language": language, "instructions": input_text})
+    
     formatted_input = f"{input_text}\n\nCode:\n{code}\n\nLanguage: {language}"
-    response = agent_executor.invoke({"input": formatted_input})
-    return response["output"]
\ No newline at end of file
+    with tracked("agent"):
+        response = run_async(get_agent_executor().ainvoke({"input": formatted_input}))
+    return response["output"]
@@ -0,0 +1,112 @@
+# utils/background_jobs.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.config import PREFETCH_WORKERS
+from utils.model_router import Restart
+
+# Process-wide pool shared by every session, so prefetching cannot exhaust threads
+executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="codecrafter-prefetch")
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """Return the process-wide event loop, started on a daemon thread on first use."""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="codecrafter-event-loop", daemon=True).start()
+        return _event_loop
+
+def run_async(coro, timeout=None):
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+
+    Async clients keep connections bound to the loop they were opened on,
+    so every coroutine that uses them runs on this one loop rather than a
+    fresh asyncio.run() loop per call.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+class Job:
+    """
+    A background call whose partial output can be read while it runs.
+
+    Streaming jobs append each chunk to `chunks`, so a tab can render the
+    text so far and pick up the rest on a later poll. When a stream restarts
+    with a stronger model's response, `chunks` starts over and `restarts`
+    goes up, so readers know to drop what they rendered.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.chunks = []
+        self.restarts = 0
+        self.future = None
+        self.cancelled = threading.Event()
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """Wait for the job and return its full text."""
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """Stop the job: queued jobs never start, running streams stop at the next chunk."""
+        self.cancelled.set()
+        self.future.cancel()
+
+class JobGroup:
+    """The set of speculative jobs started for one piece of generated code."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def get(self, name):
+        return self.jobs.get(name)
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in the background and keep its result as the job text."""
+        job = Job(name)
+
+        def run():
+            if job.cancelled.is_set():
+                return ""
+            result = fn(*args, **kwargs)
+            job.chunks.append(result)
+            return result
+
+        job.future = executor.submit(run)
+        self.jobs[name] = job
+        return job
+
+    def submit_stream(self, name, stream_fn, *args, **kwargs):
+        """Consume the generator returned by `stream_fn(*args, **kwargs)` in the background."""
+        job = Job(name)
+
+        def run():
+            for chunk in stream_fn(*args, **kwargs):
+                if job.cancelled.is_set():
+                    break
+                if isinstance(chunk, Restart):
+                    job.chunks = []
+                    job.restarts += 1
+                    continue
+                job.chunks.append(chunk)
+            return job.text
+
+        job.future = executor.submit(run)
+        self.jobs[name] = job
+        return job
+
+    def cancel(self):
+        """Cancel every job in the group."""
+        for job in self.jobs.values():
+            job.cancel()
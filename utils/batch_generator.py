@@ -0,0 +1,131 @@
+# utils/batch_generator.py
+import os
+import json
+import time
+import uuid
+import argparse
+from utils.code_generator import get_code_chain
+from utils.simple_vector_store import get_vector_store
+from utils.metrics import instrumented
+
+def read_tasks(path):
+    """
+    Read {language, task} items from a JSONL file.
+
+    Returns:
+        A list of (line_number, item) tuples
+    """
+    tasks = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("language") or not item.get("task"):
+                raise ValueError(f"Line {line_number}: each item needs a 'language' and a 'task'")
+            tasks.append((line_number, item))
+    return tasks
+
+def load_checkpoint(path):
+    """Return the input line numbers that a previous run already stored."""
+    done = set()
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["line"])
+                except (ValueError, KeyError):
+                    # A torn final line from an interrupted run
+                    break
+    return done
+
+@instrumented("batch_generation")
+def generate_code_batch(items, max_concurrency=8):
+    """
+    Generate code for many {language, task} items concurrently.
+
+    Yields:
+        (index, result) tuples in completion order, where result is the
+        generated code or the exception that the item failed with
+    """
+    inputs = [{"language": item["language"], "task": item["task"]} for item in items]
+    return get_code_chain().batch_as_completed(
+        inputs,
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True
+    )
+
+def run_batch(input_path, checkpoint_path=None, max_concurrency=8, flush_every=50, store=None):
+    """
+    Generate code for every task in a JSONL file and store the results.
+
+    Up to `max_concurrency` requests are in flight at any time. Results are
+    written to the store and the checkpoint in groups of `flush_every`, so
+    an interrupted run can be resumed without regenerating stored items.
+    The store is compacted once at the end.
+
+    Returns:
+        A dict with total, skipped, succeeded and failed counts
+    """
+    if store is None:
+        store = get_vector_store()
+    checkpoint_path = checkpoint_path or input_path + ".checkpoint"
+    tasks = read_tasks(input_path)
+    done = load_checkpoint(checkpoint_path)
+    pending = [(line_number, item) for line_number, item in tasks if line_number not in done]
+    stats = {"total": len(tasks), "skipped": len(tasks) - len(pending), "succeeded": 0, "failed": 0}
+
+    snippets = []
+    entries = []
+    with open(checkpoint_path, 'a') as checkpoint:
+        def flush():
+            store.add_snippets(snippets)
+            store.journal.flush()
+            # Only mark items done once the store has them on disk
+            checkpoint.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            snippets.clear()
+            entries.clear()
+
+        started = time.time()
+        for index, result in generate_code_batch([item for _, item in pending], max_concurrency):
+            line_number, item = pending[index]
+            if isinstance(result, Exception):
+                stats["failed"] += 1
+                print(f"Line {line_number}: generation failed: {result}")
+                continue
+
+            snippet_id = str(uuid.uuid4())
+            snippets.append((snippet_id, result, {
+                "language": item["language"],
+                "task": item["task"],
+                "timestamp": time.time()
+            }))
+            entries.append({"line": line_number, "snippet_id": snippet_id})
+            stats["succeeded"] += 1
+
+            if len(snippets) >= flush_every:
+                flush()
+                processed = stats["succeeded"] + stats["failed"]
+                print(f"{processed}/{len(pending)} done ({processed / (time.time() - started):.1f} tasks/s)")
+        flush()
+
+    store.save_snippets()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate code for a JSONL file of {language, task} items.")
+    parser.add_argument("input", help="JSONL file with one {\"language\": ..., \"task\": ...} object per line")
+    parser.add_argument("--checkpoint", help="Checkpoint file used to resume (default: <input>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of requests in flight")
+    parser.add_argument("--flush-every", type=int, default=50, help="Store results in groups of this size")
+    args = parser.parse_args()
+
+    stats = run_batch(args.input, args.checkpoint, args.concurrency, args.flush_every)
+    print(f"Done: {stats['succeeded']} generated, {stats['failed']} failed, "
+          f"{stats['skipped']} skipped from a previous run ({stats['total']} total)")
+
+if __name__ == "__main__":
+    main()
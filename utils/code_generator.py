@@ -1,10 +1,12 @@
 # utils/code_generator.py
-from langchain_openai import OpenAI
-from langchain.prompts import PromptTemplate
-from utils.config import OPENAI_API_KEY
+from functools import lru_cache
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from utils.model_router import invoke_routed, stream_routed, task_llm, python_parses
+from utils.metrics import instrumented
 
-# Initialize the LLM
-llm = OpenAI(api_key=OPENAI_API_KEY, temperature=0.5)
+# LLM settings; the client itself is created on first use
+TEMPERATURE = 0.5
 
 # Create a prompt template for code generation
 code_template = """
@@ -21,11 +23,23 @@ code_prompt = PromptTemplate(
     template=code_template
 )
 
-# Create the chain using the new pipe operator syntax
-code_chain = code_prompt | llm
+def code_validator(language):
+    """The check generated code must pass to avoid escalation; only Python can be checked cheaply."""
+    return python_parses if language.strip().lower() == "python" else None
 
+@lru_cache(maxsize=None)
+def get_code_chain():
+    """Create the chain on the task's model tier, on first use; batches use it without per-call routing."""
+    return code_prompt | task_llm("code_generation", TEMPERATURE) | StrOutputParser()
+
+@instrumented("code_generation")
 def generate_code(language, task):
     """Generate code based on the task and language."""
-    # Format the prompt and invoke the chain
-    result = code_chain.invoke({"language": language, "task": task})
-    return result
\ No newline at end of file
+    inputs = {"language": language, "task": task}
+    return invoke_routed("code_generation", code_prompt, inputs, TEMPERATURE, validate=code_validator(language))
+
+@instrumented("code_generation")
+def stream_code(language, task):
+    """Generate code based on the task and language, yielding text chunks as they arrive."""
+    inputs = {"language": language, "task": task}
+    return stream_routed("code_generation", code_prompt, inputs, TEMPERATURE, validate=code_validator(language))
\ No newline at end of file
@@ -1,21 +1,206 @@
 # utils/config.py
 import os
-import streamlit as st
+from functools import lru_cache
 
-# Get OpenAI API key from environment or secrets
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY", "")
+def get_secret(name):
+    """Read a secret from the environment, falling back to Streamlit secrets."""
+    value = os.environ.get(name)
+    if value:
+        return value
+    import streamlit as st
+    try:
+        return st.secrets.get(name, "")
+    except Exception:
+        # No secrets.toml, e.g. when running outside Streamlit
+        return ""
 
-# Get GitHub token from environment or secrets
-GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN") or st.secrets.get("GITHUB_TOKEN", "")
+@lru_cache(maxsize=None)
+def get_openai_api_key():
+    """Get the OpenAI API key from environment or secrets, stopping the app if it is missing."""
+    key = get_secret("OPENAI_API_KEY")
+    if not key:
+        import streamlit as st
+        st.error("OpenAI API key not found. Please set it in your Streamlit Cloud secrets or environment variables.")
+        st.stop()
+    return key
 
-# Check if OpenAI API key is set
-if not OPENAI_API_KEY:
-    st.error("OpenAI API key not found. Please set it in your Streamlit Cloud secrets or environment variables.")
-    st.stop()
+@lru_cache(maxsize=None)
+def get_github_token():
+    """Get the GitHub token from environment or secrets."""
+    return get_secret("GITHUB_TOKEN")
+
+def __getattr__(name):
+    # Secrets are read on first use rather than at import, which keeps this
+    # module cheap to import and usable outside Streamlit
+    if name == "OPENAI_API_KEY":
+        return get_openai_api_key()
+    if name == "GITHUB_TOKEN":
+        return get_github_token()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# GitHub API client settings; the ETag cache is in memory only unless GITHUB_CACHE_DIR names a
+# directory, which is created readable by the current user only since it holds private API responses
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_POOL_SIZE = int(os.environ.get("GITHUB_POOL_SIZE", "10"))
+GITHUB_CACHE_DIR = os.environ.get("GITHUB_CACHE_DIR", "")
+GITHUB_CACHE_ENTRIES = int(os.environ.get("GITHUB_CACHE_ENTRIES", "1024"))
+
+# Process-wide rate limiting for OpenAI and GitHub calls: requests per second,
+# burst size and the concurrency ceiling that adaptive throttling works under
+OPENAI_RATE_LIMIT = float(os.environ.get("OPENAI_RATE_LIMIT", "10"))
+OPENAI_RATE_BURST = int(os.environ.get("OPENAI_RATE_BURST", "20"))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "16"))
+GITHUB_RATE_LIMIT = float(os.environ.get("GITHUB_RATE_LIMIT", "10"))
+GITHUB_RATE_BURST = int(os.environ.get("GITHUB_RATE_BURST", "20"))
+# GitHub quotas are per token; calls with a token whose quota resets further off than
+# this many seconds fail with RateLimitExceededError instead of waiting for the reset
+GITHUB_RATE_LIMIT_MAX_WAIT = float(os.environ.get("GITHUB_RATE_LIMIT_MAX_WAIT", "5"))
+
+# Retries with exponential backoff, and the circuit breaker that stops calls to a failing provider
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_BACKOFF_BASE = float(os.environ.get("RATE_LIMIT_BACKOFF_BASE", "0.5"))
+RATE_LIMIT_BACKOFF_MAX = float(os.environ.get("RATE_LIMIT_BACKOFF_MAX", "30"))
+CIRCUIT_BREAKER_FAILURES = int(os.environ.get("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET = float(os.environ.get("CIRCUIT_BREAKER_RESET", "30"))
 
 # Simple vector store settings - use /tmp for Streamlit Cloud
 VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", "/tmp/codecrafter_snippets.json")
 
+# Append-only journal next to the snapshot; compacted into it in the background
+VECTOR_STORE_LOG_PATH = os.environ.get("VECTOR_STORE_LOG_PATH", VECTOR_STORE_PATH + ".log")
+VECTOR_STORE_FSYNC_BATCH = int(os.environ.get("VECTOR_STORE_FSYNC_BATCH", "32"))
+VECTOR_STORE_FSYNC_INTERVAL = float(os.environ.get("VECTOR_STORE_FSYNC_INTERVAL", "1.0"))
+VECTOR_STORE_COMPACT_EVERY = int(os.environ.get("VECTOR_STORE_COMPACT_EVERY", "5000"))
+
+# Set when several processes or replicas share one VECTOR_STORE_PATH
+VECTOR_STORE_SHARED = os.environ.get("VECTOR_STORE_SHARED", "").lower() in ("1", "true", "yes")
+
+# Keep only metadata in memory and the code compressed in a memory-mapped
+# segment file next to the snapshot. Once a store has been compacted in this
+# mode its snapshot refers to the segment file, so keep the setting on.
+VECTOR_STORE_SEGMENTS = os.environ.get("VECTOR_STORE_SEGMENTS", "").lower() in ("1", "true", "yes")
+VECTOR_STORE_SEGMENT_PATH = os.environ.get("VECTOR_STORE_SEGMENT_PATH", VECTOR_STORE_PATH + ".segments")
+# Compaction rewrites the segment file without the code of deleted and merged
+# snippets once it makes up this fraction of the file
+VECTOR_STORE_SEGMENT_GARBAGE = float(os.environ.get("VECTOR_STORE_SEGMENT_GARBAGE", "0.3"))
+
+# Merge a new snippet into an existing one for the same task and language whose
+# code's SimHash fingerprint is at most VECTOR_STORE_DEDUP_DISTANCE bits (of 64) away
+VECTOR_STORE_DEDUP = os.environ.get("VECTOR_STORE_DEDUP", "false").lower() in ("1", "true", "yes")
+VECTOR_STORE_DEDUP_DISTANCE = int(os.environ.get("VECTOR_STORE_DEDUP_DISTANCE", "5"))
+
+# Embedding search settings: "hashing" works offline, "openai" calls the embeddings API.
+# Set EMBEDDING_INDEX_PATH to keep the embedding matrix in a memory-mapped file.
+EMBEDDER = os.environ.get("EMBEDDER", "hashing")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "256"))
+EMBEDDING_INDEX_PATH = os.environ.get("EMBEDDING_INDEX_PATH", "")
+
+# LLM response cache (SQLite file); entries expire after LLM_CACHE_TTL seconds
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "/tmp/codecrafter_llm_cache.sqlite")
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Share one result between identical LLM and GitHub calls that are in flight
+# at the same time, e.g. several sessions reviewing the same pull request
+COALESCE_CALLS = os.environ.get("COALESCE_CALLS", "true").lower() in ("1", "true", "yes")
+
+# Model routing. MODEL_TIERS lists "tier=model" pairs from cheapest to strongest;
+# models with "instruct" in their name use the completion API, the rest the chat
+# API. Each task starts on its tier in MODEL_ROUTES, moves up one tier for prompts
+# over MODEL_ROUTE_LARGE_INPUT tokens, and down while its model's recent p95
+# latency is over the task's MODEL_ROUTE_SLOS seconds. Output that fails a
+# cheap check (Python that does not parse) is regenerated up to
+# MODEL_ROUTE_MAX_ESCALATIONS tiers higher.
+MODEL_TIERS = os.environ.get("MODEL_TIERS", "fast=gpt-3.5-turbo-instruct,standard=gpt-4o-mini,strong=gpt-4o")
+MODEL_ROUTES = os.environ.get(
+    "MODEL_ROUTES", "code_generation=fast,explanation=fast,test_generation=fast,agent=standard,pr_review=standard")
+MODEL_ROUTE_LARGE_INPUT = int(os.environ.get("MODEL_ROUTE_LARGE_INPUT", "1500"))
+MODEL_ROUTE_SLOS = os.environ.get("MODEL_ROUTE_SLOS", "")
+MODEL_ROUTE_MAX_ESCALATIONS = int(os.environ.get("MODEL_ROUTE_MAX_ESCALATIONS", "1"))
+# Print every routing decision to the console; they are always counted in the metrics
+MODEL_ROUTE_LOG = os.environ.get("MODEL_ROUTE_LOG", "").lower() in ("1", "true", "yes")
+
+# Background prefetch of the analysis tabs after code generation
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+PREFETCH_AGENTS = os.environ.get("PREFETCH_AGENTS", "").lower() in ("1", "true", "yes")
+
+# Run generated Python tests against the generated code in subprocesses, each
+# limited to TEST_RUN_TIMEOUT seconds of wall time, TEST_RUN_CPU_SECONDS of CPU
+# and TEST_RUN_MEMORY_MB of address space. Outcomes are cached by content hash.
+# Runs start from the "Run tests" button. The limits contain runaway code but
+# are not a security boundary (the code can read local files and reach the
+# network), so this is off unless every user of the app is trusted.
+TEST_RUN_ENABLED = os.environ.get("TEST_RUN_ENABLED", "false").lower() in ("1", "true", "yes")
+TEST_RUN_WORKERS = int(os.environ.get("TEST_RUN_WORKERS", str(os.cpu_count() or 2)))
+TEST_RUN_TIMEOUT = float(os.environ.get("TEST_RUN_TIMEOUT", "30"))
+TEST_RUN_CPU_SECONDS = int(os.environ.get("TEST_RUN_CPU_SECONDS", "20"))
+TEST_RUN_MEMORY_MB = int(os.environ.get("TEST_RUN_MEMORY_MB", "1024"))
+TEST_RUN_CACHE_PATH = os.environ.get("TEST_RUN_CACHE_PATH", "/tmp/codecrafter_test_runs.sqlite")
+TEST_RUN_CACHE_TTL = int(os.environ.get("TEST_RUN_CACHE_TTL", str(7 * 24 * 3600)))
+
+# PR review: token budget for the file changes in one prompt, and parallel chunk reviews
+REVIEW_TOKEN_BUDGET = int(os.environ.get("REVIEW_TOKEN_BUDGET", "6000"))
+REVIEW_MAX_CONCURRENCY = int(os.environ.get("REVIEW_MAX_CONCURRENCY", "4"))
+# Unchanged lines kept around each change in review prompts (GitHub patches carry 3)
+REVIEW_DIFF_CONTEXT = int(os.environ.get("REVIEW_DIFF_CONTEXT", "2"))
+
+# Incremental re-review: per-file findings cached by repository, path and blob SHA
+REVIEW_INCREMENTAL = os.environ.get("REVIEW_INCREMENTAL", "true").lower() in ("1", "true", "yes")
+REVIEW_CACHE_PATH = os.environ.get("REVIEW_CACHE_PATH", "/tmp/codecrafter_review_cache.sqlite")
+REVIEW_CACHE_TTL = int(os.environ.get("REVIEW_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Background PR review queue fed by pull_request webhooks (python -m utils.review_queue).
+# A push waits REVIEW_QUEUE_DEBOUNCE seconds and is superseded by a newer push to the
+# same PR; higher priorities run first, with at most REVIEW_QUEUE_PER_REPO reviews of
+# one repository at a time (0 for no limit).
+REVIEW_QUEUE_PATH = os.environ.get("REVIEW_QUEUE_PATH", "/tmp/codecrafter_review_queue.sqlite")
+REVIEW_QUEUE_WORKERS = int(os.environ.get("REVIEW_QUEUE_WORKERS", "2"))
+REVIEW_QUEUE_PER_REPO = int(os.environ.get("REVIEW_QUEUE_PER_REPO", "1"))
+REVIEW_QUEUE_DEBOUNCE = float(os.environ.get("REVIEW_QUEUE_DEBOUNCE", "30"))
+REVIEW_QUEUE_PRIORITIES = os.environ.get(
+    "REVIEW_QUEUE_PRIORITIES", "opened=10,reopened=10,ready_for_review=10,synchronize=0")
+REVIEW_QUEUE_MAX_ATTEMPTS = int(os.environ.get("REVIEW_QUEUE_MAX_ATTEMPTS", "3"))
+# Seconds before a job whose worker died is picked up again; running workers renew it every third of it
+REVIEW_QUEUE_LEASE = float(os.environ.get("REVIEW_QUEUE_LEASE", "600"))
+# Post finished reviews to GitHub (with GITHUB_TOKEN); otherwise they are only kept in the queue
+REVIEW_QUEUE_POST = os.environ.get("REVIEW_QUEUE_POST", "false").lower() in ("1", "true", "yes")
+# Queue reviews from the Streamlit app and run workers inside it. Queued reviews use
+# the server's GITHUB_TOKEN, not the session's, so only enable this for trusted users.
+REVIEW_QUEUE_IN_APP = os.environ.get("REVIEW_QUEUE_IN_APP", "").lower() in ("1", "true", "yes")
+REVIEW_WEBHOOK_HOST = os.environ.get("REVIEW_WEBHOOK_HOST", "127.0.0.1")
+REVIEW_WEBHOOK_PORT = int(os.environ.get("REVIEW_WEBHOOK_PORT", "8090"))
+# Shared secret of the GitHub webhook; deliveries without a valid signature are rejected.
+# Without a secret, deliveries are only accepted when REVIEW_WEBHOOK_HOST is a loopback address.
+REVIEW_WEBHOOK_SECRET = os.environ.get("REVIEW_WEBHOOK_SECRET", "")
+
+# Print the fallback agent's intermediate steps to the console
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE", "").lower() in ("1", "true", "yes")
+
+# Tool calls the agent can run at once, across all sessions
+AGENT_TOOL_WORKERS = int(os.environ.get("AGENT_TOOL_WORKERS", "4"))
+
+# Prometheus text endpoint for the metrics registry (served at /metrics); 0 disables it.
+# Bind to 0.0.0.0 to let a scraper on another host reach it.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Show the Metrics tab with per-feature latency, tokens, cost and cache hit rates.
+# It covers every session in the process, so it is off unless the app is for admins only.
+ADMIN_VIEW = os.environ.get("ADMIN_VIEW", "false").lower() in ("1", "true", "yes")
+
+# Headless HTTP service (python -m utils.service). Requests beyond the
+# workers wait in a queue of SERVICE_QUEUE_SIZE; past that they get 503.
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "8"))
+SERVICE_QUEUE_SIZE = int(os.environ.get("SERVICE_QUEUE_SIZE", "64"))
+SERVICE_MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", str(1024 * 1024)))
+# Chunks a stream may run ahead of a slow client
+SERVICE_STREAM_BUFFER = int(os.environ.get("SERVICE_STREAM_BUFFER", "64"))
+# When set, requests need an "Authorization: Bearer <token>" header
+SERVICE_TOKEN = os.environ.get("SERVICE_TOKEN", "")
+
 # App settings
 APP_TITLE = "CodeCrafter"
 APP_ICON = "🛠️"
\ No newline at end of file
@@ -0,0 +1,303 @@
+# utils/diff_parser.py
+import re
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)")
+
+# A removed block counts as moved when runs of this many of its non-blank
+# lines were added, in the same order, somewhere else in the pull request
+MOVED_RUN_LINES = 3
+
+CONTEXT, ADDED, REMOVED, MARKER = " ", "+", "-", "\\"
+
+class DiffLine:
+    """
+    One line of a hunk.
+
+    `kind` is CONTEXT, ADDED, REMOVED or MARKER ("\\ No newline at end of
+    file"). Line numbers are None on the side a line does not exist on, and
+    `position` is the line's position in the patch, which is how GitHub
+    review comments address lines.
+    """
+
+    __slots__ = ("kind", "text", "old_line", "new_line", "position")
+
+    def __init__(self, kind, text, old_line, new_line, position):
+        self.kind = kind
+        self.text = text
+        self.old_line = old_line
+        self.new_line = new_line
+        self.position = position
+
+    @property
+    def changed(self):
+        return self.kind in (ADDED, REMOVED)
+
+class Hunk:
+    """A hunk of a unified diff: its header ranges, the section heading after them and its lines."""
+
+    __slots__ = ("old_start", "old_count", "new_start", "new_count", "section", "lines")
+
+    def __init__(self, old_start, old_count, new_start, new_count, section=""):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.section = section
+        self.lines = []
+
+    @property
+    def header(self):
+        return format_hunk_header(self.old_start, self.old_count, self.new_start, self.new_count, self.section)
+
+def format_hunk_header(old_start, old_count, new_start, new_count, section=""):
+    header = f"@@ -{old_start},{old_count} +{new_start},{new_count} @@"
+    return f"{header} {section}" if section else header
+
+def parse_patch(patch):
+    """
+    Parse a file's unified diff, as in the `patch` field GitHub returns, into hunks.
+
+    Positions follow GitHub: position 1 is the line just below the first
+    hunk header, and every following line counts, including later hunk
+    headers. Lines before the first hunk header are ignored.
+
+    Returns:
+        A list of Hunk objects
+    """
+    lines = (patch or "").split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+
+    hunks = []
+    position = 0
+    old_line = new_line = None
+    for line in lines:
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            if hunks:
+                position += 1
+            old_line, new_line = int(match.group(1)), int(match.group(3))
+            hunks.append(Hunk(
+                old_line, int(match.group(2) or 1), new_line, int(match.group(4) or 1), match.group(5).strip()
+            ))
+            continue
+        if not hunks:
+            continue
+        position += 1
+        kind = line[:1] or CONTEXT
+        if kind == ADDED:
+            hunks[-1].lines.append(DiffLine(ADDED, line[1:], None, new_line, position))
+            new_line += 1
+        elif kind == REMOVED:
+            hunks[-1].lines.append(DiffLine(REMOVED, line[1:], old_line, None, position))
+            old_line += 1
+        elif kind == MARKER:
+            hunks[-1].lines.append(DiffLine(MARKER, line, None, None, position))
+        else:
+            # An empty line is a context line whose leading space was stripped
+            hunks[-1].lines.append(DiffLine(CONTEXT, line[1:], old_line, new_line, position))
+            old_line += 1
+            new_line += 1
+    return hunks
+
+def start_before(hunk, index, side):
+    """
+    Header start for lines that have no line numbers on `side` ("old" or
+    "new"): the line after the last one before them, as in unified diffs.
+    """
+    for line in reversed(hunk.lines[:index]):
+        number = getattr(line, f"{side}_line")
+        if number is not None:
+            return number + 1
+    return getattr(hunk, f"{side}_start")
+
+class FileDiff:
+    """A changed file's hunks, with its new-file and old-file line maps."""
+
+    def __init__(self, filename, patch):
+        self.filename = filename
+        self.hunks = parse_patch(patch)
+        self.new_lines = {}
+        self.old_lines = {}
+        for hunk in self.hunks:
+            for line in hunk.lines:
+                if line.new_line is not None:
+                    self.new_lines[line.new_line] = line
+                if line.old_line is not None:
+                    self.old_lines[line.old_line] = line
+
+def normalize_path(path):
+    """Strip the quoting and diff prefixes models tend to put around a path."""
+    path = path.strip().strip("`'\"*").strip()
+    for prefix in ("a/", "b/", "./"):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    return path.rstrip(":.,")
+
+class DiffIndex:
+    """
+    Index of a pull request's diff: every file's hunks and line maps.
+
+    Used to build compact prompts (changed hunks plus a few lines of
+    context) and to check that a review comment points at a line the diff
+    actually shows.
+
+    Args:
+        files: Changed files as returned by the pull request files endpoint
+    """
+
+    def __init__(self, files):
+        self.files = {file["filename"]: FileDiff(file["filename"], file.get("patch")) for file in files}
+        self._moved = None
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def resolve(self, path):
+        """
+        Match a path from a review to a changed file.
+
+        Tries the path as given, without quoting and a/ or b/ prefixes,
+        then as a unique suffix of a changed file's path, so that a bare
+        file name still resolves.
+
+        Returns:
+            The changed file's path, or None
+        """
+        if path in self.files:
+            return path
+        path = normalize_path(path)
+        if path in self.files:
+            return path
+        matches = [filename for filename in self.files if filename.endswith("/" + path)]
+        return matches[0] if len(matches) == 1 else None
+
+    def locate(self, path, line):
+        """
+        Find a new-file line in the diff.
+
+        Returns:
+            A (path, DiffLine) tuple, or None when the file did not change or
+            the line is outside its hunks
+        """
+        filename = self.resolve(path)
+        if filename is None:
+            return None
+        diff_line = self.files[filename].new_lines.get(line)
+        return (filename, diff_line) if diff_line is not None else None
+
+    def moved_lines(self):
+        """
+        Find removed lines that were added back elsewhere in the pull request.
+
+        A removed line counts as moved when it starts or continues a run of
+        MOVED_RUN_LINES non-blank removed lines that also appear, in order
+        and ignoring indentation, among consecutive added lines.
+
+        Returns:
+            A dict mapping (path, old line number) to the (path, new line
+            number) it moved to
+        """
+        if self._moved is not None:
+            return self._moved
+
+        def runs(kind):
+            # Maximal blocks of consecutive lines of one kind, without blank lines
+            for filename, file_diff in self.files.items():
+                for hunk in file_diff.hunks:
+                    block = []
+                    for line in hunk.lines + [None]:
+                        if line is not None and line.kind == kind:
+                            if line.text.strip():
+                                block.append(line)
+                        elif line is None or line.kind != MARKER:
+                            if len(block) >= MOVED_RUN_LINES:
+                                yield filename, block
+                            block = []
+
+        targets = {}
+        for filename, block in runs(ADDED):
+            for i in range(len(block) - MOVED_RUN_LINES + 1):
+                key = tuple(line.text.strip() for line in block[i:i + MOVED_RUN_LINES])
+                targets.setdefault(key, (filename, block[i].new_line))
+
+        moved = {}
+        for filename, block in runs(REMOVED):
+            for i in range(len(block) - MOVED_RUN_LINES + 1):
+                target = targets.get(tuple(line.text.strip() for line in block[i:i + MOVED_RUN_LINES]))
+                if target is None:
+                    continue
+                target_file, target_line = target
+                for offset, line in enumerate(block[i:i + MOVED_RUN_LINES]):
+                    moved.setdefault((filename, line.old_line), (target_file, target_line + offset))
+        self._moved = moved
+        return moved
+
+    def format_file(self, path, context=3):
+        """
+        Format a file's changes compactly for a prompt.
+
+        Keeps every added and removed line, but only `context` unchanged
+        lines around them, splitting hunks where more context is left out.
+        Added and unchanged lines start with their new-file line number so
+        that comments can cite it; removed lines have none. Removed blocks
+        that were moved elsewhere in the pull request are shown as one note.
+
+        Returns:
+            The formatted hunks, or "" when the file has no patch
+        """
+        file_diff = self.files[path]
+        moved = self.moved_lines()
+        output = []
+        for hunk in file_diff.hunks:
+            lines = hunk.lines
+            changed = [i for i, line in enumerate(lines) if line.changed]
+            keep = set()
+            for i in changed:
+                keep.update(range(max(0, i - context), min(len(lines), i + context + 1)))
+            for i, line in enumerate(lines):
+                # "\ No newline at end of file" belongs to the line above it
+                if line.kind == MARKER and i - 1 in keep:
+                    keep.add(i)
+
+            kept = sorted(keep)
+            groups = []
+            for i in kept:
+                if groups and i == groups[-1][-1] + 1:
+                    groups[-1].append(i)
+                else:
+                    groups.append([i])
+
+            for group in groups:
+                group_lines = [lines[i] for i in group]
+                old_numbers = [line.old_line for line in group_lines if line.old_line is not None]
+                new_numbers = [line.new_line for line in group_lines if line.new_line is not None]
+                old_start = old_numbers[0] if old_numbers else start_before(hunk, group[0], "old")
+                new_start = new_numbers[0] if new_numbers else start_before(hunk, group[0], "new")
+                output.append(format_hunk_header(
+                    old_start, len(old_numbers), new_start, len(new_numbers), hunk.section
+                ))
+                pending_move = []
+                for line in group_lines + [None]:
+                    target = moved.get((path, line.old_line)) if line is not None and line.kind == REMOVED else None
+                    if target is not None:
+                        pending_move.append(target)
+                        continue
+                    if pending_move and line is not None and line.kind == REMOVED and not line.text.strip():
+                        # Blank lines between moved blocks go into the same note
+                        pending_move.append(None)
+                        continue
+                    if pending_move:
+                        target_file, target_line = pending_move[0]
+                        # Worded unlike "File: <path>, Line: <n>" so it is not taken for a review comment
+                        output.append(f"-[{len(pending_move)} removed lines moved to {target_file} line {target_line}]")
+                        pending_move = []
+                    if line is None:
+                        break
+                    if line.kind == MARKER:
+                        output.append(line.text)
+                    elif line.kind == REMOVED:
+                        output.append(f"-{line.text}")
+                    else:
+                        output.append(f"{line.new_line} {line.kind}{line.text}")
+        return "\n".join(output)
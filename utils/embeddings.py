@@ -0,0 +1,86 @@
+# utils/embeddings.py
+import math
+import zlib
+from collections import Counter
+import numpy as np
+from utils.snippet_index import tokenize
+
+class HashingEmbedder:
+    """
+    Offline embedder using the hashing trick over TF-weighted terms.
+
+    Unigrams and bigrams of the search tokens are hashed into `dim` signed
+    buckets with sublinear term frequency, then L2-normalised. It needs no
+    network or model download, and identical text always maps to the same
+    vector.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _features(self, text):
+        tokens = tokenize(text)
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def embed_query(self, text):
+        """Embed a single text as a normalised float32 vector."""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in self._features(text).items():
+            digest = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dim] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_documents(self, texts):
+        """Embed several texts into an (n, dim) float32 matrix."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self.embed_query(text)
+        return matrix
+
+class OpenAIEmbedder:
+    """Embedder backed by the OpenAI embeddings API."""
+
+    name = "openai"
+
+    def __init__(self, dim=256, model="text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+        from utils.config import get_openai_api_key
+        from utils.rate_limiter import get_openai_http_client
+
+        self.dim = dim
+        self.client = OpenAIEmbeddings(
+            api_key=get_openai_api_key(), model=model, dimensions=dim,
+            http_client=get_openai_http_client(), max_retries=0
+        )
+
+    def _normalize(self, matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_query(self, text):
+        vector = np.asarray([self.client.embed_query(text)], dtype=np.float32)
+        return self._normalize(vector)[0]
+
+    def embed_documents(self, texts):
+        matrix = np.asarray(self.client.embed_documents(list(texts)), dtype=np.float32)
+        return self._normalize(matrix.reshape(len(texts), self.dim))
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "openai": OpenAIEmbedder
+}
+
+def get_embedder(name="hashing", dim=256):
+    """Create an embedder by name."""
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder: {name}. Expected one of {', '.join(EMBEDDERS)}")
+    return EMBEDDERS[name](dim=dim)
@@ -1,10 +1,10 @@
 # utils/explainer.py
-from langchain_openai import OpenAI
-from langchain.prompts import PromptTemplate
-from utils.config import OPENAI_API_KEY
+from langchain_core.prompts import PromptTemplate
+from utils.model_router import invoke_routed, stream_routed, not_empty
+from utils.metrics import instrumented
 
-# Initialize the LLM
-llm = OpenAI(api_key=OPENAI_API_KEY, temperature=0.3)
+# LLM settings; the client itself is created on first use
+TEMPERATURE = 0.3
 
 # Create a prompt template for code explanation
 explanation_template = """
@@ -24,10 +24,12 @@ explanation_prompt = PromptTemplate(
     template=explanation_template
 )
 
-# Create the chain using the pipe operator
-explanation_chain = explanation_prompt | llm
-
+@instrumented("explanation")
 def explain_code(code):
     """Generate an explanation for the given code."""
-    result = explanation_chain.invoke({"code": code})
-    return result
\ No newline at end of file
+    return invoke_routed("explanation", explanation_prompt, {"code": code}, TEMPERATURE, validate=not_empty)
+
+@instrumented("explanation")
+def stream_explanation(code):
+    """Generate an explanation for the given code, yielding text chunks as they arrive."""
+    return stream_routed("explanation", explanation_prompt, {"code": code}, TEMPERATURE, validate=not_empty)
\ No newline at end of file
@@ -1,43 +1,227 @@
 # utils/github_api.py
+import os
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 import requests
-from utils.config import GITHUB_TOKEN
+from utils.rate_limiter import RateLimitedAdapter, github_limiter
+from utils.metrics import record_github_request
+from utils.single_flight import SingleFlight
+from utils.config import (
+    get_github_token,
+    GITHUB_API_URL,
+    GITHUB_POOL_SIZE,
+    GITHUB_CACHE_DIR,
+    GITHUB_CACHE_ENTRIES,
+    COALESCE_CALLS
+)
+
+def create_session(pool_size=GITHUB_POOL_SIZE, limiter=github_limiter):
+    """
+    Create a requests session with a connection pool sized for concurrent use.
+
+    Every request goes through `limiter`, which spaces calls out, retries
+    throttled ones and backs off when GitHub starts failing.
+    """
+    session = requests.Session()
+    adapter = RateLimitedAdapter(limiter, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class ETagCache:
+    """
+    Cache of GitHub GET responses keyed by URL and token, revalidated with ETags.
+
+    A hit is sent as a conditional request with If-None-Match; GitHub answers
+    an unchanged resource with 304 Not Modified, which does not count
+    against the rate limit. Entries are kept in an in-memory LRU and, when
+    `directory` is set, also on disk so that they survive restarts.
+    """
+
+    def __init__(self, directory=None, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        if directory:
+            # Entries hold private repository data, so only the current user may read them
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def make_key(url, token):
+        # Different tokens can see different data, so the token is part of the key
+        return hashlib.sha256(f"{token}\0{url}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, key + ".json"), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def set(self, key, etag, body, next_url):
+        entry = {"etag": etag, "body": body, "next": next_url}
+        self._remember(key, entry)
+        if self.directory:
+            try:
+                path = os.path.join(self.directory, key + ".json")
+                fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(path + ".tmp", path)
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._prune_disk()
+            except OSError as e:
+                print(f"Error caching GitHub response: {e}")
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        """Delete the oldest cache files beyond `max_entries`."""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# Shared by every GitHubAPI instance, so connections are reused across calls and sessions
+session = create_session()
+etag_cache = ETagCache(GITHUB_CACHE_DIR or None, GITHUB_CACHE_ENTRIES)
+# Identical GETs in flight, e.g. several sessions opening the same pull request
+github_flight = SingleFlight("github")
 
 class GitHubAPI:
-    def __init__(self, token=None):
-        self.token = token or GITHUB_TOKEN
-        self.base_url = "https://api.github.com"
+    def __init__(self, token=None, base_url=None, http_session=None, cache=None):
+        self.token = token or get_github_token()
+        self.base_url = (base_url or GITHUB_API_URL).rstrip("/")
         self.headers = {
             "Authorization": f"token {self.token}",
             "Accept": "application/vnd.github.v3+json"
         }
-    
+        self.session = http_session or session
+        self.cache = cache or etag_cache
+
+    def _request(self, method, url, endpoint, cache_result=None, **kwargs):
+        """
+        Send a request and record its latency and status under `endpoint`.
+
+        Args:
+            endpoint: Short name of the API endpoint, used as a metrics label
+            cache_result: For GETs, whether a cached copy was revalidated
+                ("hit" when GitHub answers 304, else "stale") or there was
+                none ("none")
+        """
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            if cache_result == "stale" and status == "304":
+                cache_result = "hit"
+            record_github_request(endpoint, method, status, started, cache_result)
+
+    def _get(self, url, params=None, endpoint="other"):
+        """
+        GET a URL, revalidating any cached copy with If-None-Match.
+
+        Returns:
+            A (status_code, body, next_url, response) tuple, where body is the
+            decoded JSON (from the cache on a 304) and next_url is the
+            rel="next" link for paginated resources. Concurrent identical
+            GETs with the same token share one request and its result.
+        """
+        request_url = requests.Request("GET", url, params=params).prepare().url
+        key = self.cache.make_key(request_url, self.token)
+        if COALESCE_CALLS:
+            return github_flight.do(key, lambda: self._fetch(request_url, key, endpoint))
+        return self._fetch(request_url, key, endpoint)
+
+    def _fetch(self, request_url, key, endpoint):
+        """Make the GET for _get."""
+        cached = self.cache.get(key)
+        headers = dict(self.headers)
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        cache_result = "stale" if "If-None-Match" in headers else "none"
+        response = self._request("GET", request_url, endpoint, cache_result, headers=headers)
+        if response.status_code == 304 and cached:
+            return 200, cached["body"], cached.get("next"), response
+        if response.status_code != 200:
+            return response.status_code, None, None, response
+
+        body = response.json()
+        next_url = response.links.get("next", {}).get("url")
+        if response.headers.get("ETag"):
+            self.cache.set(key, response.headers["ETag"], body, next_url)
+        return 200, body, next_url, response
+
+    def _get_all_pages(self, url, params=None, endpoint="other"):
+        """GET every page of a paginated list resource by following Link headers."""
+        params = dict(params or {})
+        params.setdefault("per_page", 100)
+        items = []
+        while url:
+            status, body, url, response = self._get(url, params, endpoint)
+            if status != 200:
+                return status, None, response
+            items.extend(body)
+            # The next link already carries the query parameters
+            params = None
+        return 200, items, None
+
     def get_pull_request(self, owner, repo, pr_number):
         """Get pull request details."""
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            return response.json()
+        status, body, _, response = self._get(url, endpoint="pull_request")
+        if status == 200:
+            return body
         else:
             raise Exception(f"Failed to get PR: {response.status_code} - {response.text}")
-    
+
     def get_pull_request_files(self, owner, repo, pr_number):
-        """Get files changed in a pull request."""
+        """Get all files changed in a pull request, across every page."""
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/files"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            return response.json()
+        status, files, response = self._get_all_pages(url, endpoint="pull_request_files")
+        if status == 200:
+            return files
         else:
             raise Exception(f"Failed to get PR files: {response.status_code} - {response.text}")
-    
+
     def create_pull_request_review(self, owner, repo, pr_number, comments):
         """Create a review comment on a pull request."""
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/comments"
-        response = requests.post(url, headers=self.headers, json=comments)
+        response = self._request("POST", url, "review_comments", headers=self.headers, json=comments)
         if response.status_code == 201:
             return response.json()
         else:
             raise Exception(f"Failed to create review comment: {response.status_code} - {response.text}")
-    
+
     def create_pull_request_review_comment(self, owner, repo, pr_number, commit_id, path, position, body):
         """Create a review comment on a specific line of code."""
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/comments"
@@ -47,17 +231,41 @@ class GitHubAPI:
             "position": position,
             "body": body
         }
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self._request("POST", url, "review_comments", headers=self.headers, json=data)
         if response.status_code == 201:
             return response.json()
         else:
             raise Exception(f"Failed to create review comment: {response.status_code} - {response.text}")
+
+    def submit_pull_request_review(self, owner, repo, pr_number, commit_id, comments, body="", event="COMMENT"):
+        """
+        Submit a review with all of its line comments in a single request.
+        
+        Args:
+            commit_id: The PR head commit SHA the positions refer to
+            comments: List of {"path", "position", "body"} dicts, where position
+                is the line's position in the file's diff
+            body: Overall review text
+            event: COMMENT, APPROVE or REQUEST_CHANGES
+        """
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/reviews"
+        data = {
+            "commit_id": commit_id,
+            "body": body,
+            "event": event,
+            "comments": comments
+        }
+        response = self._request("POST", url, "reviews", headers=self.headers, json=data)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"Failed to submit review: {response.status_code} - {response.text}")
     
     def get_repository_languages(self, owner, repo):
         """Get programming languages used in the repository."""
         url = f"{self.base_url}/repos/{owner}/{repo}/languages"
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            return response.json()
+        status, body, _, response = self._get(url, endpoint="languages")
+        if status == 200:
+            return body
         else:
-            raise Exception(f"Failed to get repository languages: {response.status_code} - {response.text}")
\ No newline at end of file
+            raise Exception(f"Failed to get repository languages: {response.status_code} - {response.text}")
@@ -0,0 +1,204 @@
+# utils/llm_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from langchain_core.caches import BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from utils.metrics import llm_cache_lookups, current_feature
+from utils.config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_MB, LLM_CACHE_TTL
+
+def serialize_generations(generations):
+    """Serialize completion or chat generations to a JSON string."""
+    data = []
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            data.append({"message": message_to_dict(generation.message),
+                         "generation_info": generation.generation_info})
+        else:
+            data.append({"text": generation.text, "generation_info": generation.generation_info})
+    return json.dumps(data)
+
+def deserialize_generations(value):
+    """
+    Inverse of serialize_generations.
+
+    Adds "cached": True to each generation_info, so that callbacks can tell
+    a cache hit, which for chat models still runs them, from a model call.
+    """
+    generations = []
+    for item in json.loads(value):
+        info = dict(item["generation_info"] or {}, cached=True)
+        if "message" in item:
+            message = messages_from_dict([item["message"]])[0]
+            generations.append(ChatGeneration(message=message, generation_info=info))
+        else:
+            generations.append(Generation(text=item["text"], generation_info=info))
+    return generations
+
+class DiskLLMCache(BaseCache):
+    """
+    Content-addressed LLM response cache stored in a local SQLite file.
+
+    Entries are keyed by a SHA-256 of the rendered prompt and the LLM
+    configuration string, which LangChain builds from the model name,
+    temperature and the other invocation parameters. Entries older than
+    `ttl` seconds are treated as misses, and once the file holds more than
+    `max_bytes` of responses the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(prompt, llm_string):
+        """Hash the prompt and LLM configuration into a cache key."""
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                llm_cache_lookups.inc(feature=current_feature.get(), result="miss")
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        llm_cache_lookups.inc(feature=current_feature.get(), result="hit")
+        try:
+            return deserialize_generations(row[0])
+        except Exception as e:
+            print(f"Error reading cached LLM response: {e}")
+            return None
+
+    def update(self, prompt, llm_string, return_val):
+        key = self.make_key(prompt, llm_string)
+        value = serialize_generations(return_val)
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under the size limit."""
+        if self.ttl:
+            expired = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+            if expired:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+                self._total_bytes -= expired
+
+        # Evict down to 90% of the limit so that eviction does not run on every insert
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed")
+        evicted = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "size_bytes": self._total_bytes
+            }
+
+def cache_key_for(llm, prompt_value):
+    """Return the (prompt, llm_string) pair LangChain uses to cache this call."""
+    if isinstance(llm, BaseChatModel):
+        return dumps(prompt_value.to_messages()), llm._get_llm_string()
+    params = llm.dict()
+    params["stop"] = None
+    return prompt_value.to_string(), str(sorted(params.items()))
+
+def stream_with_cache(prompt, llm, inputs):
+    """
+    Stream the text of `prompt | llm` chunk by chunk.
+
+    LangChain only consults the cache on invoke, so streaming would bypass
+    it. This serves a cached response as a single chunk and stores the full
+    streamed text afterwards, under the same key invoke would use.
+    """
+    prompt_value = prompt.invoke(inputs)
+    cache = llm.cache if isinstance(llm.cache, BaseCache) else None
+    if cache is not None:
+        cache_prompt, llm_string = cache_key_for(llm, prompt_value)
+        cached = cache.lookup(cache_prompt, llm_string)
+        if cached:
+            yield cached[0].text
+            return
+
+    parts = []
+    for chunk in llm.stream(prompt_value):
+        text = chunk if isinstance(chunk, str) else chunk.content
+        parts.append(text)
+        yield text
+
+    if cache is not None:
+        text = "".join(parts)
+        if isinstance(llm, BaseChatModel):
+            generation = ChatGeneration(message=AIMessage(content=text))
+        else:
+            generation = Generation(text=text)
+        cache.update(cache_prompt, llm_string, [generation])
+
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    """Get the shared cache passed to every LLM, opened on first use; None disables caching."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    return DiskLLMCache(
+        LLM_CACHE_PATH,
+        max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+        ttl=LLM_CACHE_TTL
+    )
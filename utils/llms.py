@@ -0,0 +1,102 @@
+# utils/llms.py
+import hashlib
+from functools import lru_cache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from utils.config import get_openai_api_key, COALESCE_CALLS
+from utils.llm_cache import get_llm_cache
+from utils.metrics import metrics_handler
+from utils.rate_limiter import get_openai_http_client, get_openai_async_http_client
+from utils.single_flight import SingleFlight
+
+# Identical model calls in flight across every session and thread
+llm_flight = SingleFlight("llm")
+
+def mark_coalesced(output):
+    """
+    Copy a model result or stream chunk for a caller that shared it.
+
+    Generations are marked "coalesced", so the metrics callback does not
+    count the shared call's tokens and cost a second time.
+    """
+    output = output.model_copy(deep=True)
+    generations = getattr(output, "generations", None)
+    if generations is None:
+        generations = [output]
+    elif generations and isinstance(generations[0], list):
+        generations = [generation for batch in generations for generation in batch]
+    for generation in generations:
+        generation.generation_info = dict(generation.generation_info or {}, coalesced=True)
+    return output
+
+class CoalescingMixin:
+    """
+    Model mixin that shares identical in-flight calls between threads.
+
+    Calls are keyed on the rendered prompt or messages, the model settings
+    and call options such as stop words and bound tools, which is what
+    LangChain's cache keys on. The cache is consulted before a call gets
+    here, so only calls that would reach the API are coalesced.
+    """
+
+    def _flight_key(self, method, inputs, stop, kwargs):
+        if isinstance(self, BaseChatModel):
+            params = self._get_llm_string(stop=stop, **kwargs)
+        else:
+            params = str(sorted(dict(self.dict(), stop=stop, **kwargs).items()))
+        # Generate and stream calls return different things, and one may call the other
+        return hashlib.sha256(f"{method}\0{params}\0{dumps(inputs)}".encode("utf-8")).hexdigest()
+
+    def _generate(self, inputs, stop=None, run_manager=None, **kwargs):
+        generate = super()._generate
+        return llm_flight.do(
+            self._flight_key("generate", inputs, stop, kwargs),
+            lambda: generate(inputs, stop=stop, run_manager=run_manager, **kwargs),
+            share=mark_coalesced
+        )
+
+    def _stream(self, inputs, stop=None, run_manager=None, **kwargs):
+        stream = super()._stream
+        yield from llm_flight.stream(
+            self._flight_key("stream", inputs, stop, kwargs),
+            lambda: stream(inputs, stop=stop, run_manager=run_manager, **kwargs),
+            share=mark_coalesced
+        )
+
+@lru_cache(maxsize=None)
+def coalescing(llm_class):
+    """Subclass of a LangChain model class whose identical in-flight calls are shared."""
+    return type(llm_class.__name__, (CoalescingMixin, llm_class), {"__module__": __name__})
+
+@lru_cache(maxsize=None)
+def get_llm(chat=False, temperature=0.3, model=None):
+    """
+    Get the shared LLM client for a model, model type and temperature.
+
+    Clients are built on first use, so importing a module that needs one
+    does not pay for importing and configuring the OpenAI SDK. Every client
+    shares the response cache, the pooled, rate-limited HTTP clients and
+    the callback that records per-call metrics, and identical concurrent
+    calls are coalesced unless COALESCE_CALLS is off.
+
+    Args:
+        chat: True for a chat model, False for a completion model
+        temperature: Sampling temperature
+        model: Model name, or None for the client's default
+    """
+    from langchain_openai import ChatOpenAI, OpenAI
+
+    llm_class = ChatOpenAI if chat else OpenAI
+    if COALESCE_CALLS:
+        llm_class = coalescing(llm_class)
+    settings = {"model": model} if model else {}
+    return llm_class(
+        **settings,
+        api_key=get_openai_api_key(),
+        temperature=temperature,
+        cache=get_llm_cache(),
+        http_client=get_openai_http_client(),
+        http_async_client=get_openai_async_http_client(),
+        max_retries=0,
+        callbacks=[metrics_handler]
+    )
@@ -0,0 +1,527 @@
+# utils/metrics.py
+import time
+import inspect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from utils.tokens import count_tokens
+
+# Latency buckets in seconds, from a cached lookup to a long PR review
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Observations kept per series for the percentiles in the admin view
+RECENT_OBSERVATIONS = 1000
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of values, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+class Metric:
+    """A named metric with one series per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def series(self):
+        """Return (labels, value) pairs, where value is a copy of the series state."""
+        with self._lock:
+            items = list(self._series.items())
+        return [(dict(zip(self.labelnames, key)), self._copy(value)) for key, value in items]
+
+    def _copy(self, value):
+        return value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.series():
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+class Histogram(Metric):
+    """Bucketed observations, plus the most recent ones for exact percentiles."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = {
+                    "buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                    "recent": deque(maxlen=RECENT_OBSERVATIONS)
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+            state["recent"].append(value)
+
+    def _copy(self, state):
+        return dict(state, buckets=list(state["buckets"]), recent=list(state["recent"]))
+
+    def _render_series(self, labels, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["buckets"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(dict(labels, le='+Inf'))} {state['count']}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {state['sum']}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Process-wide set of metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+registry = MetricsRegistry()
+
+feature_seconds = registry.histogram(
+    "codecrafter_feature_seconds", "Wall time of a feature call, to the last chunk for streams", ["feature", "status"])
+feature_first_chunk_seconds = registry.histogram(
+    "codecrafter_feature_first_chunk_seconds", "Time from a streaming feature call to its first chunk", ["feature"])
+llm_seconds = registry.histogram(
+    "codecrafter_llm_request_seconds", "Wall time of an LLM call that reached the model", ["feature", "model", "status"])
+llm_first_token_seconds = registry.histogram(
+    "codecrafter_llm_first_token_seconds", "Time to the first streamed token of an LLM call", ["feature", "model"])
+llm_tokens = registry.counter(
+    "codecrafter_llm_tokens_total", "Tokens sent to and generated by the model", ["feature", "model", "kind"])
+llm_cost = registry.counter(
+    "codecrafter_llm_cost_usd_total", "Estimated model cost in US dollars", ["feature", "model"])
+llm_cache_lookups = registry.counter(
+    "codecrafter_llm_cache_lookups_total", "LLM response cache lookups", ["feature", "result"])
+http_seconds = registry.histogram(
+    "codecrafter_http_attempt_seconds", "Time to the response headers of one HTTP attempt", ["provider", "status"])
+http_events = registry.counter(
+    "codecrafter_http_events_total",
+    "Rate limiter events: calls, throttled, retries, failures and rejected", ["provider", "feature", "event"])
+github_seconds = registry.histogram(
+    "codecrafter_github_request_seconds", "Wall time of a GitHub API request, retries included",
+    ["endpoint", "method", "status"])
+single_flight_calls = registry.counter(
+    "codecrafter_single_flight_calls_total",
+    "Calls that ran (leader) or shared an identical in-flight call (coalesced)", ["group", "feature", "role"])
+model_routes = registry.counter(
+    "codecrafter_model_routes_total",
+    "Model calls by the tier they were routed to and why: task, large input, slo or escalated",
+    ["feature", "tier", "reason"])
+github_cache = registry.counter(
+    "codecrafter_github_cache_total", "GitHub ETag cache results: hit (304), stale or none", ["endpoint", "result"])
+
+# The feature a call belongs to, so that LLM and HTTP metrics can be broken
+# down by it. Context variables follow LangChain's batch threads and
+# asyncio tasks; code that hands work to its own threads copies the context.
+current_feature = contextvars.ContextVar("current_feature", default="other")
+
+@contextmanager
+def feature_context(feature):
+    """Attribute the metrics recorded inside the block to `feature`."""
+    token = current_feature.set(feature)
+    try:
+        yield
+    finally:
+        current_feature.reset(token)
+
+@contextmanager
+def tracked(feature):
+    """Attribute the metrics recorded inside the block to `feature` and record its wall time."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with feature_context(feature):
+            yield
+        status = "ok"
+    finally:
+        feature_seconds.observe(time.perf_counter() - started, feature=feature, status=status)
+
+def instrumented(feature):
+    """
+    Decorate a feature's entry point to record its wall time and status.
+
+    Functions that return a generator, like the stream_* functions, are
+    timed until the stream is exhausted, with the time to the first chunk
+    recorded separately.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with feature_context(feature):
+                    result = fn(*args, **kwargs)
+            except BaseException:
+                feature_seconds.observe(time.perf_counter() - started, feature=feature, status="error")
+                raise
+            if inspect.isgenerator(result):
+                return instrument_stream(feature, result, started)
+            feature_seconds.observe(time.perf_counter() - started, feature=feature, status="ok")
+            return result
+        return wrapper
+    return decorate
+
+def instrument_stream(feature, chunks, started):
+    """Yield from `chunks`, running each step under `feature` and timing the stream."""
+    status = "ok"
+    first = True
+    try:
+        while True:
+            with feature_context(feature):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+            if first:
+                feature_first_chunk_seconds.observe(time.perf_counter() - started, feature=feature)
+                first = False
+            yield chunk
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        chunks.close()
+        feature_seconds.observe(time.perf_counter() - started, feature=feature, status=status)
+
+# USD per million (prompt, completion) tokens; the longest matching prefix wins
+MODEL_PRICES = {
+    "gpt-3.5-turbo-instruct": (1.50, 2.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+}
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimated cost of a call in USD, or 0 for models without a known price."""
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def is_cached(response):
+    """
+    True when an LLMResult did not reach the model: it was served from
+    DiskLLMCache or shared from an identical in-flight call, which mark
+    their generations.
+    """
+    return any(
+        (generation.generation_info or {}).get("cached") or (generation.generation_info or {}).get("coalesced")
+        for generations in response.generations for generation in generations
+    )
+
+def usage_of(response):
+    """Return (prompt_tokens, completion_tokens) reported by the API, or None."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        return usage["prompt_tokens"], usage.get("completion_tokens") or 0
+    prompt_tokens = completion_tokens = 0
+    found = False
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                found = True
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+    return (prompt_tokens, completion_tokens) if found else None
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records latency, time to first token, token counts and cost of LLM calls.
+
+    Token counts come from the API's usage data when it reports any, which
+    it does not for streamed calls; those are counted with tiktoken.
+    Responses served from the cache are counted by the cache instead.
+    """
+
+    # Run in the calling thread, where the feature context is set
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, prompt, metadata, invocation_params):
+        params = invocation_params or {}
+        model = (metadata or {}).get("ls_model_name") or params.get("model_name") or params.get("model") or "unknown"
+        with self._lock:
+            self._runs[run_id] = {
+                "started": time.perf_counter(), "first_token": None, "model": model,
+                "prompt": prompt, "feature": current_feature.get()
+            }
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "\n".join(prompts), metadata, kwargs.get("invocation_params"))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        prompt = "\n".join(get_buffer_string(batch) for batch in messages)
+        self._start(run_id, prompt, metadata, kwargs.get("invocation_params"))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run["first_token"] is None:
+                run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or is_cached(response):
+            return
+        feature = run["feature"]
+        model = (response.llm_output or {}).get("model_name") or run["model"]
+        llm_seconds.observe(time.perf_counter() - run["started"], feature=feature, model=model, status="ok")
+        if run["first_token"] is not None:
+            llm_first_token_seconds.observe(run["first_token"] - run["started"], feature=feature, model=model)
+
+        usage = usage_of(response)
+        if usage is None:
+            completion = "".join(
+                generation.text for generations in response.generations for generation in generations
+            )
+            usage = count_tokens(run["prompt"], model), count_tokens(completion, model)
+        prompt_tokens, completion_tokens = usage
+        llm_tokens.inc(prompt_tokens, feature=feature, model=model, kind="prompt")
+        llm_tokens.inc(completion_tokens, feature=feature, model=model, kind="completion")
+        llm_cost.inc(estimate_cost(model, prompt_tokens, completion_tokens), feature=feature, model=model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            llm_seconds.observe(time.perf_counter() - run["started"], feature=run["feature"], model=run["model"], status="error")
+
+metrics_handler = MetricsCallbackHandler()
+
+def record_github_request(endpoint, method, status, started, cache_result=None):
+    """Record a GitHub API request that began at `started` (time.perf_counter())."""
+    github_seconds.observe(time.perf_counter() - started, endpoint=endpoint, method=method, status=status)
+    if cache_result is not None:
+        github_cache.inc(endpoint=endpoint, result=cache_result)
+
+def totals(metric, by, **match):
+    """Sum a counter's series, or a histogram's counts, grouped by the `by` labels."""
+    grouped = {}
+    for labels, value in metric.series():
+        if any(labels.get(name) != wanted for name, wanted in match.items()):
+            continue
+        key = tuple(labels[name] for name in by)
+        grouped[key] = grouped.get(key, 0) + (value["count"] if isinstance(value, dict) else value)
+    return grouped
+
+def latencies(histogram, by, **match):
+    """Recent observations of a histogram grouped by the `by` labels."""
+    grouped = {}
+    for labels, state in histogram.series():
+        if any(labels.get(name) != wanted for name, wanted in match.items()):
+            continue
+        grouped.setdefault(tuple(labels[name] for name in by), []).extend(state["recent"])
+    return grouped
+
+def summary():
+    """
+    Summarize the registry as tables (lists of row dicts) for the admin view.
+
+    Percentiles are over the most recent observations of each series.
+    """
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    features = []
+    calls = latencies(feature_seconds, ["feature"])
+    errors = totals(feature_seconds, ["feature"], status="error")
+    first_chunks = latencies(feature_first_chunk_seconds, ["feature"])
+    cost = totals(llm_cost, ["feature"])
+    for (feature,), values in sorted(calls.items()):
+        features.append({
+            "feature": feature,
+            "calls": len(values),
+            "errors": errors.get((feature,), 0),
+            "p50 ms": ms(percentile(values, 50)),
+            "p95 ms": ms(percentile(values, 95)),
+            "first chunk p50 ms": ms(percentile(first_chunks.get((feature,), []), 50)),
+            "cost usd": round(cost.get((feature,), 0.0), 4),
+        })
+
+    models = []
+    tokens = totals(llm_tokens, ["feature", "model", "kind"])
+    first_tokens = latencies(llm_first_token_seconds, ["feature", "model"])
+    for (feature, model), values in sorted(latencies(llm_seconds, ["feature", "model"]).items()):
+        models.append({
+            "feature": feature,
+            "model": model,
+            "calls": len(values),
+            "p50 ms": ms(percentile(values, 50)),
+            "p95 ms": ms(percentile(values, 95)),
+            "first token p50 ms": ms(percentile(first_tokens.get((feature, model), []), 50)),
+            "prompt tokens": tokens.get((feature, model, "prompt"), 0),
+            "completion tokens": tokens.get((feature, model, "completion"), 0),
+            "cost usd": round(totals(llm_cost, ["feature", "model"]).get((feature, model), 0.0), 4),
+        })
+
+    cache = []
+    lookups = totals(llm_cache_lookups, ["feature", "result"])
+    for feature in sorted({feature for feature, _ in lookups}):
+        hits, misses = lookups.get((feature, "hit"), 0), lookups.get((feature, "miss"), 0)
+        cache.append({"feature": feature, "hits": hits, "misses": misses, "hit rate": round(hits / (hits + misses), 3)})
+
+    http = []
+    events = totals(http_events, ["provider", "event"])
+    attempts = latencies(http_seconds, ["provider"])
+    for provider in sorted({provider for provider, _ in events}):
+        row = {"provider": provider}
+        for event in ("calls", "throttled", "retries", "failures", "rejected"):
+            row[event] = events.get((provider, event), 0)
+        row["p95 ms"] = ms(percentile(attempts.get((provider,), []), 95))
+        http.append(row)
+
+    github = []
+    cache_results = totals(github_cache, ["endpoint", "result"])
+    for (endpoint, method), values in sorted(latencies(github_seconds, ["endpoint", "method"]).items()):
+        github.append({
+            "endpoint": endpoint,
+            "method": method,
+            "requests": len(values),
+            "p50 ms": ms(percentile(values, 50)),
+            "p95 ms": ms(percentile(values, 95)),
+            "cache hits": cache_results.get((endpoint, "hit"), 0),
+        })
+
+    coalescing = []
+    flights = totals(single_flight_calls, ["group", "feature", "role"])
+    for group, feature in sorted({(group, feature) for group, feature, _ in flights}):
+        leaders, coalesced = flights.get((group, feature, "leader"), 0), flights.get((group, feature, "coalesced"), 0)
+        coalescing.append({
+            "group": group,
+            "feature": feature,
+            "leaders": leaders,
+            "coalesced": coalesced,
+            "coalesced rate": round(coalesced / (leaders + coalesced), 3),
+        })
+
+    routes = []
+    route_counts = totals(model_routes, ["feature", "tier", "reason"])
+    for feature, tier in sorted({(feature, tier) for feature, tier, _ in route_counts}):
+        row = {"feature": feature, "tier": tier}
+        for reason in ("task", "large input", "slo", "escalated"):
+            row[reason] = route_counts.get((feature, tier, reason), 0)
+        routes.append(row)
+
+    return {
+        "features": features, "models": models, "cache": cache, "coalescing": coalescing,
+        "routes": routes, "http": http, "github": github
+    }
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(host, port):
+    """
+    Serve the registry at http://host:port/metrics from a daemon thread.
+
+    Safe to call on every Streamlit rerun: the server starts once per
+    process, and a port that is already taken is reported, not raised.
+    """
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server or None
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        try:
+            _server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"Error starting metrics server on {host}:{port}: {e}")
+            # Do not retry on every rerun
+            _server = False
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True, name="codecrafter-metrics").start()
+        return _server
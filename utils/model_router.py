@@ -0,0 +1,241 @@
+# utils/model_router.py
+import re
+import ast
+from functools import lru_cache
+from langchain_core.output_parsers import StrOutputParser
+from utils.config import (
+    MODEL_TIERS,
+    MODEL_ROUTES,
+    MODEL_ROUTE_LARGE_INPUT,
+    MODEL_ROUTE_SLOS,
+    MODEL_ROUTE_MAX_ESCALATIONS,
+    MODEL_ROUTE_LOG
+)
+from utils.llm_cache import stream_with_cache
+from utils.llms import get_llm
+from utils.metrics import model_routes, llm_seconds, latencies, percentile
+from utils.tokens import count_tokens
+
+# Recent calls a model needs before its latency counts against an SLO
+SLO_MIN_SAMPLES = 5
+
+FENCED_BLOCK_PATTERN = re.compile(r"```[^\n`]*\n(.*?)```", re.S)
+CODE_START_PATTERN = re.compile(r"^(def |async def |class |import |from |@|#|if __name__)")
+
+class Tier:
+    """A named model; completion models are called through the completion API, the rest as chat models."""
+
+    __slots__ = ("name", "model", "chat")
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.chat = not is_completion_model(model)
+
+def is_completion_model(model):
+    return "instruct" in model or model.startswith(("davinci", "babbage"))
+
+class Route:
+    """The tier a call was sent to, why, and the size of its prompt."""
+
+    __slots__ = ("task", "index", "tier", "reason", "input_tokens")
+
+    def __init__(self, task, index, tier, reason, input_tokens):
+        self.task = task
+        self.index = index
+        self.tier = tier
+        self.reason = reason
+        self.input_tokens = input_tokens
+
+def parse_tiers(text):
+    """Parse "tier=model,..." into a list of Tier objects, cheapest first."""
+    tiers = []
+    for item in text.split(","):
+        if "=" in item:
+            name, model = item.split("=", 1)
+            tiers.append(Tier(name.strip(), model.strip()))
+    if not tiers:
+        raise ValueError("MODEL_TIERS needs at least one tier=model pair")
+    return tiers
+
+def parse_settings(text, convert=str):
+    """Parse "task=value,..." into a dict."""
+    settings = {}
+    for item in text.split(","):
+        if "=" in item:
+            task, value = item.split("=", 1)
+            settings[task.strip()] = convert(value.strip())
+    return settings
+
+class ModelRouter:
+    """
+    Picks a model tier for each call.
+
+    A task starts on its configured tier. Prompts over `large_input` tokens
+    go one tier up, since the cheapest models have the smallest context
+    windows and do worst on long inputs. Otherwise, while the tier's model
+    has been slower than the task's latency SLO (p95 of its recent calls),
+    the next cheaper tier is used. Tasks that need a chat model skip
+    completion-only tiers. Every decision is counted in
+    codecrafter_model_routes_total.
+    """
+
+    def __init__(self, tiers, routes, large_input=MODEL_ROUTE_LARGE_INPUT, slos=None,
+                 max_escalations=MODEL_ROUTE_MAX_ESCALATIONS):
+        self.tiers = tiers
+        self.routes = routes
+        self.large_input = large_input
+        self.slos = slos or {}
+        self.max_escalations = max_escalations
+        names = [tier.name for tier in tiers]
+        unknown = sorted(set(routes.values()) - set(names))
+        if unknown:
+            raise ValueError(f"MODEL_ROUTES uses unknown tiers: {', '.join(unknown)}")
+
+    def task_tier(self, task):
+        """Index of a task's configured tier; tasks that are not listed use the cheapest."""
+        name = self.routes.get(task)
+        return next((i for i, tier in enumerate(self.tiers) if tier.name == name), 0)
+
+    def task_model(self, task, chat=False):
+        """The model of a task's configured tier, without routing a call."""
+        return self.tiers[self.usable(self.task_tier(task), chat)].model
+
+    def usable(self, index, chat):
+        """The tier at or above `index` that can serve the call."""
+        for i in range(index, len(self.tiers)):
+            if self.tiers[i].chat or not chat:
+                return i
+        raise ValueError("MODEL_TIERS has no chat model above the requested tier")
+
+    def recent_p95(self, model):
+        """p95 latency in seconds of a model's recent successful calls, or None with too few of them."""
+        values = []
+        for (name,), recent in latencies(llm_seconds, ["model"], status="ok").items():
+            # The API reports versioned names such as gpt-4o-2024-08-06; the longest tier prefix wins
+            matches = [tier.model for tier in self.tiers if name.startswith(tier.model)]
+            if matches and max(matches, key=len) == model:
+                values.extend(recent)
+        return percentile(values, 95) if len(values) >= SLO_MIN_SAMPLES else None
+
+    def choose(self, task, prompt_text="", chat=False):
+        """Pick the tier for a call with the given prompt."""
+        index = self.task_tier(task)
+        reason = "task"
+        input_tokens = count_tokens(prompt_text, self.tiers[index].model) if prompt_text else 0
+        if input_tokens > self.large_input and index + 1 < len(self.tiers):
+            index += 1
+            reason = "large input"
+        else:
+            slo = self.slos.get(task)
+            while slo and index > 0:
+                p95 = self.recent_p95(self.tiers[index].model)
+                if p95 is None or p95 <= slo:
+                    break
+                index -= 1
+                reason = "slo"
+        return self.record(task, self.usable(index, chat), reason, input_tokens)
+
+    def escalate(self, route, chat=False):
+        """The next stronger route after a response failed validation, or None at the top tier."""
+        if route.index + 1 >= len(self.tiers):
+            return None
+        return self.record(route.task, self.usable(route.index + 1, chat), "escalated", route.input_tokens)
+
+    def record(self, task, index, reason, input_tokens):
+        tier = self.tiers[index]
+        model_routes.inc(feature=task, tier=tier.name, reason=reason)
+        if MODEL_ROUTE_LOG:
+            print(f"Routed {task} to {tier.name} ({tier.model}): {reason}, {input_tokens} prompt tokens")
+        return Route(task, index, tier, reason, input_tokens)
+
+@lru_cache(maxsize=None)
+def get_model_router():
+    """Get the shared router, built from the MODEL_* settings on first use."""
+    return ModelRouter(
+        parse_tiers(MODEL_TIERS),
+        parse_settings(MODEL_ROUTES),
+        slos=parse_settings(MODEL_ROUTE_SLOS, float)
+    )
+
+def routed_llm(route, temperature):
+    """The shared client for a route's model."""
+    return get_llm(chat=route.tier.chat, temperature=temperature, model=route.tier.model)
+
+def task_llm(task, temperature, chat=False):
+    """The client for a task's tier, for callers that build a chain once or have no prompt to size."""
+    return routed_llm(get_model_router().choose(task, chat=chat), temperature)
+
+def extract_code(text):
+    """The code in a model response: its fenced blocks, or the text from the first line that looks like code."""
+    blocks = FENCED_BLOCK_PATTERN.findall(text)
+    if blocks:
+        return "\n".join(blocks)
+    lines = text.strip("\n").split("\n")
+    for i, line in enumerate(lines):
+        if CODE_START_PATTERN.match(line):
+            return "\n".join(lines[i:])
+    return text
+
+def python_parses(text):
+    """Cheap validation for Python responses: there is code and it parses."""
+    code = extract_code(text)
+    if not code.strip():
+        return False
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+def not_empty(text):
+    return bool(text.strip())
+
+class Restart(str):
+    """
+    Stream chunk that discards the text streamed so far: the response
+    failed validation and a stronger model's response follows.
+    """
+
+def invoke_routed(task, prompt, inputs, temperature, validate=None):
+    """
+    Run `prompt | llm` on the routed model and return the text.
+
+    When `validate` rejects the response, it is regenerated on the next
+    stronger tier, at most MODEL_ROUTE_MAX_ESCALATIONS times.
+    """
+    router = get_model_router()
+    route = router.choose(task, prompt.format(**inputs))
+    escalations = 0
+    while True:
+        text = (prompt | routed_llm(route, temperature) | StrOutputParser()).invoke(inputs)
+        if validate is None or validate(text) or escalations >= router.max_escalations:
+            return text
+        route = router.escalate(route)
+        if route is None:
+            return text
+        escalations += 1
+
+def stream_routed(task, prompt, inputs, temperature, validate=None):
+    """
+    Stream `prompt | llm` on the routed model, yielding text chunks.
+
+    A response that `validate` rejects has already been streamed, so the
+    stronger model's response follows a Restart chunk, which tells the
+    consumer to drop what it has so far.
+    """
+    router = get_model_router()
+    route = router.choose(task, prompt.format(**inputs))
+    escalations = 0
+    while True:
+        parts = []
+        for chunk in stream_with_cache(prompt, routed_llm(route, temperature), inputs):
+            parts.append(chunk)
+            yield chunk
+        if validate is None or validate("".join(parts)) or escalations >= router.max_escalations:
+            return
+        route = router.escalate(route)
+        if route is None:
+            return
+        escalations += 1
+        yield Restart()
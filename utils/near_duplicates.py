@@ -0,0 +1,129 @@
+# utils/near_duplicates.py
+import re
+import hashlib
+import argparse
+from collections import Counter
+import numpy as np
+
+FINGERPRINT_BITS = 64
+
+# Code is compared as overlapping runs of this many tokens
+SHINGLE_SIZE = 3
+
+CODE_TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+TASK_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def shingles(code, size=SHINGLE_SIZE):
+    """Count the overlapping `size`-token runs in code, ignoring whitespace and case."""
+    tokens = CODE_TOKEN_PATTERN.findall((code or "").lower())
+    if len(tokens) <= size:
+        return Counter([" ".join(tokens)]) if tokens else Counter()
+    return Counter(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+def simhash(code):
+    """
+    64-bit SimHash of a code snippet.
+
+    Each shingle votes on every bit with its hash, weighted by how often it
+    occurs, so snippets that share most of their shingles end up with
+    fingerprints a few bits apart.
+    """
+    counts = shingles(code)
+    if not counts:
+        return 0
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in counts)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(counts), FINGERPRINT_BITS)
+    weights = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    votes = weights @ (bits.astype(np.int64) * 2 - 1)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), "big")
+
+def normalize_task(task):
+    """A task description reduced to lowercase words, so that case, spacing and punctuation do not matter."""
+    return " ".join(TASK_WORD_PATTERN.findall(str(task or "").lower()))
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+class SimHashIndex:
+    """
+    LSH index that finds fingerprints within `max_distance` bits of a query.
+
+    Fingerprints are split into max_distance + 1 bands, and every band value
+    has a bucket. Two fingerprints that differ in at most max_distance bits
+    agree on at least one whole band, so looking up the query's bands finds
+    every near-duplicate without scanning the store.
+    """
+
+    def __init__(self, max_distance=5):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        self.bands = []
+        for i in range(bands):
+            bits = width if i < bands - 1 else FINGERPRINT_BITS - width * (bands - 1)
+            self.bands.append((i * width, (1 << bits) - 1))
+        self.buckets = [{} for _ in self.bands]
+        self.fingerprints = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, snippet_id):
+        return snippet_id in self.fingerprints
+
+    def _keys(self, fingerprint):
+        for (shift, mask), buckets in zip(self.bands, self.buckets):
+            yield buckets, (fingerprint >> shift) & mask
+
+    def add(self, snippet_id, fingerprint):
+        """Index (or re-index) a snippet's fingerprint."""
+        self.remove(snippet_id)
+        self.fingerprints[snippet_id] = fingerprint
+        for buckets, key in self._keys(fingerprint):
+            buckets.setdefault(key, set()).add(snippet_id)
+
+    def remove(self, snippet_id):
+        fingerprint = self.fingerprints.pop(snippet_id, None)
+        if fingerprint is None:
+            return
+        for buckets, key in self._keys(fingerprint):
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket.discard(snippet_id)
+                if not bucket:
+                    del buckets[key]
+
+    def query(self, fingerprint):
+        """Return (snippet_id, distance) pairs within max_distance, closest first."""
+        candidates = set()
+        for buckets, key in self._keys(fingerprint):
+            bucket = buckets.get(key)
+            if bucket:
+                candidates.update(bucket)
+        matches = []
+        for snippet_id in candidates:
+            distance = (fingerprint ^ self.fingerprints[snippet_id]).bit_count()
+            if distance <= self.max_distance:
+                matches.append((snippet_id, distance))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge near-duplicate snippets in the vector store.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be merged")
+    args = parser.parse_args()
+
+    from utils.simple_vector_store import get_vector_store
+
+    store = get_vector_store()
+    before = len(store.snippets)
+    merged = store.deduplicate(dry_run=args.dry_run)
+    removed = sum(len(duplicates) for _, duplicates in merged)
+    for kept, duplicates in merged:
+        print(f"{kept}: {len(duplicates)} duplicates")
+    action = "Would remove" if args.dry_run else "Removed"
+    print(f"{action} {removed} of {before} snippets in {len(merged)} groups")
+    store.journal.close()
+
+if __name__ == "__main__":
+    main()
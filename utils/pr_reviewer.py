@@ -1,12 +1,22 @@
 # utils/pr_reviewer.py
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from utils.config import OPENAI_API_KEY
+from utils.config import REVIEW_TOKEN_BUDGET, REVIEW_MAX_CONCURRENCY, REVIEW_DIFF_CONTEXT
+from utils.llm_cache import stream_with_cache
+from utils.model_router import task_llm, get_model_router
+from utils.metrics import instrumented
+from utils.review_cache import get_review_cache, file_version
+from utils.diff_parser import DiffIndex, normalize_path
+from utils.tokens import count_tokens as count_model_tokens
+from functools import lru_cache
 import re
 
-# Initialize the LLM
-llm = ChatOpenAI(openai_api_key=OPENAI_API_KEY, temperature=0.3)
+# LLM settings; the client itself is created on first use
+TEMPERATURE = 0.3
+
+def get_review_llm():
+    """Get the shared chat model of the review tier."""
+    return task_llm("pr_review", TEMPERATURE, chat=True)
 
 # Create a prompt template for PR review
 review_template = """
@@ -20,6 +30,9 @@ Description: {pr_description}
 Files Changed:
 {file_changes}
 
+Added and unchanged diff lines start with their line number in the new file; removed lines have none.
+Only a few unchanged lines are shown around each change.
+
 Review Guidelines:
 1. Identify potential bugs or issues
 2. Suggest performance improvements
@@ -32,7 +45,7 @@ Provide your review in the following format:
 [Brief summary of your overall assessment]
 
 ## Issues Found
-[List any issues found, with file paths and line numbers if possible]
+[List any issues found. Refer to code locations as "File: <path>, Line: <line number>".]
 
 ## Suggestions
 [Provide specific suggestions for improvement]
@@ -45,42 +58,367 @@ Review:
 
 review_prompt = ChatPromptTemplate.from_template(review_template)
 
-# Create the chain
-review_chain = review_prompt | llm | StrOutputParser()
+
+# Prompt for reviewing one chunk of a large pull request (map step)
+chunk_review_template = """
+You are an expert code reviewer. You are reviewing part {part} of {parts} of the changes in a pull request.
+Other parts are reviewed separately, so only comment on the files below.
+
+Repository: {repo}
+Pull Request: #{pr_number}
+Title: {pr_title}
+Description: {pr_description}
+
+Files Changed:
+{file_changes}
+
+Added and unchanged diff lines start with their line number in the new file; removed lines have none.
+Only a few unchanged lines are shown around each change.
+
+Review Guidelines:
+1. Identify potential bugs or issues
+2. Suggest performance improvements
+3. Check for security vulnerabilities
+4. Evaluate code readability and maintainability
+5. Ensure consistency with the project's coding standards
+
+Refer to code locations as "File: <path>, Line: <line number>".
+Review each file separately. Start each file's review with a heading of the form
+"### File: <path>" (the path only), followed by its issues, suggestions and positive notes.
+
+Review:
+"""
+
+# Prompt for merging partial reviews into the final format (reduce step)
+merge_review_template = """
+You are an expert code reviewer. The changes in the pull request below were reviewed in several parts.
+Merge the partial reviews into a single review. Keep every distinct issue with its file path and line
+number, remove duplicates, and do not invent findings that are not in the partial reviews.
+
+Repository: {repo}
+Pull Request: #{pr_number}
+Title: {pr_title}
+Description: {pr_description}
+
+Partial reviews:
+{partial_reviews}
+
+Provide your review in the following format:
+## Summary
+[Brief summary of your overall assessment]
+
+## Issues Found
+[List any issues found. Refer to code locations as "File: <path>, Line: <line number>".]
+
+## Suggestions
+[Provide specific suggestions for improvement]
+
+## Positive Notes
+[Mention any positive aspects of the changes]
+
+Review:
+"""
+
+chunk_review_prompt = ChatPromptTemplate.from_template(chunk_review_template)
+
+merge_review_prompt = ChatPromptTemplate.from_template(merge_review_template)
+
+review_prompts = {
+    "review": review_prompt,
+    "chunk": chunk_review_prompt,
+    "merge": merge_review_prompt
+}
+
+@lru_cache(maxsize=None)
+def get_review_chain(name="review"):
+    """Create the single-pass ("review"), map ("chunk") or reduce ("merge") chain on first use."""
+    return review_prompts[name] | get_review_llm() | StrOutputParser()
+
+def count_tokens(text):
+    """Count the tokens in text for the review model."""
+    return count_model_tokens(text, get_model_router().task_model("pr_review", chat=True))
+
+def format_file(file, patch=None, part=None):
+    """Format one file's changes for the prompt."""
+    formatted = f"\n### File: {file['filename']}"
+    if part:
+        formatted += f" (part {part})"
+    formatted += f"\nStatus: {file['status']}\n"
+    formatted += f"Changes: {file['additions']} additions, {file['deletions']} deletions\n"
+    patch = file.get('patch') if patch is None else patch
+    if patch:
+        formatted += "```diff\n" + patch + "\n```\n"
+    return formatted + "\n"
+
+def compact_patches(files):
+    """
+    Trim every file's patch to its changes and REVIEW_DIFF_CONTEXT lines
+    around them, with new-file line numbers and moved blocks collapsed.
+
+    Returns:
+        A dict mapping file path to its compact patch
+    """
+    index = DiffIndex(files)
+    return {file["filename"]: index.format_file(file["filename"], REVIEW_DIFF_CONTEXT) for file in files}
 
 def format_file_changes(files):
     """Format file changes for the prompt."""
-    formatted = ""
+    patches = compact_patches(files)
+    return "".join(format_file(file, patches[file["filename"]]) for file in files)
+
+def split_patch(patch, budget):
+    """
+    Split a patch into pieces of at most `budget` tokens.
+
+    Pieces break at hunk headers where possible, and inside a hunk only
+    when the hunk alone is over budget.
+    """
+    hunks = re.split(r"(?m)^(?=@@ )", patch)
+    pieces = []
+    current = []
+    current_tokens = 0
+    for hunk in hunks:
+        lines = hunk.splitlines() if count_tokens(hunk) > budget else [hunk.rstrip("\n")]
+        for line in lines:
+            tokens = count_tokens(line) + 1
+            if current and current_tokens + tokens > budget:
+                pieces.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(line)
+            current_tokens += tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+def pack_file_chunks(files, budget):
+    """
+    Pack formatted file changes into chunks of at most `budget` tokens.
+
+    Files stay whole when they fit; larger patches are split into parts.
+    Chunks are filled in order, so related files tend to stay together.
+
+    Returns:
+        A list of (formatted file changes, file paths) tuples, one per chunk
+    """
+    patches = compact_patches(files)
+    sections = []
     for file in files:
-        formatted += f"\n### File: {file['filename']}\n"
-        formatted += f"Status: {file['status']}\n"
-        formatted += f"Changes: {file['additions']} additions, {file['deletions']} deletions\n"
-        
-        # Include a snippet of the diff
-        if 'patch' in file:
-            # Limit the diff size to avoid token limits
-            diff_lines = file['patch'].split('\n')
-            if len(diff_lines) > 50:
-                formatted += "```diff\n" + '\n'.join(diff_lines[:25]) + "\n...\n" + '\n'.join(diff_lines[-25:]) + "\n```\n"
-            else:
-                formatted += "```diff\n" + file['patch'] + "\n```\n"
-        formatted += "\n"
-    return formatted
-
-def generate_pr_review(repo, pr_number, pr_title, pr_description, files):
-    """Generate a review for a pull request."""
-    file_changes = format_file_changes(files)
-    
-    review = review_chain.invoke({
+        patch = patches[file["filename"]]
+        section = format_file(file, patch)
+        tokens = count_tokens(section)
+        if tokens <= budget or not patch:
+            sections.append((section, tokens, file["filename"]))
+            continue
+        # Leave room for the file header in each part
+        for part, piece in enumerate(split_patch(patch, budget - 100), 1):
+            part_section = format_file(file, piece, part)
+            sections.append((part_section, count_tokens(part_section), file["filename"]))
+
+    chunks = []
+    current = ""
+    current_files = []
+    current_tokens = 0
+    for section, tokens, filename in sections:
+        if current and current_tokens + tokens > budget:
+            chunks.append((current, current_files))
+            current = ""
+            current_files = []
+            current_tokens = 0
+        current += section
+        current_tokens += tokens
+        if filename not in current_files:
+            current_files.append(filename)
+    if current:
+        chunks.append((current, current_files))
+    return chunks
+
+def pack_files(files, budget):
+    """
+    Pack formatted file changes into chunks of at most `budget` tokens.
+
+    Returns:
+        A list of formatted file-change strings, one per chunk
+    """
+    return [chunk for chunk, _ in pack_file_chunks(files, budget)]
+
+def map_review_chunks(pr_info, chunks):
+    """Review every chunk concurrently, returning the partial reviews in order."""
+    inputs = [
+        dict(pr_info, file_changes=chunk, part=i, parts=len(chunks))
+        for i, chunk in enumerate(chunks, 1)
+    ]
+    return get_review_chain("chunk").batch(inputs, config={"max_concurrency": REVIEW_MAX_CONCURRENCY})
+
+# A line that only names a file: "### File: a.py", "**File: `a.py`**", "- **File:** a.py (part 2)".
+# "File: a.py, Line: 3 ..." is a finding, not a heading, and does not match.
+FILE_SECTION_PATTERN = re.compile(
+    r"(?m)^[ \t]*(?:#+|[-*+])?[ \t]*(?:\*\*)?File:(?:\*\*)?[ \t]*(?:\*\*)?`?([^\s`*,]+)`?"
+    r"(?:\*\*)?[ \t]*(?:\(part \d+\))?[ \t]*(?:\*\*)?[ \t]*$"
+)
+
+def split_file_sections(review, index=None):
+    """
+    Split a chunk review into per-file findings.
+
+    Heading paths are resolved against `index` (a DiffIndex) when given, so
+    quoted, prefixed or bare file names still match the changed file.
+    Headings that do not resolve are kept as part of the section before them.
+
+    Returns:
+        A dict mapping file path to the findings under its heading
+    """
+    headings = []
+    for match in FILE_SECTION_PATTERN.finditer(review):
+        path = index.resolve(match.group(1)) if index is not None else normalize_path(match.group(1))
+        if path is not None:
+            headings.append((path, match))
+
+    sections = {}
+    for i, (path, match) in enumerate(headings):
+        end = headings[i + 1][1].start() if i + 1 < len(headings) else len(review)
+        text = review[match.end():end].strip()
+        sections[path] = (sections[path] + "\n\n" + text) if path in sections else text
+    return sections
+
+def review_files_incrementally(pr_info, files, stats=None):
+    """
+    Review only files whose blob SHA has no cached findings.
+
+    New and changed files are packed into chunks and reviewed concurrently;
+    their findings are split per file and cached, so the next review of the
+    pull request reuses them for every file that did not change. When a
+    chunk review has no section for one of its files, the whole chunk
+    review is passed on for those files and nothing is cached for them.
+
+    Returns:
+        A list of formatted per-file findings, in the order of `files`,
+        followed by the chunk reviews that could not be split
+    """
+    repo = pr_info["repo"]
+    review_cache = get_review_cache()
+    findings = {}
+    changed = []
+    for file in files:
+        cached = review_cache.get(repo, file["filename"], file_version(file))
+        if cached is None:
+            changed.append(file)
+        else:
+            findings[file["filename"]] = cached
+
+    unsplit = []
+    if changed:
+        index = DiffIndex(changed)
+        chunks = pack_file_chunks(changed, REVIEW_TOKEN_BUDGET)
+        new_findings = {}
+        unmatched = set()
+        for (_, chunk_files), review in zip(chunks, map_review_chunks(pr_info, [chunk for chunk, _ in chunks])):
+            sections = split_file_sections(review, index)
+            for path in chunk_files:
+                if path in sections:
+                    text = sections[path]
+                    new_findings[path] = (new_findings[path] + "\n\n" + text) if path in new_findings else text
+            missing = [path for path in chunk_files if path not in sections]
+            if missing:
+                unmatched.update(missing)
+                unsplit.append(f"\n### Files: {', '.join(missing)}\n{review}\n")
+        for file in changed:
+            if file["filename"] in new_findings:
+                findings[file["filename"]] = new_findings[file["filename"]]
+                if file["filename"] not in unmatched:
+                    review_cache.set(repo, file["filename"], file_version(file), new_findings[file["filename"]])
+
+    if stats is not None:
+        stats["files_reviewed"] = len(changed)
+        stats["files_reused"] = len(files) - len(changed)
+    return [
+        f"\n### File: {file['filename']}\n{findings[file['filename']]}\n"
+        for file in files if file["filename"] in findings
+    ] + unsplit
+
+def reduce_partial_reviews(pr_info, sections):
+    """
+    Merge formatted partial reviews until they fit in a single merge prompt.
+
+    Returns:
+        The formatted partial reviews for the final merge
+    """
+    while count_tokens("".join(sections)) > REVIEW_TOKEN_BUDGET and len(sections) > 1:
+        groups = []
+        current = []
+        current_tokens = 0
+        for section in sections:
+            tokens = count_tokens(section)
+            if current and current_tokens + tokens > REVIEW_TOKEN_BUDGET:
+                groups.append(current)
+                current = []
+                current_tokens = 0
+            current.append(section)
+            current_tokens += tokens
+        groups.append(current)
+        if len(groups) == len(sections):
+            # Every partial review is over budget on its own; merge them in pairs instead
+            groups = [sections[i:i + 2] for i in range(0, len(sections), 2)]
+        merged = get_review_chain("merge").batch(
+            [dict(pr_info, partial_reviews="".join(group)) for group in groups],
+            config={"max_concurrency": REVIEW_MAX_CONCURRENCY}
+        )
+        sections = [f"\n### Part {i}\n{review}\n" for i, review in enumerate(merged, 1)]
+    return "".join(sections)
+
+def prepare_pr_review(repo, pr_number, pr_title, pr_description, files, stats=None):
+    """
+    Prepare the final review prompt for a pull request.
+
+    Changes that fit in REVIEW_TOKEN_BUDGET are reviewed in a single pass.
+    Larger pull requests are packed into budget-sized chunks that are
+    reviewed concurrently (map) and merged into the usual format (reduce),
+    so no part of the diff is dropped. In incremental mode
+    (REVIEW_INCREMENTAL), chunk findings are cached per blob SHA and only
+    new or changed files go to the map step.
+
+    Returns:
+        A (prompt, inputs) tuple for the final LLM call
+    """
+    pr_info = {
         "repo": repo,
         "pr_number": pr_number,
         "pr_title": pr_title,
-        "pr_description": pr_description,
-        "file_changes": file_changes
-    })
+        "pr_description": pr_description or ""
+    }
+    file_changes = format_file_changes(files)
+    if count_tokens(file_changes) <= REVIEW_TOKEN_BUDGET:
+        return review_prompt, dict(pr_info, file_changes=file_changes)
+
+    if get_review_cache() is not None:
+        sections = review_files_incrementally(pr_info, files, stats)
+        return merge_review_prompt, dict(pr_info, partial_reviews=reduce_partial_reviews(pr_info, sections))
+
+    chunks = pack_files(files, REVIEW_TOKEN_BUDGET)
+    reviews = map_review_chunks(pr_info, chunks)
+    sections = [f"\n### Part {i}\n{review}\n" for i, review in enumerate(reviews, 1)]
+    return merge_review_prompt, dict(pr_info, partial_reviews=reduce_partial_reviews(pr_info, sections))
+
+@instrumented("pr_review")
+def generate_pr_review(repo, pr_number, pr_title, pr_description, files, stats=None):
+    """Generate a review for a pull request."""
+    prompt, inputs = prepare_pr_review(repo, pr_number, pr_title, pr_description, files, stats)
+    chain = get_review_chain("review" if prompt is review_prompt else "merge")
+    review = chain.invoke(inputs)
     
     return review
 
+@instrumented("pr_review")
+def stream_pr_review(repo, pr_number, pr_title, pr_description, files, stats=None):
+    """
+    Generate a review for a pull request, yielding text chunks as they arrive.
+    
+    When files are reviewed in chunks, the chunk reviews run first and only
+    the final merge is streamed.
+    """
+    prompt, inputs = prepare_pr_review(repo, pr_number, pr_title, pr_description, files, stats)
+    yield from stream_with_cache(prompt, get_review_llm(), inputs)
+
 def extract_line_comments(review):
     """Extract line-specific comments from the review."""
     # This is a simple implementation that looks for patterns like "File: path, Line: number"
@@ -107,4 +445,32 @@ def extract_line_comments(review):
             "comment": comment_text
         })
     
-    return line_comments
\ No newline at end of file
+    return line_comments
+
+def build_review_comments(line_comments, files):
+    """
+    Turn extracted line comments into review comments addressed by diff position.
+
+    Paths are matched loosely (quoting, a/ and b/ prefixes, bare file
+    names), and the comment is posted on the changed file's full path.
+    
+    Returns:
+        A (comments, unmapped) tuple: comments is a list of {"path", "position",
+        "body"} dicts for the reviews endpoint, and unmapped lists the line
+        comments whose line is not part of the file's diff
+    """
+    index = DiffIndex(files)
+    comments = []
+    unmapped = []
+    for comment in line_comments:
+        located = index.locate(comment["file"], comment["line"])
+        if located is None:
+            unmapped.append(comment)
+            continue
+        path, diff_line = located
+        comments.append({
+            "path": path,
+            "position": diff_line.position,
+            "body": comment["comment"]
+        })
+    return comments, unmapped
\ No newline at end of file
@@ -0,0 +1,536 @@
+# utils/rate_limiter.py
+import time
+import asyncio
+import random
+import hashlib
+import threading
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+import httpx
+from requests.adapters import HTTPAdapter
+from utils.config import (
+    OPENAI_RATE_LIMIT, OPENAI_RATE_BURST, OPENAI_MAX_CONCURRENCY,
+    GITHUB_RATE_LIMIT, GITHUB_RATE_BURST, GITHUB_POOL_SIZE,
+    RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX,
+    CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET, GITHUB_RATE_LIMIT_MAX_WAIT
+)
+from utils.metrics import http_seconds, http_events, current_feature
+
+# Methods that can be re-sent after a server error without repeating a side effect
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+class RateLimitExceededError(Exception):
+    """Raised instead of waiting long for a credential's exhausted quota to reset."""
+
+# Requests that revalidate a cached response; GitHub does not count their 304s against the quota
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+def quota_key(headers):
+    """Quotas are per credential, so pauses are keyed by a hash of the Authorization header."""
+    return hashlib.sha256((headers.get("Authorization") or "").encode("utf-8")).hexdigest()[:16]
+
+def parse_duration(value):
+    """Parse an OpenAI reset duration such as "20ms", "1s" or "6m0s" into seconds."""
+    total = 0.0
+    number = ""
+    unit = ""
+    for char in value.strip() + " ":
+        if char.isdigit() or char == ".":
+            if unit:
+                total += _unit_seconds(float(number), unit)
+                number, unit = "", ""
+            number += char
+        elif char.isalpha():
+            unit += char
+        elif number:
+            total += _unit_seconds(float(number), unit or "s")
+            number, unit = "", ""
+    return total
+
+def _unit_seconds(number, unit):
+    return number * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}.get(unit, 1)
+
+def parse_retry_after(headers, now=None):
+    """
+    Return how long the provider asked us to wait, in seconds, or None.
+
+    Understands Retry-After (seconds or an HTTP date) and OpenAI's
+    retry-after-ms.
+    """
+    now = now or time.time()
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+def parse_rate_limit(headers, now=None):
+    """
+    Read the remaining quota from X-RateLimit-* headers.
+
+    GitHub sends X-RateLimit-Remaining and an epoch X-RateLimit-Reset;
+    OpenAI sends x-ratelimit-remaining-requests and a duration in
+    x-ratelimit-reset-requests.
+
+    Returns:
+        A (remaining, reset_in_seconds) tuple; either may be None
+    """
+    now = now or time.time()
+    remaining = headers.get("x-ratelimit-remaining") or headers.get("x-ratelimit-remaining-requests")
+    reset = headers.get("x-ratelimit-reset")
+    reset_in = None
+    try:
+        remaining = int(remaining) if remaining is not None else None
+    except ValueError:
+        remaining = None
+    if reset:
+        try:
+            reset_in = max(0.0, float(reset) - now)
+        except ValueError:
+            reset_in = None
+    else:
+        reset = headers.get("x-ratelimit-reset-requests")
+        if reset:
+            reset_in = parse_duration(reset)
+    return remaining, reset_in
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing provider for a while instead of piling on.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast for `reset_timeout` seconds. Then one trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go through now.
+
+        Returns:
+            True when the call is the half-open trial; its outcome must be
+            recorded, or the trial aborted if it is never sent
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                raise CircuitOpenError("Service temporarily unavailable after repeated failures; try again shortly")
+            self.trial_running = True
+            return True
+
+    def abort_trial(self):
+        """Let another call be the trial, after the trial call was given up without an outcome."""
+        with self._lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+class AdaptiveConcurrency:
+    """
+    A concurrency limit that follows the provider's health (AIMD).
+
+    The limit grows by one slot per window of successful calls and is halved
+    when a call is throttled, fails, or its latency rises well above the
+    long-run average.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_factor=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.fast_latency = None
+        self.slow_latency = None
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self, latency):
+        with self._condition:
+            if self.fast_latency is None:
+                self.fast_latency = self.slow_latency = latency
+            else:
+                self.fast_latency += 0.3 * (latency - self.fast_latency)
+                self.slow_latency += 0.05 * (latency - self.slow_latency)
+            if self.fast_latency > self.latency_factor * self.slow_latency:
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_overload(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        # One response per round trip is enough; a burst of failures from the
+        # same overload should not collapse the limit to the minimum
+        now = time.monotonic()
+        if now - self.last_decrease < (self.slow_latency or 1.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+
+class RateLimiter:
+    """
+    Process-wide gate for every call to one provider.
+
+    Each call takes a token-bucket token and a concurrency slot, is refused
+    while the circuit breaker is open, and is retried with exponential
+    backoff and jitter when the provider throttles it or fails. Rate limit
+    headers on every response pause calls with the same credential (`key`)
+    once its quota runs out; a pause longer than `max_quota_wait` seconds
+    raises RateLimitExceededError instead of blocking the caller.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency, max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, failure_threshold=5, reset_timeout=30.0,
+                 retry_methods=None, max_quota_wait=None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_methods = retry_methods
+        self.max_quota_wait = max_quota_wait
+        # Quota key -> monotonic time its quota resets
+        self.paused_until = {}
+        self.stats_counts = {"calls": 0, "throttled": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def is_throttled(self, response):
+        """True for 429s and GitHub's 403 secondary rate limit responses."""
+        if response.status_code == 429:
+            return True
+        if response.status_code == 403:
+            remaining, _ = parse_rate_limit(response.headers)
+            return remaining == 0 or parse_retry_after(response.headers) is not None
+        return False
+
+    def pause(self, key, seconds):
+        """Send no calls with quota key `key` for `seconds`, e.g. until its quota resets."""
+        now = time.monotonic()
+        with self._lock:
+            self.paused_until = {k: until for k, until in self.paused_until.items() if until > now}
+            self.paused_until[key] = max(self.paused_until.get(key, 0.0), now + seconds)
+
+    def wait_for_quota(self, key):
+        """Sleep until `key`'s quota resets, or raise RateLimitExceededError if that is too far off."""
+        with self._lock:
+            wait = self.paused_until.get(key, 0.0) - time.monotonic()
+        if wait <= 0:
+            return
+        if self.max_quota_wait is not None and wait > self.max_quota_wait:
+            self._count("rejected")
+            raise RateLimitExceededError(f"{self.name} rate limit exhausted; it resets in {wait:.0f}s")
+        time.sleep(wait)
+
+    def call(self, send, method="GET", key=None, conditional=False):
+        """
+        Send a request through the limiter.
+
+        Args:
+            send: Callable that performs the request and returns a response
+                with `status_code` and `headers` (requests or httpx)
+            method: HTTP method, used to decide whether failures may be retried
+            key: Quota key of the request's credential (see quota_key)
+            conditional: The request revalidates a cached response and is
+                not held back by an exhausted quota
+
+        Returns:
+            The final response; throttled or failed responses are returned
+            once retries run out
+        """
+        retry_failures = self.retry_methods is None or method.upper() in self.retry_methods
+        attempt = 0
+        while True:
+            started, trial = self._admit(key, conditional)
+            try:
+                response = send()
+            except Exception:
+                if not self._settle(None, started, attempt, retry_failures, key):
+                    raise
+            except BaseException:
+                self._abandon(trial)
+                raise
+            else:
+                if not self._settle(response, started, attempt, retry_failures, key):
+                    return response
+                response.close()
+            self._count("retries")
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def acall(self, send, method="GET", key=None, conditional=False):
+        """Async version of `call`, for a `send` coroutine function."""
+        loop = asyncio.get_running_loop()
+        retry_failures = self.retry_methods is None or method.upper() in self.retry_methods
+        attempt = 0
+        while True:
+            # Waiting for a token or a slot blocks, so it happens off the event loop
+            admission = loop.run_in_executor(None, self._admit, key, conditional)
+            try:
+                started, trial = await asyncio.shield(admission)
+            except asyncio.CancelledError:
+                # The thread still finishes admitting the call; free what it takes
+                admission.add_done_callback(self._abandon_admission)
+                raise
+            try:
+                response = await send()
+            except Exception:
+                if not self._settle(None, started, attempt, retry_failures, key):
+                    raise
+            except BaseException:
+                self._abandon(trial)
+                raise
+            else:
+                if not self._settle(response, started, attempt, retry_failures, key):
+                    return response
+                await response.aclose()
+            self._count("retries")
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def _admit(self, key=None, conditional=False):
+        """Wait until a call may be sent; returns its start time and whether it is the breaker trial."""
+        try:
+            trial = self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("rejected")
+            raise
+        try:
+            if not conditional:
+                self.wait_for_quota(key)
+            self.bucket.acquire()
+            self.concurrency.acquire()
+        except BaseException:
+            if trial:
+                self.breaker.abort_trial()
+            raise
+        return time.monotonic(), trial
+
+    def _abandon(self, trial):
+        """Free an admitted call that ended without a response to settle."""
+        self.concurrency.release()
+        if trial:
+            self.breaker.abort_trial()
+
+    def _abandon_admission(self, admission):
+        """Done callback freeing a call admitted for an acall that was cancelled meanwhile."""
+        if admission.cancelled() or admission.exception() is not None:
+            return
+        _, trial = admission.result()
+        self._abandon(trial)
+
+    def _settle(self, response, started, attempt, retry_failures, key=None):
+        """
+        Record the outcome of one attempt.
+
+        Args:
+            response: The response, or None when sending raised
+            key: Quota key of the request, paused when its quota runs out
+
+        Returns:
+            True when the call should be retried
+        """
+        self.concurrency.release()
+        self._count("calls")
+        http_seconds.observe(time.monotonic() - started, provider=self.name,
+                             status=str(response.status_code) if response is not None else "error")
+        if response is None:
+            self.breaker.record_failure()
+            self.concurrency.on_overload()
+            self._count("failures")
+            return retry_failures and attempt < self.max_retries
+
+        remaining, reset_in = parse_rate_limit(response.headers)
+        if remaining == 0 and reset_in:
+            self.pause(key, reset_in)
+
+        if self.is_throttled(response):
+            # A throttled response shows the provider is up, so it
+            # slows us down without counting towards the breaker
+            self.breaker.record_success()
+            self._count("throttled")
+            self.concurrency.on_overload()
+            wait = parse_retry_after(response.headers)
+            if wait is not None:
+                self.pause(key, wait)
+            return attempt < self.max_retries
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            self.concurrency.on_overload()
+            self._count("failures")
+            return retry_failures and attempt < self.max_retries
+        self.breaker.record_success()
+        self.concurrency.on_success(time.monotonic() - started)
+        return False
+
+    def _count(self, key):
+        with self._lock:
+            self.stats_counts[key] += 1
+        http_events.inc(provider=self.name, feature=current_feature.get(), event=key)
+
+    def stats(self):
+        """Return counters and the current limiter state."""
+        with self._lock:
+            stats = dict(self.stats_counts)
+        stats["circuit"] = self.breaker.state
+        stats["concurrency_limit"] = int(self.concurrency.limit)
+        stats["in_flight"] = self.concurrency.in_flight
+        return stats
+
+class RateLimitedAdapter(HTTPAdapter):
+    """A requests adapter that sends every request through a RateLimiter."""
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        return self.limiter.call(
+            lambda: super(RateLimitedAdapter, self).send(request, **kwargs), request.method,
+            key=quota_key(request.headers),
+            conditional=any(header in request.headers for header in CONDITIONAL_HEADERS)
+        )
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    """An httpx transport that sends every request through a RateLimiter."""
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def handle_request(self, request):
+        return self.limiter.call(
+            lambda: super(RateLimitedTransport, self).handle_request(request), request.method,
+            key=quota_key(request.headers)
+        )
+
+class AsyncRateLimitedTransport(httpx.AsyncHTTPTransport):
+    """An async httpx transport that sends every request through a RateLimiter."""
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    async def handle_async_request(self, request):
+        return await self.limiter.acall(
+            lambda: super(AsyncRateLimitedTransport, self).handle_async_request(request), request.method,
+            key=quota_key(request.headers)
+        )
+
+# One limiter per provider, shared by every session in the process
+openai_limiter = RateLimiter(
+    "openai", OPENAI_RATE_LIMIT, OPENAI_RATE_BURST, OPENAI_MAX_CONCURRENCY,
+    max_retries=RATE_LIMIT_MAX_RETRIES, backoff_base=RATE_LIMIT_BACKOFF_BASE, backoff_max=RATE_LIMIT_BACKOFF_MAX,
+    failure_threshold=CIRCUIT_BREAKER_FAILURES, reset_timeout=CIRCUIT_BREAKER_RESET
+)
+github_limiter = RateLimiter(
+    "github", GITHUB_RATE_LIMIT, GITHUB_RATE_BURST, GITHUB_POOL_SIZE,
+    max_retries=RATE_LIMIT_MAX_RETRIES, backoff_base=RATE_LIMIT_BACKOFF_BASE, backoff_max=RATE_LIMIT_BACKOFF_MAX,
+    failure_threshold=CIRCUIT_BREAKER_FAILURES, reset_timeout=CIRCUIT_BREAKER_RESET,
+    retry_methods=IDEMPOTENT_METHODS, max_quota_wait=GITHUB_RATE_LIMIT_MAX_WAIT
+)
+
+# HTTP clients for the OpenAI SDK, created on first use and shared by every
+# LLM; pass them with max_retries=0 so that retries happen here, where they
+# are coordinated with every other caller. The async client keeps connections
+# bound to one event loop, so only use it from utils.background_jobs.run_async.
+@lru_cache(maxsize=None)
+def get_openai_http_client():
+    import openai
+    return openai.DefaultHttpxClient(
+        transport=RateLimitedTransport(openai_limiter, limits=httpx.Limits(max_connections=OPENAI_MAX_CONCURRENCY * 2))
+    )
+
+@lru_cache(maxsize=None)
+def get_openai_async_http_client():
+    import openai
+    return openai.DefaultAsyncHttpxClient(
+        transport=AsyncRateLimitedTransport(openai_limiter, limits=httpx.Limits(max_connections=OPENAI_MAX_CONCURRENCY * 2))
+    )
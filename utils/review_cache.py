@@ -0,0 +1,69 @@
+# utils/review_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from utils.config import REVIEW_INCREMENTAL, REVIEW_CACHE_PATH, REVIEW_CACHE_TTL
+
+def file_version(file):
+    """
+    Identify the reviewed content of a PR file.
+
+    Uses the blob SHA that the GitHub files endpoint returns, falling back to
+    a hash of the patch when it is missing.
+    """
+    if file.get("sha"):
+        return file["sha"]
+    return hashlib.sha1(file.get("patch", "").encode("utf-8")).hexdigest()
+
+class FileReviewCache:
+    """Per-file review findings stored in SQLite, keyed by repository, path and blob SHA."""
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_reviews ("
+            "repo TEXT NOT NULL, path TEXT NOT NULL, sha TEXT NOT NULL, "
+            "review TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (repo, path, sha))"
+        )
+
+    def get(self, repo, path, sha):
+        """Return the cached findings for a file version, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT review, created FROM file_reviews WHERE repo = ? AND path = ? AND sha = ?",
+                (repo, path, sha)
+            ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None
+        return row[0]
+
+    def set(self, repo, path, sha, review):
+        """Store the findings for a file version."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_reviews (repo, path, sha, review, created) VALUES (?, ?, ?, ?, ?)",
+                (repo, path, sha, review, time.time())
+            )
+
+    def clear(self, repo=None):
+        """Forget cached findings, for one repository or all of them."""
+        with self._lock:
+            if repo is None:
+                self._conn.execute("DELETE FROM file_reviews")
+            else:
+                self._conn.execute("DELETE FROM file_reviews WHERE repo = ?", (repo,))
+
+@lru_cache(maxsize=None)
+def get_review_cache():
+    """Get the shared per-file review cache, opened on first use; None disables incremental re-review."""
+    if not REVIEW_INCREMENTAL:
+        return None
+    return FileReviewCache(REVIEW_CACHE_PATH, ttl=REVIEW_CACHE_TTL)
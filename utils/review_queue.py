@@ -0,0 +1,577 @@
+# utils/review_queue.py
+import os
+import hmac
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import ipaddress
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.metrics import registry
+from utils.config import (
+    REVIEW_QUEUE_PATH,
+    REVIEW_QUEUE_WORKERS,
+    REVIEW_QUEUE_PER_REPO,
+    REVIEW_QUEUE_DEBOUNCE,
+    REVIEW_QUEUE_PRIORITIES,
+    REVIEW_QUEUE_MAX_ATTEMPTS,
+    REVIEW_QUEUE_LEASE,
+    REVIEW_QUEUE_POST,
+    REVIEW_WEBHOOK_HOST,
+    REVIEW_WEBHOOK_PORT,
+    REVIEW_WEBHOOK_SECRET
+)
+
+review_jobs = registry.counter(
+    "codecrafter_review_jobs_total", "Queued PR review jobs by what happened to them", ["event"])
+review_job_wait_seconds = registry.histogram(
+    "codecrafter_review_job_wait_seconds", "Time from queueing a PR review to a worker starting it")
+review_job_seconds = registry.histogram(
+    "codecrafter_review_job_seconds", "Time a worker spent on a PR review job", ["status"])
+
+# Largest webhook delivery accepted; pull_request payloads are usually well under 100 KB
+MAX_WEBHOOK_BYTES = 5 * 1024 * 1024
+
+def parse_priorities(text):
+    """Parse "action=priority,..." into a dict; actions that are not listed are ignored."""
+    priorities = {}
+    for item in text.split(","):
+        if "=" in item:
+            action, priority = item.split("=", 1)
+            priorities[action.strip()] = int(priority)
+    return priorities
+
+class ReviewQueue:
+    """
+    Persistent queue of PR review jobs in a SQLite file.
+
+    There is at most one queued job per pull request: queueing a newer head
+    supersedes the queued one, keeping the higher of their priorities, and
+    restarts the debounce delay, so a burst of pushes is reviewed once, at
+    its last commit. Workers claim due jobs by priority, never two of the
+    same pull request at once and at most `per_repo` of one repository.
+    A claim is a lease that the worker renews while it works; if the worker
+    dies, the job is retried once the lease runs out. Each claim counts as
+    an attempt, so a job's `attempts` identifies the claim, and finishing
+    or renewing fails once another worker has claimed the job again.
+    Several processes can share the file.
+    """
+
+    def __init__(self, path, per_repo=REVIEW_QUEUE_PER_REPO, max_attempts=REVIEW_QUEUE_MAX_ATTEMPTS,
+                 lease=REVIEW_QUEUE_LEASE):
+        self.path = path
+        self.per_repo = per_repo
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._lock = threading.Lock()
+        # Wakes this process's workers when a job is queued
+        self.changed = threading.Condition()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS review_jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, repo TEXT NOT NULL, "
+            "pr_number INTEGER NOT NULL, head_sha TEXT, action TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, not_before REAL NOT NULL, "
+            "lease_until REAL, created REAL NOT NULL, updated REAL NOT NULL, "
+            "review TEXT, comments INTEGER, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS review_jobs_status ON review_jobs (status, not_before)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS review_jobs_pr ON review_jobs (owner, repo, pr_number)")
+
+    def _transaction(self, fn):
+        """Run fn() in a write transaction, which also locks out other processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def enqueue(self, owner, repo, pr_number, head_sha=None, action="manual", priority=0,
+                delay=REVIEW_QUEUE_DEBOUNCE):
+        """
+        Queue a review of a pull request, superseding any queued one.
+
+        Args:
+            head_sha: The head commit to review; None reviews whatever the head is
+            delay: Seconds to wait for further pushes before starting
+
+        Returns:
+            The new job's ID
+        """
+        now = time.time()
+
+        def insert():
+            queued = self._conn.execute(
+                "SELECT id, priority FROM review_jobs "
+                "WHERE owner = ? AND repo = ? AND pr_number = ? AND status = 'queued'",
+                (owner, repo, pr_number)
+            ).fetchall()
+            if queued:
+                self._conn.execute(
+                    "UPDATE review_jobs SET status = 'superseded', updated = ? "
+                    "WHERE owner = ? AND repo = ? AND pr_number = ? AND status = 'queued'",
+                    (now, owner, repo, pr_number)
+                )
+            job_priority = max([priority] + [row["priority"] for row in queued])
+            cursor = self._conn.execute(
+                "INSERT INTO review_jobs (owner, repo, pr_number, head_sha, action, priority, status, "
+                "not_before, created, updated) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (owner, repo, pr_number, head_sha, action, job_priority, now + delay, now, now)
+            )
+            return cursor.lastrowid, len(queued)
+
+        job_id, superseded = self._transaction(insert)
+        review_jobs.inc(event="queued")
+        if superseded:
+            review_jobs.inc(superseded, event="superseded")
+        self._notify()
+        return job_id
+
+    def claim(self):
+        """Lease the next due job to the caller, or return None when none can run now."""
+        now = time.time()
+
+        def take():
+            # Jobs whose worker stopped renewing the lease go back in the queue
+            self._conn.execute(
+                "UPDATE review_jobs SET status = 'queued', updated = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts < ?",
+                (now, now, self.max_attempts)
+            )
+            self._conn.execute(
+                "UPDATE review_jobs SET status = 'failed', error = 'Worker stopped', updated = ? "
+                "WHERE status = 'running' AND lease_until < ?",
+                (now, now)
+            )
+            running = self._conn.execute(
+                "SELECT owner, repo, pr_number FROM review_jobs WHERE status = 'running'"
+            ).fetchall()
+            running_prs = {(row["owner"], row["repo"], row["pr_number"]) for row in running}
+            per_repo = {}
+            for row in running:
+                per_repo[(row["owner"], row["repo"])] = per_repo.get((row["owner"], row["repo"]), 0) + 1
+
+            due = self._conn.execute(
+                "SELECT * FROM review_jobs WHERE status = 'queued' AND not_before <= ? "
+                "ORDER BY priority DESC, not_before, id",
+                (now,)
+            )
+            for row in due:
+                if (row["owner"], row["repo"], row["pr_number"]) in running_prs:
+                    continue
+                if self.per_repo and per_repo.get((row["owner"], row["repo"]), 0) >= self.per_repo:
+                    continue
+                self._conn.execute(
+                    "UPDATE review_jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                    "updated = ? WHERE id = ?",
+                    (now + self.lease, now, row["id"])
+                )
+                return dict(row, status="running", attempts=row["attempts"] + 1)
+            return None
+
+        job = self._transaction(take)
+        if job is not None:
+            review_job_wait_seconds.observe(now - job["not_before"])
+        return job
+
+    def next_due(self):
+        """When the earliest queued job becomes due (a timestamp), or None if none is queued."""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(not_before) FROM review_jobs WHERE status = 'queued'").fetchone()
+        return row[0]
+
+    def is_superseded(self, job):
+        """True when a newer job has been queued for the same pull request."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM review_jobs WHERE owner = ? AND repo = ? AND pr_number = ? AND id > ? "
+                "AND status IN ('queued', 'running') LIMIT 1",
+                (job["owner"], job["repo"], job["pr_number"], job["id"])
+            ).fetchone()
+        return row is not None
+
+    def renew(self, job):
+        """
+        Extend the lease of a claimed job.
+
+        Returns:
+            False when the claim is no longer held: the lease ran out, or the
+            job was finished or claimed again
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE review_jobs SET lease_until = ?, updated = ? "
+                "WHERE id = ? AND attempts = ? AND status = 'running' AND lease_until >= ?",
+                (now + self.lease, now, job["id"], job["attempts"], now)
+            )
+        return cursor.rowcount > 0
+
+    def finish(self, job, status, review=None, comments=None, head_sha=None):
+        """
+        Record a job as done or superseded.
+
+        Returns:
+            False, recording nothing, when the claim is no longer held
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE review_jobs SET status = ?, review = ?, comments = ?, head_sha = COALESCE(?, head_sha), "
+                "lease_until = NULL, updated = ? "
+                "WHERE id = ? AND attempts = ? AND status = 'running' AND lease_until >= ?",
+                (status, review, comments, head_sha, now, job["id"], job["attempts"], now)
+            )
+        finished = cursor.rowcount > 0
+        review_jobs.inc(event=status if finished else "lease_lost")
+        return finished
+
+    def fail(self, job, error):
+        """Record a failed attempt: retry with backoff, or give up after max_attempts."""
+        now = time.time()
+        retry = job["attempts"] < self.max_attempts
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE review_jobs SET status = ?, error = ?, not_before = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND attempts = ? AND status = 'running'",
+                ("queued" if retry else "failed", error, now + min(300, 10 * 2 ** job["attempts"]), now,
+                 job["id"], job["attempts"])
+            )
+        if cursor.rowcount == 0:
+            review_jobs.inc(event="lease_lost")
+            return
+        review_jobs.inc(event="retried" if retry else "failed")
+        if retry:
+            self._notify()
+
+    def jobs(self, limit=50, ids=None):
+        """The most recent jobs, newest first, as dicts; only those in `ids` when it is given."""
+        if ids is not None and not ids:
+            return []
+        where = f"WHERE id IN ({', '.join('?' * len(ids))}) " if ids else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM review_jobs {where}ORDER BY id DESC LIMIT ?", (*(ids or ()), limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        """Number of jobs by status."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM review_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+@lru_cache(maxsize=None)
+def get_review_queue():
+    """Get the shared review queue, opened on first use."""
+    return ReviewQueue(REVIEW_QUEUE_PATH)
+
+class ReviewWorkers:
+    """
+    Threads that run queued PR reviews with GitHubAPI and generate_pr_review.
+
+    A job reviews the pull request's current head. If the head moved since
+    the job was queued, or a newer job was queued while the review ran, the
+    job is marked superseded instead of posting a review of an old commit.
+    A heartbeat renews the job's lease while it runs, and the review is only
+    posted while the lease is still held, so a job is never posted twice.
+
+    Args:
+        github_api: Callable that returns the GitHubAPI to use for a job
+        post: Post each finished review to GitHub
+    """
+
+    def __init__(self, queue, workers=REVIEW_QUEUE_WORKERS, github_api=None, post=REVIEW_QUEUE_POST,
+                 poll_interval=1.0):
+        from utils.github_api import GitHubAPI
+
+        self.queue = queue
+        self.worker_count = workers
+        self.github_api = github_api or GitHubAPI
+        self.post = post
+        self.poll_interval = poll_interval
+        self.threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._run, name=f"codecrafter-review-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Stop after the jobs in progress."""
+        self._stopping.set()
+        with self.queue.changed:
+            self.queue.changed.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            job = self.queue.claim()
+            if job is None:
+                # Sleep until the next queued job is due, a new one arrives, or the poll interval passes
+                wait = self.poll_interval
+                due = self.queue.next_due()
+                if due is not None:
+                    wait = max(0.01, min(wait, due - time.time()))
+                with self.queue.changed:
+                    self.queue.changed.wait(wait)
+                continue
+            self.run_job(job)
+
+    def _heartbeat(self, job, done):
+        """Renew a job's lease until `done` is set or the lease is lost."""
+        interval = self.queue.lease / 3
+        while not done.wait(interval):
+            if not self.queue.renew(job):
+                print(f"Lost the lease on review job {job['id']}")
+                return
+
+    def run_job(self, job):
+        """Review one claimed job and record the outcome."""
+        from utils.pr_reviewer import generate_pr_review, extract_line_comments, build_review_comments
+
+        started = time.perf_counter()
+        status = "error"
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, done), name=f"codecrafter-lease-{job['id']}",
+                         daemon=True).start()
+        try:
+            github_api = self.github_api()
+            owner, repo, pr_number = job["owner"], job["repo"], job["pr_number"]
+            pr_details = github_api.get_pull_request(owner, repo, pr_number)
+            head_sha = pr_details["head"]["sha"]
+            if (job["head_sha"] and head_sha != job["head_sha"]) or self.queue.is_superseded(job):
+                # A newer push; its webhook queues (or has queued) the review of the new head
+                status = "superseded"
+                if not self.queue.is_superseded(job):
+                    self.queue.enqueue(owner, repo, pr_number, head_sha, job["action"], job["priority"])
+                self.queue.finish(job, status)
+                return
+
+            files = github_api.get_pull_request_files(owner, repo, pr_number)
+            review = generate_pr_review(
+                f"{owner}/{repo}", pr_number, pr_details.get("title", ""), pr_details.get("body") or "", files
+            )
+            if self.queue.is_superseded(job):
+                status = "superseded"
+                self.queue.finish(job, status, review=review, head_sha=head_sha)
+                return
+
+            comments, unmapped = build_review_comments(extract_line_comments(review), files)
+            # Renewing right before posting also checks that no other worker has taken the job over
+            if not self.queue.renew(job):
+                status = "lease_lost"
+                review_jobs.inc(event=status)
+                return
+            if self.post:
+                github_api.submit_pull_request_review(owner, repo, pr_number, head_sha, comments, body=review)
+            status = "done"
+            self.queue.finish(job, status, review=review, comments=len(comments), head_sha=head_sha)
+        except Exception as e:
+            print(f"Error reviewing {job['owner']}/{job['repo']}#{job['pr_number']}: {e}")
+            self.queue.fail(job, str(e))
+        finally:
+            done.set()
+            review_job_seconds.observe(time.perf_counter() - started, status=status)
+
+_workers = None
+_workers_lock = threading.Lock()
+
+def start_review_workers():
+    """Start workers for the shared queue in this process, once; safe to call on every Streamlit rerun."""
+    global _workers
+    with _workers_lock:
+        if _workers is None:
+            _workers = ReviewWorkers(get_review_queue()).start()
+        return _workers
+
+def is_loopback(host):
+    """True when `host` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def verify_signature(secret, body, signature):
+    """Check GitHub's X-Hub-Signature-256 header against the delivery body."""
+    expected = "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+class WebhookReceiver:
+    """
+    HTTP endpoint for GitHub pull_request webhooks that queues reviews.
+
+    Deliveries go to POST /webhook. Actions with a priority in
+    REVIEW_QUEUE_PRIORITIES queue a review of the delivered head commit;
+    draft and closed pull requests and other events are acknowledged and
+    ignored. GET /jobs lists recent jobs and GET /healthz the queue counts.
+
+    Deliveries must be signed with `secret`. Without a secret, unsigned
+    deliveries are only accepted on a loopback interface.
+    """
+
+    def __init__(self, queue, host=REVIEW_WEBHOOK_HOST, port=REVIEW_WEBHOOK_PORT, secret=REVIEW_WEBHOOK_SECRET,
+                 priorities=None, debounce=REVIEW_QUEUE_DEBOUNCE):
+        self.queue = queue
+        self.secret = secret
+        self.accept_unsigned = not secret and is_loopback(host)
+        self.priorities = priorities if priorities is not None else parse_priorities(REVIEW_QUEUE_PRIORITIES)
+        self.debounce = debounce
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="codecrafter-webhooks", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, event, payload):
+        """
+        Act on a delivery.
+
+        Returns:
+            A (status, body) response
+        """
+        if event == "ping":
+            return 200, {"ok": True}
+        if event != "pull_request":
+            return 202, {"ignored": f"event {event}"}
+        action = payload.get("action")
+        pr = payload.get("pull_request") or {}
+        if action not in self.priorities:
+            return 202, {"ignored": f"action {action}"}
+        if pr.get("state") == "closed" or pr.get("draft"):
+            return 202, {"ignored": "closed or draft pull request"}
+
+        repository = payload["repository"]
+        job_id = self.queue.enqueue(
+            repository["owner"]["login"], repository["name"], pr.get("number") or payload["number"],
+            head_sha=(pr.get("head") or {}).get("sha"), action=action, priority=self.priorities[action],
+            delay=self.debounce
+        )
+        return 202, {"job_id": job_id}
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/healthz":
+                    self.send_json(200, receiver.queue.stats())
+                elif path == "/jobs":
+                    jobs = [{k: v for k, v in job.items() if k != "review"} for job in receiver.queue.jobs()]
+                    self.send_json(200, jobs)
+                else:
+                    self.send_json(404, {"error": "Not found"})
+
+            def do_POST(self):
+                if self.path.split("?")[0] != "/webhook":
+                    self.send_json(404, {"error": "Not found"})
+                    return
+                length = int(self.headers.get("Content-Length", "0"))
+                if length > MAX_WEBHOOK_BYTES:
+                    self.send_json(413, {"error": "Payload too large"})
+                    return
+                body = self.rfile.read(length)
+                if not receiver.secret and not receiver.accept_unsigned:
+                    self.send_json(401, {"error": "REVIEW_WEBHOOK_SECRET is not set"})
+                    return
+                if receiver.secret and not verify_signature(
+                        receiver.secret, body, self.headers.get("X-Hub-Signature-256")):
+                    self.send_json(401, {"error": "Invalid signature"})
+                    return
+                try:
+                    payload = json.loads(body or b"{}")
+                    status, response = receiver.handle(self.headers.get("X-GitHub-Event", ""), payload)
+                except (ValueError, KeyError, TypeError) as e:
+                    status, response = 400, {"error": f"Malformed payload: {e}"}
+                self.send_json(status, response)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive GitHub pull_request webhooks and review PRs in the background.")
+    parser.add_argument("--host", default=REVIEW_WEBHOOK_HOST, help="Interface for the webhook receiver")
+    parser.add_argument("--port", type=int, default=REVIEW_WEBHOOK_PORT, help="Port for the webhook receiver")
+    parser.add_argument("--workers", type=int, default=REVIEW_QUEUE_WORKERS, help="Reviews run at once")
+    parser.add_argument("--queue", default=REVIEW_QUEUE_PATH, help="SQLite file of the job queue")
+    parser.add_argument("--debounce", type=float, default=REVIEW_QUEUE_DEBOUNCE,
+                        help="Seconds to wait for further pushes before reviewing")
+    parser.add_argument("--post", action="store_true", default=REVIEW_QUEUE_POST,
+                        help="Post finished reviews to GitHub instead of only keeping them in the queue")
+    parser.add_argument("--fake-llm", action="store_true", help="Review with the offline benchmark LLMs")
+    args = parser.parse_args()
+
+    queue = ReviewQueue(args.queue)
+    receiver = WebhookReceiver(queue, args.host, args.port, debounce=args.debounce)
+
+    def serve():
+        workers = ReviewWorkers(queue, args.workers, post=args.post).start()
+        receiver.start()
+        print(f"Receiving webhooks at {receiver.url} with {args.workers} review workers")
+        if not receiver.secret and not receiver.accept_unsigned:
+            print("REVIEW_WEBHOOK_SECRET is not set: deliveries will be rejected on a non-loopback interface")
+        try:
+            while True:
+                time.sleep(3600)
+        finally:
+            receiver.stop()
+            workers.stop()
+
+    if args.fake_llm:
+        from benchmarks.fakes import fake_llms
+        with fake_llms():
+            serve()
+    else:
+        serve()
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
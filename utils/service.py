@@ -0,0 +1,433 @@
+# utils/service.py
+import json
+import time
+import asyncio
+import argparse
+import threading
+import contextvars
+from http import HTTPStatus
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from utils.config import (
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_WORKERS,
+    SERVICE_QUEUE_SIZE,
+    SERVICE_MAX_BODY_BYTES,
+    SERVICE_STREAM_BUFFER,
+    SERVICE_TOKEN
+)
+from utils.metrics import registry
+from utils.model_router import Restart
+
+service_seconds = registry.histogram(
+    "codecrafter_service_request_seconds", "Wall time of a service request, to the last chunk for streams",
+    ["route", "status"])
+service_rejected = registry.counter(
+    "codecrafter_service_rejected_total", "Service requests turned away because the queue was full", ["route"])
+
+# Marks the end of a stream in a job's chunk queue
+END_OF_STREAM = object()
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+def require(body, name):
+    """Return a required field of a JSON request body."""
+    value = body.get(name)
+    if value is None or value == "":
+        raise HTTPError(400, f"Missing field: {name}")
+    return value
+
+# Pipelines run on worker threads. Each route turns a request body into the
+# function to call and its arguments; streaming routes return a generator
+# function. Modules are imported on first use, as in the app.
+
+def generate_code_route(body, stream):
+    from utils.code_generator import generate_code, stream_code
+    return (stream_code if stream else generate_code), (require(body, "language"), require(body, "task"))
+
+def explain_code_route(body, stream):
+    from utils.explainer import explain_code, stream_explanation
+    return (stream_explanation if stream else explain_code), (require(body, "code"),)
+
+def generate_tests_route(body, stream):
+    from utils.test_generator import generate_tests, stream_tests
+    return (stream_tests if stream else generate_tests), (require(body, "code"), body.get("testing_framework") or "pytest")
+
+def run_agent_route(body, stream):
+    from utils.agents import run_agent
+    if stream:
+        raise HTTPError(400, "run_agent does not stream")
+    return run_agent, (require(body, "input"), require(body, "code"), require(body, "language"), body.get("tool"))
+
+def search_snippets_route(body, stream):
+    from utils.simple_vector_store import get_vector_store
+
+    def search(query, n_results, language, mode):
+        store = get_vector_store()
+        if mode == "semantic":
+            return store.search_similar(query, n_results, language)
+        return store.search_snippets(query, n_results, language)
+
+    mode = body.get("mode") or "keyword"
+    if mode not in ("keyword", "semantic"):
+        raise HTTPError(400, "mode must be keyword or semantic")
+    return search, (require(body, "query"), int(body.get("n_results") or 5), body.get("language"), mode)
+
+def add_snippet_route(body, stream):
+    import uuid
+    from utils.simple_vector_store import get_vector_store
+
+    def add(snippet_id, code, metadata):
+        return {"id": get_vector_store().add_snippet(snippet_id, code, metadata)}
+
+    metadata = body.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        raise HTTPError(400, "metadata must be an object")
+    metadata.setdefault("timestamp", time.time())
+    return add, (body.get("snippet_id") or str(uuid.uuid4()), require(body, "code"), metadata)
+
+def pr_review_route(body, stream):
+    from utils.github_api import GitHubAPI
+    from utils.pr_reviewer import generate_pr_review, stream_pr_review, extract_line_comments
+
+    owner, repo, pr_number = require(body, "owner"), require(body, "repo"), int(require(body, "pr_number"))
+
+    def fetch():
+        github_api = GitHubAPI()
+        pr_details = github_api.get_pull_request(owner, repo, pr_number)
+        files = github_api.get_pull_request_files(owner, repo, pr_number)
+        return (f"{owner}/{repo}", pr_number, pr_details["title"], pr_details.get("body") or "", files)
+
+    def review():
+        text = generate_pr_review(*fetch())
+        return {"review": text, "line_comments": extract_line_comments(text)}
+
+    def stream_review():
+        yield from stream_pr_review(*fetch())
+
+    return (stream_review if stream else review), ()
+
+ROUTES = {
+    "/v1/generate_code": generate_code_route,
+    "/v1/explain_code": explain_code_route,
+    "/v1/generate_tests": generate_tests_route,
+    "/v1/run_agent": run_agent_route,
+    "/v1/snippets/search": search_snippets_route,
+    "/v1/snippets": add_snippet_route,
+    "/v1/pr_review": pr_review_route,
+}
+
+class ServiceJob:
+    """A queued pipeline call, with a future for its result or a queue of its chunks."""
+
+    def __init__(self, loop, fn, args, stream):
+        self.fn = fn
+        self.args = args
+        self.stream = stream
+        self.future = loop.create_future()
+        self.chunks = asyncio.Queue() if stream else None
+        # Chunks the producer may hand over before the client has taken them
+        self.credits = threading.Semaphore(SERVICE_STREAM_BUFFER) if stream else None
+        self.cancelled = threading.Event()
+        # Keeps the caller's context variables, such as the metrics feature, on the worker thread
+        self.context = contextvars.copy_context()
+
+class CodeCrafterService:
+    """
+    Headless asyncio HTTP server for the CodeCrafter pipelines.
+
+    Requests are parsed on the event loop and queued; a fixed pool of
+    workers runs them on threads, since the pipelines block. A full queue
+    is answered with 503 and Retry-After instead of piling up work, and
+    streaming responses (NDJSON, {"stream": true}) only pull the next
+    chunk from the model once the client has taken the previous ones.
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, queue_size=SERVICE_QUEUE_SIZE, token=SERVICE_TOKEN):
+        self.worker_count = workers
+        self.queue_size = queue_size
+        self.token = token
+        self.loop = None
+        self.queue = None
+        self.server = None
+        self.workers = []
+        self.executor = None
+        self.connections = set()
+        self.busy = 0
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix="codecrafter-service")
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        # Idle keep-alive connections would otherwise wait for requests forever
+        tasks = self.workers + list(self.connections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, route, fn, args, stream):
+        """Queue a pipeline call, or raise a 503 when the queue is full."""
+        job = ServiceJob(self.loop, fn, args, stream)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            service_rejected.inc(route=route)
+            raise HTTPError(503, "Server busy, retry later", {"Retry-After": "1"})
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            self.busy += 1
+            try:
+                if job.stream:
+                    await self.loop.run_in_executor(self.executor, job.context.run, self._produce, job)
+                else:
+                    result = await self.loop.run_in_executor(self.executor, job.context.run, job.fn, *job.args)
+                    if not job.future.done():
+                        job.future.set_result(result)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.busy -= 1
+                self.queue.task_done()
+
+    def _produce(self, job):
+        """Run a streaming pipeline on a worker thread, handing its chunks to the event loop."""
+        def put(item):
+            # Blocks while the buffer is full, which holds back the model stream
+            job.credits.acquire()
+            self.loop.call_soon_threadsafe(job.chunks.put_nowait, item)
+
+        chunks = None
+        try:
+            chunks = job.fn(*job.args)
+            for chunk in chunks:
+                if job.cancelled.is_set():
+                    break
+                put(chunk)
+            put(END_OF_STREAM)
+        except Exception as e:
+            put(e)
+        finally:
+            if chunks is not None:
+                chunks.close()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                if not await self._respond(request, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # The client went away, or the service is stopping
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _respond(self, request, writer):
+        """Answer one request; returns whether the connection can be reused."""
+        method, path, headers, body = request
+        keep_alive = headers.get("connection", "").lower() != "close"
+        route = path if path in ROUTES or path in ("/healthz", "/metrics") else "other"
+        started = time.perf_counter()
+        status = 500
+        try:
+            if path == "/healthz" and method == "GET":
+                status = 200
+                await send_json(writer, 200, {
+                    "status": "ok", "workers": self.worker_count, "busy": self.busy, "queued": self.queue.qsize()
+                }, keep_alive=keep_alive)
+            elif path == "/metrics" and method == "GET":
+                status = 200
+                await send_response(writer, 200, registry.render().encode("utf-8"),
+                                    "text/plain; version=0.0.4; charset=utf-8", keep_alive=keep_alive)
+            elif path in ROUTES:
+                if method != "POST":
+                    raise HTTPError(405, "Use POST", {"Allow": "POST"})
+                if self.token and headers.get("authorization") != f"Bearer {self.token}":
+                    raise HTTPError(401, "Missing or invalid bearer token")
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    raise HTTPError(400, "Body must be JSON")
+                if not isinstance(payload, dict):
+                    raise HTTPError(400, "Body must be a JSON object")
+                stream = bool(payload.get("stream"))
+                fn, args = ROUTES[path](payload, stream)
+                job = self.submit(route, fn, args, stream)
+                if stream:
+                    status = 200
+                    await self._send_stream(writer, job, keep_alive)
+                else:
+                    result = await job.future
+                    status = 200
+                    await send_json(writer, 200, {"result": result}, keep_alive=keep_alive)
+            else:
+                raise HTTPError(404, "Not found")
+        except HTTPError as e:
+            status = e.status
+            await send_json(writer, e.status, {"error": e.message}, e.headers, keep_alive=keep_alive)
+        except (ConnectionError, asyncio.CancelledError):
+            status = 499
+            raise
+        except Exception as e:
+            status = 500
+            await send_json(writer, 500, {"error": str(e)}, keep_alive=keep_alive)
+        finally:
+            service_seconds.observe(time.perf_counter() - started, route=route, status=status)
+        return keep_alive
+
+    async def _send_stream(self, writer, job, keep_alive):
+        """
+        Send a job's chunks as chunked NDJSON: {"chunk": ...} lines, then {"done": true} or {"error": ...}.
+
+        A {"restart": true} line means the text so far failed validation and
+        a stronger model's response follows; clients drop what they have.
+        """
+        await send_head(writer, 200, "application/x-ndjson", {"Transfer-Encoding": "chunked"}, keep_alive)
+        try:
+            done = False
+            while not done:
+                items = [await job.chunks.get()]
+                # Send whatever else is ready in the same write
+                while not job.chunks.empty():
+                    items.append(job.chunks.get_nowait())
+                job.credits.release(len(items))
+                data = b""
+                for item in items:
+                    if item is END_OF_STREAM:
+                        line = {"done": True}
+                    elif isinstance(item, Exception):
+                        line = {"error": str(item)}
+                    elif isinstance(item, Restart):
+                        line = {"restart": True}
+                    else:
+                        line = {"chunk": item}
+                    data += (json.dumps(line) + "\n").encode("utf-8")
+                    done = "done" in line or "error" in line
+                writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                # Waits while the client is slow to read, so the stream slows down too
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except BaseException:
+            # The client went away: stop the producer, unblocking it if it waits for credits
+            job.cancelled.set()
+            job.credits.release(SERVICE_STREAM_BUFFER)
+            raise
+
+async def read_request(reader):
+    """
+    Read one HTTP/1.1 request.
+
+    Returns:
+        A (method, path, headers, body) tuple with lowercased header names,
+        or None when the client closed the connection
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HTTPError(400, "Incomplete request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > SERVICE_MAX_BODY_BYTES:
+        raise HTTPError(413, f"Body larger than {SERVICE_MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), urlsplit(target).path, headers, body
+
+async def send_head(writer, status, content_type, headers=None, keep_alive=True):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}"]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+async def send_response(writer, status, data, content_type, headers=None, keep_alive=True):
+    await send_head(writer, status, content_type, dict(headers or {}, **{"Content-Length": len(data)}), keep_alive)
+    writer.write(data)
+    await writer.drain()
+
+async def send_json(writer, status, body, headers=None, keep_alive=True):
+    await send_response(writer, status, json.dumps(body).encode("utf-8"), "application/json", headers, keep_alive)
+
+async def serve(host, port, workers, queue_size):
+    service = await CodeCrafterService(workers, queue_size).start(host, port)
+    print(f"CodeCrafter service listening on http://{host}:{service.port} "
+          f"({workers} workers, queue of {queue_size})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the CodeCrafter pipelines over HTTP.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Interface to bind")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to bind (0 for any free port)")
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Pipeline calls run at once")
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE,
+                        help="Requests waiting for a worker before new ones get 503")
+    parser.add_argument("--fake-llm", action="store_true",
+                        help="Answer with the offline benchmark LLMs instead of OpenAI, for load tests")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="Fake LLM time to first token, in seconds")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        from benchmarks.fakes import fake_llms
+        with fake_llms(latency=args.fake_latency):
+            asyncio.run(serve(args.host, args.port, args.workers, args.queue_size))
+    else:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue_size))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -1,85 +1,452 @@
 # utils/simple_vector_store.py
-import os
-import json
 import time
-from utils.config import VECTOR_STORE_PATH
+from functools import lru_cache
+from utils.config import (
+    VECTOR_STORE_PATH,
+    VECTOR_STORE_LOG_PATH,
+    VECTOR_STORE_FSYNC_BATCH,
+    VECTOR_STORE_FSYNC_INTERVAL,
+    VECTOR_STORE_COMPACT_EVERY,
+    VECTOR_STORE_SHARED,
+    VECTOR_STORE_DEDUP,
+    VECTOR_STORE_DEDUP_DISTANCE,
+    VECTOR_STORE_SEGMENTS,
+    VECTOR_STORE_SEGMENT_PATH,
+    VECTOR_STORE_SEGMENT_GARBAGE,
+    EMBEDDER,
+    EMBEDDING_DIM,
+    EMBEDDING_INDEX_PATH
+)
+from utils.snippet_index import InvertedIndex, parse_timestamp
+from utils.near_duplicates import SimHashIndex, simhash, normalize_task
+from utils.snippet_journal import SnippetJournal
+from utils.snippet_segments import SegmentFile, SegmentSnippets
+from utils.locks import ReadWriteLock
+from utils.embeddings import get_embedder
+from utils.vector_matrix import EmbeddingMatrix
+
+# Number of snippets embedded per batch when (re)building the matrix
+EMBED_BATCH_SIZE = 256
+
+def embedding_text(code, metadata):
+    """Text used to embed a snippet: its task description followed by the code."""
+    return f"{metadata.get('task', '')}\n{code}"
 
 class SimpleVectorStore:
-    def __init__(self):
-        self.snippets = {}
+    """
+    Snippet store with keyword and embedding search.
+    
+    Each snippet carries a SimHash fingerprint of its code. With `dedup`,
+    a new snippet for the same task (ignoring case and punctuation) whose
+    fingerprint is near an existing one in the same language is merged
+    into it, which counts the duplicate in the existing snippet's metadata
+    instead of storing the code again.
+    
+    With `segment_path` set, code is kept out of memory: it is stored
+    compressed and deduplicated in a memory-mapped segment file, and only
+    read back for search results and re-indexing.
+    
+    All access goes through an in-process reader/writer lock, so Streamlit
+    session threads can share one instance. With `shared=True` the journal
+    is also locked across processes, and every read first picks up records
+    that other processes appended to the journal.
+    """
+    
+    def __init__(self, path=VECTOR_STORE_PATH, log_path=VECTOR_STORE_LOG_PATH, shared=VECTOR_STORE_SHARED,
+                 dedup=VECTOR_STORE_DEDUP, dedup_distance=VECTOR_STORE_DEDUP_DISTANCE,
+                 segment_path=VECTOR_STORE_SEGMENT_PATH if VECTOR_STORE_SEGMENTS else None):
+        self.segments = SegmentFile(segment_path, shared=shared) if segment_path else None
+        self.snippets = self._new_snippets()
+        self.index = InvertedIndex()
+        self.dedup = dedup
+        self.fingerprints = SimHashIndex(dedup_distance)
+        self.lock = ReadWriteLock()
+        self.journal = SnippetJournal(
+            path,
+            log_path,
+            fsync_batch=VECTOR_STORE_FSYNC_BATCH,
+            fsync_interval=VECTOR_STORE_FSYNC_INTERVAL,
+            compact_every=VECTOR_STORE_COMPACT_EVERY,
+            shared=shared
+        )
+        self.journal.compact_callback = self.save_snippets
+        self.embedder = get_embedder(EMBEDDER, EMBEDDING_DIM)
+        # Row order differs between processes, so a memory-mapped matrix cannot be shared
+        self.vectors = EmbeddingMatrix(
+            EMBEDDING_DIM,
+            (EMBEDDING_INDEX_PATH or None) if not shared else None,
+            signature=f"{self.embedder.name}:{EMBEDDING_DIM}"
+        )
         self.load_snippets()
     
     def load_snippets(self):
-        """Load snippets from file if it exists."""
+        """Load snippets from the snapshot plus the journal tail."""
+        with self.lock.write(), self.journal.shared_lock():
+            self._load()
+    
+    def _new_snippets(self):
+        return SegmentSnippets(self.segments) if self.segments is not None else {}
+    
+    def _load(self):
+        if self.segments is not None:
+            # Another process may have rewritten the segment file during a compaction
+            self.segments.reopen()
         try:
-            if os.path.exists(VECTOR_STORE_PATH):
-                with open(VECTOR_STORE_PATH, 'r') as f:
-                    self.snippets = json.load(f)
+            self.snippets = self.journal.load(self._new_snippets())
         except Exception as e:
             print(f"Error loading snippets: {e}")
-            self.snippets = {}
+            self.snippets = self._new_snippets()
+        self.rebuild_index()
+    
+    def _metadata(self, snippet_id):
+        """A snippet's metadata, without reading its code from the segment file."""
+        if self.segments is not None:
+            return self.snippets.metadata(snippet_id)
+        return self.snippets[snippet_id]["metadata"]
+    
+    def _sync(self):
+        """Apply changes made by other processes. Requires the write lock."""
+        status = self.journal.poll()
+        if status == "reload":
+            self._load()
+        elif status == "tail":
+            for record in self.journal.read_tail():
+                self._apply(record)
+    
+    def _apply(self, record, vector=None):
+        """Apply a journal record to the in-memory snippets and indexes."""
+        snippet_id = record["id"]
+        previous = self.snippets.get(snippet_id)
+        SnippetJournal.apply(record, self.snippets)
+        if snippet_id in self.snippets:
+            # The record holds what was just stored, without reading it back from a segment file
+            code = record["code"]
+            metadata = record["metadata"]
+            fingerprint = record.get("fingerprint")
+            if fingerprint is None:
+                fingerprint = self._fingerprint(self.snippets[snippet_id])
+            text = embedding_text(code, metadata)
+            # Merges only change the metadata, so keep the vector rather than embed again
+            unchanged = previous is not None and embedding_text(previous["code"], previous["metadata"]) == text
+            if vector is None and not (unchanged and snippet_id in self.vectors):
+                vector = self.embedder.embed_query(text)
+            self.index.add(snippet_id, code, metadata)
+            if vector is not None:
+                self.vectors.add(snippet_id, vector)
+            self.fingerprints.add(snippet_id, fingerprint)
+        else:
+            self.index.remove(snippet_id)
+            self.vectors.remove(snippet_id)
+            self.fingerprints.remove(snippet_id)
+    
+    @staticmethod
+    def _fingerprint(snippet):
+        """Return a snippet's fingerprint, computing it for snippets stored before fingerprints were."""
+        if "fingerprint" not in snippet:
+            snippet["fingerprint"] = simhash(snippet["code"])
+        return snippet["fingerprint"]
+    
+    @staticmethod
+    def _tasks(metadata):
+        """Normalised task descriptions of a snippet, including those of snippets merged into it."""
+        return {normalize_task(task) for task in [metadata.get("task", "")] + metadata.get("tasks", [])}
+    
+    def _find_duplicate(self, snippet_id, metadata, fingerprint, index=None):
+        """Return the ID of a near-duplicate of a snippet for the same task and language, or None."""
+        if index is None:
+            index = self.fingerprints
+        language = str(metadata.get("language", "")).lower()
+        tasks = self._tasks(metadata)
+        for candidate, _distance in index.query(fingerprint):
+            if candidate == snippet_id:
+                continue
+            candidate_metadata = self._metadata(candidate)
+            if str(candidate_metadata.get("language", "")).lower() == language and \
+                    tasks & self._tasks(candidate_metadata):
+                return candidate
+        return None
+    
+    def _merge_record(self, snippet_id, duplicates):
+        """
+        Build the put record that folds `duplicates` into a stored snippet.
+        
+        The snippet keeps its code and gains a count of the duplicates it
+        absorbed and the timestamp of the latest one. Task descriptions that
+        differ from its own, if only in wording, are kept in
+        metadata["tasks"] so that search still finds them.
+        
+        Args:
+            duplicates: Metadata dicts of the merged snippets
+        """
+        snippet = self.snippets[snippet_id]
+        metadata = dict(snippet["metadata"])
+        metadata["duplicates"] = metadata.get("duplicates", 0) + sum(1 + d.get("duplicates", 0) for d in duplicates)
+        seen = [parse_timestamp(d.get("last_seen", d.get("timestamp"))) for d in duplicates]
+        seen = [t for t in seen + [parse_timestamp(metadata.get("last_seen"))] if t is not None]
+        if seen:
+            metadata["last_seen"] = max(seen)
+        tasks = list(metadata.get("tasks", []))
+        for d in duplicates:
+            for task in [d.get("task")] + d.get("tasks", []):
+                if task and task != metadata.get("task") and task not in tasks:
+                    tasks.append(task)
+        if tasks:
+            metadata["tasks"] = tasks
+        return {
+            "op": "put",
+            "id": snippet_id,
+            "code": snippet["code"],
+            "metadata": metadata,
+            "fingerprint": self._fingerprint(snippet)
+        }
+    
+    def refresh(self):
+        """Pick up inserts from other processes sharing the store (shared mode only)."""
+        if not self.journal.shared or self.journal.poll() == "none":
+            return
+        with self.lock.write(), self.journal.shared_lock():
+            self._sync()
+    
+    def rebuild_index(self):
+        """Rebuild the search index from the loaded snippets."""
+        self.index = InvertedIndex()
+        self.fingerprints = SimHashIndex(self.fingerprints.max_distance)
+        for snippet_id, snippet_data in self.snippets.items():
+            self.index.add(snippet_id, snippet_data["code"], snippet_data["metadata"])
+            self.fingerprints.add(snippet_id, self._fingerprint(snippet_data))
+        self.rebuild_vectors()
+    
+    def rebuild_vectors(self):
+        """Bring the embedding matrix in line with the loaded snippets, embedding only what is missing."""
+        self.vectors.close()
+        self.vectors = EmbeddingMatrix(self.vectors.dim, self.vectors.path, self.vectors.signature)
+        for snippet_id in self.vectors.load():
+            if snippet_id not in self.snippets:
+                self.vectors.remove(snippet_id)
+        
+        missing = [snippet_id for snippet_id in self.snippets if snippet_id not in self.vectors]
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            batch = missing[start:start + EMBED_BATCH_SIZE]
+            snippets = [self.snippets[i] for i in batch]
+            texts = [embedding_text(snippet["code"], snippet["metadata"]) for snippet in snippets]
+            self.vectors.add_many(batch, self.embedder.embed_documents(texts))
     
     def save_snippets(self):
-        """Save snippets to file."""
+        """Compact the journal into a full snapshot file."""
         try:
-            with open(VECTOR_STORE_PATH, 'w') as f:
-                json.dump(self.snippets, f)
+            if self.journal.shared:
+                # Other processes must not append while the log is folded into the snapshot
+                with self.lock.write(), self.journal.exclusive():
+                    self._sync()
+                    self.journal.compact(self.snippets)
+                    self.vectors.save()
+                    self._reclaim_segments()
+            else:
+                self.journal.compact(self.snippets)
+                with self.lock.read():
+                    self.vectors.save()
+                with self.lock.write():
+                    self._reclaim_segments()
         except Exception as e:
             print(f"Error saving snippets: {e}")
     
+    def _reclaim_segments(self):
+        """Drop deleted and merged snippets' code from the segment file. Requires the write lock."""
+        if self.segments is None:
+            return
+        reclaimed = self.snippets.reclaim(VECTOR_STORE_SEGMENT_GARBAGE)
+        if reclaimed:
+            print(f"Reclaimed {reclaimed} bytes from the snippet segment file")
+    
     def add_snippet(self, snippet_id, code, metadata=None):
-        """Add a code snippet to the store."""
-        if metadata is None:
-            metadata = {}
-        # Ensure required metadata fields
-        metadata.setdefault("language", "unknown")
-        metadata.setdefault("task", "unknown")
-        metadata.setdefault("timestamp", str(time.time()))
-        
-        self.snippets[snippet_id] = {
-            "code": code,
-            "metadata": metadata
-        }
+        """
+        Add a code snippet to the store.
+        
+        Returns:
+            The ID the snippet is stored under: snippet_id, or the ID of the
+            existing snippet it was merged into
+        """
+        return self.add_snippets([(snippet_id, code, metadata)])[0]
+    
+    def add_snippets(self, snippets):
+        """
+        Add several code snippets with a single journal write.
+        
+        Args:
+            snippets: Iterable of (snippet_id, code, metadata) tuples
+        
+        Returns:
+            The ID each snippet is stored under, in order; see add_snippet
+        """
+        records = []
+        for snippet_id, code, metadata in snippets:
+            if metadata is None:
+                metadata = {}
+            # Ensure required metadata fields
+            metadata.setdefault("language", "unknown")
+            metadata.setdefault("task", "unknown")
+            metadata.setdefault("timestamp", str(time.time()))
+            records.append({"op": "put", "id": snippet_id, "code": code, "metadata": metadata,
+                            "fingerprint": simhash(code)})
+        if not records:
+            return []
+        
+        # Embed outside the lock, since the embedder may call a remote API,
+        # and skip snippets that already have a near-duplicate in the store
+        new = records
+        if self.dedup:
+            self.refresh()
+            with self.lock.read():
+                new = [r for r in records if r["id"] in self.snippets or
+                       self._find_duplicate(r["id"], r["metadata"], r["fingerprint"]) is None]
+        vectors = dict(zip(
+            (r["id"] for r in new),
+            self.embedder.embed_documents([embedding_text(r["code"], r["metadata"]) for r in new]) if new else []
+        ))
+        
+        stored_ids = []
+        journal_records = []
+        with self.lock.write(), self.journal.exclusive():
+            if self.journal.shared:
+                self._sync()
+            for record in records:
+                # Re-putting an existing ID is an update, not a duplicate
+                duplicate = None
+                if self.dedup and record["id"] not in self.snippets:
+                    duplicate = self._find_duplicate(record["id"], record["metadata"], record["fingerprint"])
+                if duplicate is not None:
+                    record = self._merge_record(duplicate, [record["metadata"]])
+                self._apply(record, vectors.get(record["id"]) if duplicate is None else None)
+                journal_records.append(record)
+                stored_ids.append(record["id"])
+            try:
+                self.journal.append_many(journal_records)
+            except Exception as e:
+                print(f"Error saving snippets: {e}")
+        return stored_ids
+    
+    def deduplicate(self, dry_run=False):
+        """
+        Merge near-duplicate snippets already in the store.
+        
+        Snippets are visited oldest first, so each group keeps its oldest
+        snippet, which absorbs the duplicate counts of the others. The
+        journal is compacted afterwards to reclaim the space.
+        
+        Returns:
+            A list of (kept_id, [removed_ids]) for each group of duplicates
+        """
+        with self.lock.write(), self.journal.exclusive():
+            if self.journal.shared:
+                self._sync()
+            index = SimHashIndex(self.fingerprints.max_distance)
+            groups = {}
+            order = sorted(
+                self.snippets,
+                key=lambda i: (parse_timestamp(self._metadata(i).get("timestamp")) or 0.0, i)
+            )
+            for snippet_id in order:
+                fingerprint = self.fingerprints.fingerprints[snippet_id]
+                kept = self._find_duplicate(snippet_id, self._metadata(snippet_id), fingerprint, index)
+                if kept is None:
+                    index.add(snippet_id, fingerprint)
+                    groups[snippet_id] = []
+                else:
+                    groups[kept].append(snippet_id)
+            merged = [(kept, removed) for kept, removed in groups.items() if removed]
+            if dry_run or not merged:
+                return merged
+            
+            records = []
+            for kept, removed in merged:
+                records.append(self._merge_record(kept, [self._metadata(i) for i in removed]))
+                records.extend({"op": "delete", "id": i} for i in removed)
+            for record in records:
+                self._apply(record)
+            self.journal.append_many(records)
+        
         self.save_snippets()
+        return merged
     
-    def search_snippets(self, query, n_results=5):
-        """Search for similar code snippets (simple keyword search)."""
-        query_lower = query.lower()
+    def search_snippets(self, query, n_results=5, language=None, since=None, until=None):
+        """
+        Search for similar code snippets, ranked by BM25 relevance.
+        
+        Args:
+            query: Free-text query matched against code, task and language
+            n_results: Maximum number of results to return
+            language: Only return snippets in this language (case-insensitive)
+            since: Only return snippets created at or after this Unix timestamp
+            until: Only return snippets created at or before this Unix timestamp
+        """
         results = {
             "documents": [],
             "metadatas": [],
             "ids": []
         }
         
-        # Simple keyword matching
-        for snippet_id, snippet_data in self.snippets.items():
-            code = snippet_data["code"]
-            metadata = snippet_data["metadata"]
-            
-            # Check if query is in code or metadata
-            if (query_lower in code.lower() or 
-                query_lower in metadata.get("task", "").lower() or
-                query_lower in metadata.get("language", "").lower()):
-                
-                results["documents"].append(code)
-                results["metadatas"].append(metadata)
+        self.refresh()
+        with self.lock.read():
+            for snippet_id, _score in self.index.search(query, n_results, language, since, until):
+                snippet_data = self.snippets[snippet_id]
+                results["documents"].append(snippet_data["code"])
+                results["metadatas"].append(snippet_data["metadata"])
                 results["ids"].append(snippet_id)
-                
-                # Limit results
-                if len(results["documents"]) >= n_results:
+        
+        return results
+    
+    def search_similar(self, query, n_results=5, language=None):
+        """
+        Search for semantically similar snippets by cosine similarity of embeddings.
+        
+        Args:
+            query: Free-text description or code to compare against
+            n_results: Maximum number of results to return
+            language: Only return snippets in this language (case-insensitive)
+        """
+        results = {
+            "documents": [],
+            "metadatas": [],
+            "ids": []
+        }
+        
+        query_vector = self.embedder.embed_query(query)
+        self.refresh()
+        with self.lock.read():
+            # Over-fetch when filtering so that enough candidates survive the filter
+            k = n_results * 4 if language else n_results
+            while True:
+                matches = self.vectors.search(query_vector, k)
+                if language:
+                    matches = [
+                        (snippet_id, score) for snippet_id, score in matches
+                        if str(self._metadata(snippet_id).get("language", "")).lower() == language.lower()
+                    ]
+                if len(matches) >= n_results or k >= len(self.vectors):
                     break
+                k *= 4
+            
+            for snippet_id, _score in matches[:n_results]:
+                snippet_data = self.snippets[snippet_id]
+                results["documents"].append(snippet_data["code"])
+                results["metadatas"].append(snippet_data["metadata"])
+                results["ids"].append(snippet_id)
         
         return results
     
     def get_snippet_by_id(self, snippet_id):
         """Retrieve a specific snippet by its ID."""
-        if snippet_id in self.snippets:
-            return {
-                "documents": [self.snippets[snippet_id]["code"]],
-                "metadatas": [self.snippets[snippet_id]["metadata"]],
-                "ids": [snippet_id]
-            }
+        self.refresh()
+        with self.lock.read():
+            if snippet_id in self.snippets:
+                return {
+                    "documents": [self.snippets[snippet_id]["code"]],
+                    "metadatas": [self.snippets[snippet_id]["metadata"]],
+                    "ids": [snippet_id]
+                }
         return {"documents": [], "metadatas": [], "ids": []}
 
-# Initialize the vector store
-vector_store = SimpleVectorStore()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_vector_store():
+    """Get the shared vector store, loading the snippets on first use."""
+    return SimpleVectorStore()
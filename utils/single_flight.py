@@ -0,0 +1,177 @@
+# utils/single_flight.py
+import threading
+import contextvars
+from utils.metrics import single_flight_calls, current_feature
+
+class _Call:
+    """One in-flight call and the callers sharing it."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.followers = 0
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.finished = False
+        # Set when the leader gave up without a result, so followers run the call themselves
+        self.abandoned = False
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, result=None, error=None, abandoned=False):
+        with self.condition:
+            self.result = result
+            self.error = error
+            self.abandoned = abandoned
+            self.finished = True
+            self.condition.notify_all()
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls within the process.
+
+    The first caller for a key (the leader) makes the call; callers that
+    arrive with the same key while it is in flight wait for and share its
+    result instead of repeating it. Nothing is kept once the call is done,
+    so this only merges overlapping calls; repeats later are left to the
+    caches. Errors are shared too, but if the leader is interrupted
+    (cancelled, or its stream closed with nobody waiting) the followers
+    make the call themselves.
+
+    `share` is applied to the result for each follower, to give it a copy
+    when callers may modify what they get back.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
+
+    def _join(self, key):
+        """Return (call, is_leader) for a key, registering a new call or a follower."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.followers += 1
+                leader = False
+        role = "leader" if leader else "coalesced"
+        single_flight_calls.inc(group=self.group, feature=current_feature.get(), role=role)
+        return call, leader
+
+    def _leave(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key, fn, share=None):
+        """Return fn(), or the result of an identical call already in flight."""
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            with call.condition:
+                call.condition.wait_for(lambda: call.finished)
+            if call.abandoned:
+                continue
+            if call.error is not None:
+                raise call.error
+            return share(call.result) if share else call.result
+
+        try:
+            result = fn()
+        except Exception as e:
+            self._leave(key, call)
+            call.finish(error=e)
+            raise
+        except BaseException:
+            self._leave(key, call)
+            call.finish(abandoned=True)
+            raise
+        self._leave(key, call)
+        call.finish(result)
+        return result
+
+    def stream(self, key, fn, share=None):
+        """
+        Yield the chunks of fn(), or of an identical stream already in flight.
+
+        Followers that join late replay the chunks produced so far, then
+        follow along. If the leader's consumer stops early while followers
+        are waiting, the rest of the stream is read on a background thread
+        for them.
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            try:
+                replayed = 0
+                while True:
+                    with call.condition:
+                        call.condition.wait_for(lambda: call.finished or len(call.chunks) > replayed)
+                        chunks = call.chunks[replayed:]
+                        finished, abandoned, error = call.finished, call.abandoned, call.error
+                    if abandoned and not replayed:
+                        break
+                    for chunk in chunks:
+                        yield share(chunk) if share else chunk
+                    replayed += len(chunks)
+                    if finished:
+                        if error is not None:
+                            raise error
+                        return
+            finally:
+                with self._lock:
+                    call.followers -= 1
+
+        source = fn()
+        try:
+            for chunk in source:
+                # Followers get copies of the chunk as it was produced, before the caller sees it
+                call.append(share(chunk) if share else chunk)
+                yield chunk
+        except Exception as e:
+            self._leave(key, call)
+            call.finish(error=e)
+            raise
+        except BaseException:
+            # The consumer stopped early (GeneratorExit) or was interrupted
+            with self._lock:
+                handoff = call.followers > 0
+                if not handoff:
+                    del self._calls[key]
+            if handoff:
+                context = contextvars.copy_context()
+                thread = threading.Thread(
+                    target=context.run, args=(self._finish_stream, key, call, source, share),
+                    name=f"single-flight-{self.group}", daemon=True
+                )
+                thread.start()
+            else:
+                source.close()
+                call.finish(abandoned=True)
+            raise
+        self._leave(key, call)
+        call.finish()
+
+    def _finish_stream(self, key, call, source, share):
+        """Read the rest of an abandoned leader's stream for its followers."""
+        try:
+            for chunk in source:
+                call.append(share(chunk) if share else chunk)
+        except Exception as e:
+            self._leave(key, call)
+            call.finish(error=e)
+            return
+        self._leave(key, call)
+        call.finish()
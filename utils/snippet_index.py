@@ -0,0 +1,134 @@
+# utils/snippet_index.py
+import re
+import math
+import heapq
+from collections import Counter
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Task descriptions are short but very descriptive, so weight them higher
+TASK_WEIGHT = 2
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9]*|\d+")
+CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def tokenize(text):
+    """Split text into lowercase search terms, including camelCase/snake_case parts."""
+    terms = []
+    for word in TOKEN_PATTERN.findall(text or ""):
+        lower = word.lower()
+        terms.append(lower)
+        parts = CAMEL_PATTERN.findall(word)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts)
+    return terms
+
+def parse_timestamp(value):
+    """Convert a stored timestamp (float or string) to a float, or None."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class InvertedIndex:
+    """Tokenized inverted index over snippets with BM25 ranking."""
+
+    def __init__(self):
+        self.postings = {}        # term -> {snippet_id: term frequency}
+        self.doc_terms = {}       # snippet_id -> tuple of indexed terms
+        self.doc_lengths = {}     # snippet_id -> number of indexed tokens
+        self.doc_languages = {}   # snippet_id -> lowercase language
+        self.doc_timestamps = {}  # snippet_id -> float timestamp or None
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, snippet_id, code, metadata):
+        """Index (or re-index) a snippet."""
+        if snippet_id in self.doc_lengths:
+            self.remove(snippet_id)
+
+        tokens = tokenize(code)
+        task_tokens = tokenize(metadata.get("task", ""))
+        # Tasks of merged duplicates add only the words the snippet's own task lacks
+        for task in metadata.get("tasks", []):
+            task_tokens.extend(token for token in tokenize(task) if token not in task_tokens)
+        tokens.extend(task_tokens * TASK_WEIGHT)
+        tokens.extend(tokenize(metadata.get("language", "")))
+        frequencies = Counter(tokens)
+
+        for term, count in frequencies.items():
+            self.postings.setdefault(term, {})[snippet_id] = count
+
+        self.doc_terms[snippet_id] = tuple(frequencies)
+        self.doc_lengths[snippet_id] = len(tokens)
+        self.doc_languages[snippet_id] = str(metadata.get("language", "")).lower()
+        self.doc_timestamps[snippet_id] = parse_timestamp(metadata.get("timestamp"))
+        self.total_length += len(tokens)
+
+    def remove(self, snippet_id):
+        """Drop a snippet from the index."""
+        if snippet_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(snippet_id):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(snippet_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(snippet_id)
+        self.doc_languages.pop(snippet_id, None)
+        self.doc_timestamps.pop(snippet_id, None)
+
+    def _matches_filters(self, snippet_id, language, since, until):
+        if language and self.doc_languages.get(snippet_id) != language:
+            return False
+        if since is not None or until is not None:
+            timestamp = self.doc_timestamps.get(snippet_id)
+            if timestamp is None:
+                return False
+            if since is not None and timestamp < since:
+                return False
+            if until is not None and timestamp > until:
+                return False
+        return True
+
+    def search(self, query, n_results=5, language=None, since=None, until=None):
+        """
+        Rank snippets against the query with BM25.
+
+        Only the postings of the query terms are visited, so the cost depends
+        on how many snippets match rather than on the size of the store.
+
+        Returns:
+            A list of (snippet_id, score) tuples, best match first
+        """
+        doc_count = len(self.doc_lengths)
+        if doc_count == 0:
+            return []
+
+        language = language.lower() if language else None
+        average_length = self.total_length / doc_count
+        scores = {}
+
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            df = len(docs)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for snippet_id, tf in docs.items():
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[snippet_id] / average_length
+                score = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+                scores[snippet_id] = scores.get(snippet_id, 0.0) + score
+
+        if language or since is not None or until is not None:
+            scores = {
+                snippet_id: score for snippet_id, score in scores.items()
+                if self._matches_filters(snippet_id, language, since, until)
+            }
+
+        return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
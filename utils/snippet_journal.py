@@ -0,0 +1,306 @@
+# utils/snippet_journal.py
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import nullcontext
+from utils.locks import FileLock
+
+class SnippetJournal:
+    """
+    Append-only JSONL journal with a periodically compacted JSON snapshot.
+
+    Every insert is a single appended line, so writes cost the same no matter
+    how large the store is. fsync is batched: it runs after `fsync_batch`
+    records or `fsync_interval` seconds, whichever comes first. Once the log
+    grows past `compact_every` records, a background thread folds it into
+    the snapshot, which is replaced atomically.
+
+    Startup replays the snapshot, then any log rotated out by an interrupted
+    compaction, then the live log. Replay is idempotent, so a crash at any
+    point loses at most the records that were not yet fsynced.
+
+    With `shared=True` several processes may use the same files: writers and
+    compaction hold an exclusive lock file, and `poll`/`read_tail` let a
+    process pick up records appended by the others without a full reload.
+    """
+
+    def __init__(self, snapshot_path, log_path, fsync_batch=32, fsync_interval=1.0, compact_every=5000, shared=False):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compacting_path = log_path + ".compacting"
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.shared = shared
+        self.file_lock = FileLock(snapshot_path + ".lock") if shared else None
+        self.compact_callback = None
+
+        self._lock = threading.Lock()
+        self._log = None
+        self._log_records = 0
+        self._log_id = None
+        self._snapshot_id = None
+        self._offset = 0
+        self._pending_fsync = 0
+        self._last_fsync = time.monotonic()
+        self._compacting = False
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = None
+
+    def exclusive(self):
+        """Context manager holding the cross-process write lock (no-op unless shared)."""
+        return self.file_lock.exclusive() if self.shared else nullcontext()
+
+    def shared_lock(self):
+        """Context manager holding the cross-process read lock (no-op unless shared)."""
+        return self.file_lock.shared() if self.shared else nullcontext()
+
+    def load(self, snippets=None):
+        """
+        Replay the snapshot and the log tail into a snippets dict.
+
+        Args:
+            snippets: Empty mapping to load into, such as a SegmentSnippets;
+                defaults to a new dict
+        """
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+        if snippets is None:
+            snippets = {}
+        self._snapshot_id = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                self._snapshot_id = self._file_id(os.fstat(f.fileno()))
+                snippets.update(json.load(f))
+
+        if os.path.exists(self.compacting_path):
+            self._replay(self.compacting_path, snippets)
+
+        self._log_id = None
+        self._offset = 0
+        self._log_records = 0
+        for record in self.read_tail(repair=not self.shared):
+            self.apply(record, snippets)
+        return snippets
+
+    def _replay(self, path, snippets):
+        """Apply every complete record in a log file to `snippets`."""
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    self.apply(json.loads(line), snippets)
+                except ValueError:
+                    break
+
+    @staticmethod
+    def _file_id(stat):
+        return (stat.st_ino, stat.st_dev, stat.st_mtime_ns)
+
+    def _current_snapshot_id(self):
+        try:
+            return self._file_id(os.stat(self.snapshot_path))
+        except FileNotFoundError:
+            return None
+
+    def poll(self):
+        """
+        Cheaply check whether another process changed the log.
+
+        Returns:
+            "none" if nothing changed, "tail" if records were appended since
+            the last read, or "reload" if the log was compacted away
+        """
+        if self._current_snapshot_id() != self._snapshot_id:
+            return "reload"
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return "reload" if self._offset else "none"
+        if self._log_id is not None and (stat.st_ino, stat.st_dev) != self._log_id:
+            return "reload"
+        if stat.st_size < self._offset:
+            return "reload"
+        if stat.st_size > self._offset:
+            return "tail"
+        return "none"
+
+    def read_tail(self, repair=False):
+        """
+        Read the records appended to the log since the last read.
+
+        A trailing partial line (a torn write from a crash, or an append that
+        is still in flight) is left for the next read, or truncated away when
+        `repair` is set.
+        """
+        if not os.path.exists(self.log_path):
+            return []
+
+        records = []
+        with open(self.log_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._log_id = (stat.st_ino, stat.st_dev)
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                self._offset += len(line)
+
+        if repair and self._offset < os.path.getsize(self.log_path):
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(self._offset)
+        self._log_records += len(records)
+        return records
+
+    @staticmethod
+    def apply(record, snippets):
+        """Apply a single journal record to a snippets dict."""
+        if record.get("op") == "put":
+            snippet = {
+                "code": record["code"],
+                "metadata": record["metadata"]
+            }
+            if "fingerprint" in record:
+                snippet["fingerprint"] = record["fingerprint"]
+            snippets[record["id"]] = snippet
+        elif record.get("op") == "delete":
+            snippets.pop(record["id"], None)
+
+    def _open_log(self):
+        if self._log is None:
+            self._log = open(self.log_path, 'ab')
+            stat = os.fstat(self._log.fileno())
+            self._log_id = (stat.st_ino, stat.st_dev)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._background_loop, name="snippet-journal", daemon=True)
+                self._flusher.start()
+                atexit.register(self.close)
+        return self._log
+
+    def append(self, record):
+        """Append a record, fsyncing in batches."""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """
+        Append several records with a single write.
+
+        In shared mode the caller must hold `exclusive()` and have caught up
+        with `read_tail()` first, so that the log offset stays accurate.
+        """
+        if not records:
+            return
+        data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        with self._lock:
+            log = self._open_log()
+            log.write(data)
+            log.flush()
+            self._offset += len(data)
+            self._log_records += len(records)
+            self._pending_fsync += len(records)
+            if (self._pending_fsync >= self.fsync_batch or
+                    time.monotonic() - self._last_fsync >= self.fsync_interval):
+                self._fsync_locked()
+            needs_compaction = self._log_records >= self.compact_every and not self._compacting
+        if needs_compaction:
+            self._wakeup.set()
+
+    def _fsync_locked(self):
+        if self._log is not None and self._pending_fsync:
+            os.fsync(self._log.fileno())
+        self._pending_fsync = 0
+        self._last_fsync = time.monotonic()
+
+    def flush(self):
+        """Force any buffered records to disk."""
+        with self._lock:
+            self._fsync_locked()
+
+    def _background_loop(self):
+        """Periodically fsync pending records and run requested compactions."""
+        while not self._closed:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            if self._closed:
+                break
+            self.flush()
+            if self._log_records >= self.compact_every and self.compact_callback is not None:
+                try:
+                    self.compact_callback()
+                except Exception as e:
+                    print(f"Error compacting snippets: {e}")
+
+    def compact(self, snippets):
+        """
+        Fold the log into a fresh snapshot of `snippets`.
+
+        The live log is rotated out under the lock together with a copy of
+        the snippets, so inserts are only blocked for the rotation itself;
+        the snapshot is written afterwards and swapped in atomically. In
+        shared mode the caller must hold `exclusive()` for the whole call.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            try:
+                self._fsync_locked()
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+                if os.path.exists(self.log_path):
+                    os.replace(self.log_path, self.compacting_path)
+                self._log_records = 0
+                self._log_id = None
+                self._offset = 0
+                # Stores that keep code out of memory write references to it instead
+                data = snippets.snapshot() if hasattr(snippets, "snapshot") else dict(snippets)
+            except Exception:
+                self._compacting = False
+                raise
+
+        try:
+            self._write_snapshot(data)
+            self._snapshot_id = self._current_snapshot_id()
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _write_snapshot(self, snippets):
+        """Atomically replace the snapshot file."""
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snippets, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Make the rename itself durable where the platform allows it
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """Flush and close the log."""
+        with self._lock:
+            self._fsync_locked()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self._closed = True
+        self._wakeup.set()
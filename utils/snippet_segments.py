@@ -0,0 +1,332 @@
+# utils/snippet_segments.py
+import os
+import sys
+import mmap
+import zlib
+import struct
+import hashlib
+import threading
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+from utils.locks import FileLock
+from utils.near_duplicates import simhash
+
+# Entry header: compressed length and a 128-bit BLAKE2b digest of the uncompressed body
+ENTRY_HEADER = struct.Struct(">I16s")
+
+COMPRESSION_LEVEL = 6
+
+class SegmentFile:
+    """
+    Append-only file of zlib-compressed code bodies, read through mmap.
+
+    Each body is stored once: the file is indexed by the digest of the
+    uncompressed text, so identical code shared by several snippets takes
+    one entry. Entries are only moved by `rewrite`, which copies the bodies
+    still in use to a new file that replaces this one; until then
+    (offset, length) references stay valid. Opening the file scans the
+    entry headers to rebuild the digest index, and a torn entry at the end
+    from a crash is truncated.
+
+    With `shared=True`, appends hold a lock file and first pick up entries
+    that other processes appended, so that they are not written twice. A
+    torn entry is truncated by the next append, under the lock, since no
+    other process can be writing it then.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.file_lock = FileLock(path + ".lock") if shared else None
+        self._offsets = {}
+        self._size = 0
+        self._map = None
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a+b')
+        with self._lock:
+            self._scan()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def _scan(self, repair=False):
+        """
+        Index entries appended since the last scan. Requires the lock.
+
+        Args:
+            repair: Truncate a torn entry at the end even in shared mode;
+                the caller must hold the exclusive file lock
+        """
+        f = self._file
+        f.flush()
+        file_size = os.fstat(f.fileno()).st_size
+        while self._size + ENTRY_HEADER.size <= file_size:
+            f.seek(self._size)
+            length, digest = ENTRY_HEADER.unpack(f.read(ENTRY_HEADER.size))
+            offset = self._size + ENTRY_HEADER.size
+            if offset + length > file_size:
+                break
+            self._offsets[digest] = (offset, length)
+            self._size = offset + length
+        # Another process may still be writing the tail, so only repair it when unshared or locked
+        if file_size > self._size and (repair or not self.shared):
+            f.truncate(self._size)
+
+    def locate(self, digest):
+        """The (offset, length) of the body with this digest, or None."""
+        with self._lock:
+            return self._offsets.get(digest)
+
+    def digests(self):
+        """A dict mapping the (offset, length) of every entry to its digest."""
+        with self._lock:
+            return {location: digest for digest, location in self._offsets.items()}
+
+    def reopen(self):
+        """
+        Switch to the file at `path` if another process replaced it with `rewrite`.
+
+        References into the old file are invalid afterwards, so call this
+        only before reloading them.
+
+        Returns:
+            True when the file was replaced
+        """
+        with self._lock:
+            try:
+                replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            if replaced:
+                self._open()
+                self._scan()
+            return replaced
+
+    def _open(self):
+        """(Re)open the file at `path` with an empty index. Requires the lock."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._file = open(self.path, 'a+b')
+        self._offsets = {}
+        self._size = 0
+
+    def rewrite(self, locations):
+        """
+        Replace the file with one that holds only the bodies at `locations`.
+
+        Bodies are copied without recompressing them. The new file is
+        written next to the old one and renamed over it, so a crash leaves
+        one or the other. Where an open file cannot be replaced (Windows),
+        nothing is rewritten.
+
+        Returns:
+            A dict mapping each of `locations` to its (offset, length) in
+            the new file, or None when the file was not rewritten
+        """
+        tmp_path = self.path + ".rewrite"
+        with self._lock, self.file_lock.exclusive() if self.shared else nullcontext():
+            self._scan(repair=True)
+            digests = {location: digest for digest, location in self._offsets.items()}
+            moved = {}
+            offsets = {}
+            size = 0
+            with open(tmp_path, 'wb') as out:
+                for offset, length in sorted(set(locations)):
+                    digest = digests[(offset, length)]
+                    self._file.seek(offset)
+                    out.write(ENTRY_HEADER.pack(length, digest) + self._file.read(length))
+                    moved[(offset, length)] = offsets[digest] = (size + ENTRY_HEADER.size, length)
+                    size += ENTRY_HEADER.size + length
+                out.flush()
+                os.fsync(out.fileno())
+            try:
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error replacing segment file: {e}")
+                os.remove(tmp_path)
+                return None
+            self._open()
+            self._offsets = offsets
+            self._size = size
+            return moved
+
+    def put(self, text):
+        """
+        Store a body, unless an identical one is already stored.
+
+        Returns:
+            The (offset, length) of the compressed body
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            location = self._offsets.get(digest)
+            if location is not None:
+                return location
+            with self.file_lock.exclusive() if self.shared else nullcontext():
+                if self.shared:
+                    self._scan(repair=True)
+                    location = self._offsets.get(digest)
+                    if location is not None:
+                        return location
+                compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                self._file.seek(0, os.SEEK_END)
+                offset = self._file.tell() + ENTRY_HEADER.size
+                self._file.write(ENTRY_HEADER.pack(len(compressed), digest) + compressed)
+                self._file.flush()
+                self._offsets[digest] = (offset, len(compressed))
+                self._size = offset + len(compressed)
+                return offset, len(compressed)
+
+    def get(self, offset, length):
+        """Read and decompress the body at (offset, length)."""
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # The file grew since it was mapped
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._map[offset:offset + length]
+        return zlib.decompress(data).decode("utf-8")
+
+    def sync(self):
+        """Make appended bodies durable, before a snapshot refers to them."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+class SnippetRecord:
+    """What stays in memory for a snippet: its metadata, fingerprint and where its code is."""
+
+    __slots__ = ("metadata", "fingerprint", "offset", "length")
+
+    def __init__(self, metadata, fingerprint, offset, length):
+        self.metadata = metadata
+        self.fingerprint = fingerprint
+        self.offset = offset
+        self.length = length
+
+class SegmentSnippets(MutableMapping):
+    """
+    Snippets dict that keeps code bodies in a SegmentFile.
+
+    Reads return the same {"code", "metadata", "fingerprint"} dicts as the
+    in-memory store, decompressing the code on each access, so it can stand
+    in for the plain dict that SimpleVectorStore and SnippetJournal use.
+    Entries may be set either with their code or, when loaded from a
+    snapshot, with a "body": [offset, length] reference. Snapshots also
+    record the body's digest, which is looked up instead of the offset, so
+    a snapshot stays readable after the segment file is rewritten.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self._records = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __contains__(self, snippet_id):
+        return snippet_id in self._records
+
+    def __getitem__(self, snippet_id):
+        record = self._records[snippet_id]
+        return {
+            "code": self.segments.get(record.offset, record.length),
+            "metadata": record.metadata,
+            "fingerprint": record.fingerprint
+        }
+
+    def __setitem__(self, snippet_id, snippet):
+        metadata = snippet["metadata"]
+        if isinstance(metadata.get("language"), str):
+            # Few distinct languages across many snippets
+            metadata["language"] = sys.intern(metadata["language"])
+        if "digest" in snippet:
+            location = self.segments.locate(bytes.fromhex(snippet["digest"]))
+            if location is None:
+                # Only bodies of snippets deleted after the snapshot are dropped from the segment file
+                print(f"Segment file has no code for snippet {snippet_id}; skipping it")
+                return
+            offset, length = location
+        elif "body" in snippet:
+            offset, length = snippet["body"]
+        else:
+            offset, length = self.segments.put(snippet["code"])
+        fingerprint = snippet.get("fingerprint")
+        if fingerprint is None:
+            fingerprint = simhash(snippet["code"] if "code" in snippet else self.segments.get(offset, length))
+        self._records[snippet_id] = SnippetRecord(metadata, fingerprint, offset, length)
+
+    def __delitem__(self, snippet_id):
+        del self._records[snippet_id]
+
+    def pop(self, snippet_id, *default):
+        # Skip decompressing the code of the snippet being removed
+        record = self._records.pop(snippet_id, None)
+        if record is None:
+            if default:
+                return default[0]
+            raise KeyError(snippet_id)
+        return record
+
+    def metadata(self, snippet_id):
+        """A snippet's metadata, without reading its code."""
+        return self._records[snippet_id].metadata
+
+    def snapshot(self):
+        """Entries for a snapshot file, which refers to the code by segment offset and digest."""
+        self.segments.sync()
+        records = list(self._records.items())
+        digests = self.segments.digests()
+        return {
+            snippet_id: {
+                "body": [record.offset, record.length],
+                "digest": digests[(record.offset, record.length)].hex(),
+                "metadata": record.metadata,
+                "fingerprint": record.fingerprint
+            }
+            for snippet_id, record in records
+        }
+
+    def reclaim(self, min_garbage=0.5):
+        """
+        Rewrite the segment file without the bodies no snippet refers to any
+        more, once they make up at least `min_garbage` of it.
+
+        Only call this after a snapshot of these snippets was written, since
+        snapshots from before it may refer to bodies that it drops.
+
+        Returns:
+            The number of bytes reclaimed
+        """
+        locations = {(record.offset, record.length) for record in self._records.values()}
+        size = self.segments.size_bytes
+        live = sum(ENTRY_HEADER.size + length for _, length in locations)
+        if not size or (size - live) / size < min_garbage:
+            return 0
+        moved = self.segments.rewrite(locations)
+        if moved is None:
+            return 0
+        for record in self._records.values():
+            record.offset, record.length = moved[(record.offset, record.length)]
+        return size - self.segments.size_bytes
@@ -0,0 +1,103 @@
+# utils/startup.py
+import time
+import threading
+import importlib
+
+# Set on first import, which app.py does before anything else, so once per process
+PROCESS_STARTED = time.perf_counter()
+
+class StartupTimer:
+    """
+    Times the app's cold start and the overhead of each Streamlit rerun.
+
+    The cold start runs from the first import of this module to the end of
+    the first script run, so it covers importing the app's modules. Later
+    runs reuse the imported modules and shared clients, so their time is
+    the per-rerun overhead.
+    """
+
+    def __init__(self):
+        self.cold_start = None
+        self.runs = 0
+        self.last_run = None
+        self.total_run_time = 0.0
+        self._lock = threading.Lock()
+
+    def run_finished(self, started):
+        """Record a script run that began at `started` (time.perf_counter())."""
+        now = time.perf_counter()
+        elapsed = now - started
+        with self._lock:
+            self.runs += 1
+            self.last_run = elapsed
+            self.total_run_time += elapsed
+            if self.cold_start is None:
+                self.cold_start = now - PROCESS_STARTED
+                print(f"Cold start: {self.cold_start:.2f}s")
+        return elapsed
+
+    def stats(self):
+        """Return the cold start, last run and average run time in seconds."""
+        with self._lock:
+            return {
+                "cold_start": self.cold_start,
+                "runs": self.runs,
+                "last_run": self.last_run,
+                "average_run": self.total_run_time / self.runs if self.runs else None
+            }
+
+startup_timer = StartupTimer()
+
+# Modules app.py imports, in order, and the shared resources created on first use
+APP_MODULES = [
+    "streamlit",
+    "utils.code_generator",
+    "utils.explainer",
+    "utils.test_generator",
+    "utils.agents",
+    "utils.github_api",
+    "utils.pr_reviewer",
+    "utils.simple_vector_store",
+    "utils.llm_cache",
+    "utils.background_jobs",
+]
+
+def measure_startup():
+    """
+    Time importing the app's modules and then creating each shared resource.
+
+    Run in a fresh process (python -m utils.startup) to see what a cold
+    start costs and which resources would be paid for by the first request.
+    """
+    timings = []
+    for name in APP_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        timings.append((f"import {name}", time.perf_counter() - started))
+
+    from utils.llms import get_llm
+    from utils.llm_cache import get_llm_cache
+    from utils.simple_vector_store import get_vector_store
+    from utils.agents import get_agent_executor
+    resources = [
+        ("LLM cache", get_llm_cache),
+        ("completion LLM", lambda: get_llm(temperature=0.5)),
+        ("chat LLM", lambda: get_llm(chat=True, temperature=0.3)),
+        ("agent executor", get_agent_executor),
+        ("vector store", get_vector_store),
+    ]
+    for label, create in resources:
+        started = time.perf_counter()
+        create()
+        timings.append((f"create {label}", time.perf_counter() - started))
+    return timings
+
+def main():
+    started = time.perf_counter()
+    timings = measure_startup()
+    for label, elapsed in timings:
+        print(f"{elapsed * 1000:9.1f} ms  {label}")
+    print(f"{(time.perf_counter() - started) * 1000:9.1f} ms  total")
+
+if __name__ == "__main__":
+    main()
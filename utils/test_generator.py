@@ -1,10 +1,10 @@
 # utils/test_generator.py
-from langchain_openai import OpenAI
-from langchain.prompts import PromptTemplate
-from utils.config import OPENAI_API_KEY
+from langchain_core.prompts import PromptTemplate
+from utils.model_router import invoke_routed, stream_routed, python_parses, not_empty
+from utils.metrics import instrumented
 
-# Initialize the LLM
-llm = OpenAI(api_key=OPENAI_API_KEY, temperature=0.3)
+# LLM settings; the client itself is created on first use
+TEMPERATURE = 0.3
 
 # Create a prompt template for test generation
 test_template = """
@@ -26,10 +26,20 @@ test_prompt = PromptTemplate(
     template=test_template
 )
 
-# Create the chain using the pipe operator
-test_chain = test_prompt | llm
+# Frameworks whose tests are Python, so that generated tests can be checked by parsing them
+PYTHON_FRAMEWORKS = ("pytest", "unittest")
 
+def tests_validator(testing_framework):
+    return python_parses if testing_framework.strip().lower() in PYTHON_FRAMEWORKS else not_empty
+
+@instrumented("test_generation")
 def generate_tests(code, testing_framework="pytest"):
     """Generate unit tests for the given code."""
-    result = test_chain.invoke({"code": code, "testing_framework": testing_framework})
-    return result
\ No newline at end of file
+    inputs = {"code": code, "testing_framework": testing_framework}
+    return invoke_routed("test_generation", test_prompt, inputs, TEMPERATURE, validate=tests_validator(testing_framework))
+
+@instrumented("test_generation")
+def stream_tests(code, testing_framework="pytest"):
+    """Generate unit tests for the given code, yielding text chunks as they arrive."""
+    inputs = {"code": code, "testing_framework": testing_framework}
+    return stream_routed("test_generation", test_prompt, inputs, TEMPERATURE, validate=tests_validator(testing_framework))
\ No newline at end of file
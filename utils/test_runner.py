@@ -0,0 +1,392 @@
+# utils/test_runner.py
+import os
+import re
+import ast
+import sys
+import json
+import time
+import signal
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import importlib.util
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from utils.config import (
+    TEST_RUN_ENABLED,
+    TEST_RUN_WORKERS,
+    TEST_RUN_TIMEOUT,
+    TEST_RUN_CPU_SECONDS,
+    TEST_RUN_MEMORY_MB,
+    TEST_RUN_CACHE_PATH,
+    TEST_RUN_CACHE_TTL
+)
+from utils.metrics import registry
+from utils.model_router import extract_code
+from utils.single_flight import SingleFlight
+
+test_runs = registry.counter(
+    "codecrafter_test_runs_total", "Generated test runs by outcome, and whether the outcome was cached",
+    ["status", "cached"])
+test_run_seconds = registry.histogram(
+    "codecrafter_test_run_seconds", "Wall time of a sandboxed test run", ["status"])
+
+# Frameworks whose tests can be run; pytest also runs unittest test cases
+FRAMEWORKS = ("pytest", "unittest")
+
+# The generated code is importable under this name, and under any other
+# module name the tests import that does not exist
+CODE_MODULE = "solution"
+TEST_FILE = "test_solution.py"
+
+# Cap on the test output kept with a result
+MAX_OUTPUT_CHARS = 20000
+MAX_FILE_BYTES = 64 * 1024 * 1024
+
+# Bump when a change to the runner can change outcomes, so cached ones are not reused
+RUNNER_VERSION = 1
+
+# Runs in the test subprocess: applies the resource limits, then runs the
+# runner module as `python -m` would. Limits are set in the child rather than
+# in a preexec_fn, which is unsafe in a process with threads.
+SANDBOX_BOOTSTRAP = """
+import sys, runpy
+try:
+    import resource
+except ImportError:
+    resource = None
+cpu_seconds, memory_bytes, file_bytes = (int(value) for value in sys.argv[1:4])
+if resource is not None:
+    for limit, value in ((resource.RLIMIT_CPU, cpu_seconds), (resource.RLIMIT_AS, memory_bytes),
+                         (resource.RLIMIT_FSIZE, file_bytes), (resource.RLIMIT_CORE, 0)):
+        hard = resource.getrlimit(limit)[1]
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard) if value else hard
+        if value or limit == resource.RLIMIT_CORE:
+            resource.setrlimit(limit, (value, value))
+sys.argv = sys.argv[4:]
+# -I leaves the sandbox directory off the path, where the tests and the code are
+sys.path.insert(0, "")
+runpy.run_module(sys.argv[0], run_name="__main__", alter_sys=True)
+"""
+
+UNITTEST_RAN_PATTERN = re.compile(r"^Ran (\d+) tests?", re.M)
+UNITTEST_COUNTS_PATTERN = re.compile(r"(failures|errors|skipped|expected failures|unexpected successes)=(\d+)")
+
+class TestRunResult:
+    """
+    Outcome of running generated tests.
+
+    `status` is "passed" (every test passed), "failed" (some test failed),
+    "error" (tests errored, none were collected or the run crashed) or
+    "timeout".
+    """
+
+    __slots__ = ("status", "passed", "failed", "errors", "skipped", "duration", "output", "cached")
+
+    def __init__(self, status, passed=0, failed=0, errors=0, skipped=0, duration=0.0, output="", cached=False):
+        self.status = status
+        self.passed = passed
+        self.failed = failed
+        self.errors = errors
+        self.skipped = skipped
+        self.duration = duration
+        self.output = output
+        self.cached = cached
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "cached"}
+
+    @classmethod
+    def from_dict(cls, data, cached=False):
+        return cls(**data, cached=cached)
+
+def outcome(passed, failed, errors):
+    """Overall status from test counts."""
+    if errors:
+        return "error"
+    if failed:
+        return "failed"
+    return "passed" if passed else "error"
+
+def run_key(code, tests, framework, limits):
+    """Content hash identifying a run: the code, the tests, the framework and the limits."""
+    data = json.dumps([RUNNER_VERSION, framework, code, tests, limits])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def imported_modules(tree):
+    """Top-level names of the modules a parsed file imports."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return names
+
+def module_exists(name):
+    if name in sys.stdlib_module_names:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def write_sandbox(directory, code, tests):
+    """
+    Write the code and tests into `directory`.
+
+    The code goes to solution.py. Tests import it under whatever name the
+    model picked, so every module they import that does not exist gets a
+    stub that re-exports solution, and tests that use the code without
+    importing it get `from solution import *` at the top.
+
+    Raises:
+        SyntaxError: The tests are not valid Python
+    """
+    tree = ast.parse(tests)
+    with open(os.path.join(directory, f"{CODE_MODULE}.py"), 'w') as f:
+        f.write(code)
+    for name in imported_modules(tree) - {CODE_MODULE}:
+        if not module_exists(name):
+            with open(os.path.join(directory, f"{name}.py"), 'w') as f:
+                f.write(f"from {CODE_MODULE} import *\n")
+    has_future_import = any(
+        isinstance(node, ast.ImportFrom) and node.module == "__future__" for node in tree.body
+    )
+    if CODE_MODULE not in imported_modules(tree) and not has_future_import:
+        tests = f"from {CODE_MODULE} import *\n" + tests
+    with open(os.path.join(directory, TEST_FILE), 'w') as f:
+        f.write(tests)
+
+def read_junit_report(path):
+    """Return (passed, failed, errors, skipped) from a JUnit XML report, or None without one."""
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError):
+        return None
+    suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+    tests = failed = errors = skipped = 0
+    for suite in suites:
+        tests += int(suite.get("tests", 0))
+        failed += int(suite.get("failures", 0))
+        errors += int(suite.get("errors", 0))
+        skipped += int(suite.get("skipped", 0))
+    return tests - failed - errors - skipped, failed, errors, skipped
+
+def read_unittest_output(output):
+    """Return (passed, failed, errors, skipped) from `python -m unittest` output, or None."""
+    ran = UNITTEST_RAN_PATTERN.search(output)
+    if ran is None:
+        return None
+    counts = dict((name, int(value)) for name, value in UNITTEST_COUNTS_PATTERN.findall(output))
+    failed = counts.get("failures", 0) + counts.get("unexpected successes", 0)
+    errors = counts.get("errors", 0)
+    skipped = counts.get("skipped", 0) + counts.get("expected failures", 0)
+    return int(ran.group(1)) - failed - errors - skipped, failed, errors, skipped
+
+def sandbox_env(directory):
+    """A minimal environment for the test process: no secrets, one thread per native library."""
+    return {
+        "PATH": os.environ.get("PATH", ""),
+        "HOME": directory,
+        "TMPDIR": directory,
+        "LANG": "C.UTF-8",
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "PYTEST_DISABLE_PLUGIN_AUTOLOAD": "1",
+        "OMP_NUM_THREADS": "1",
+        "OPENBLAS_NUM_THREADS": "1",
+        "MKL_NUM_THREADS": "1",
+    }
+
+def kill_process_group(process):
+    """Kill a test process and anything it started."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+class TestRunCache:
+    """Test run outcomes stored in SQLite, keyed by the content hash of the run."""
+
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS test_runs ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)"
+        )
+
+    def get(self, key):
+        """Return the cached outcome of a run, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT result, created FROM test_runs WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None
+        return TestRunResult.from_dict(json.loads(row[0]), cached=True)
+
+    def set(self, key, result):
+        """Store the outcome of a run."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO test_runs (key, result, created) VALUES (?, ?, ?)",
+                (key, json.dumps(result.to_dict()), time.time())
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM test_runs")
+
+class TestRunner:
+    """
+    Runs generated tests against generated code in a pool of subprocesses.
+
+    Each run gets its own temporary directory and a Python process with
+    CPU time, address space and file size limits, a minimal environment
+    and a wall-clock timeout after which its whole process group is
+    killed. Runs execute on `workers` threads, each waiting on its own
+    process, so that many test files use all cores while callers get a
+    future back at once. Outcomes are cached by content hash, and
+    identical runs in flight at the same time are only made once.
+    """
+
+    def __init__(self, workers=TEST_RUN_WORKERS, cache=None, timeout=TEST_RUN_TIMEOUT,
+                 cpu_seconds=TEST_RUN_CPU_SECONDS, memory_mb=TEST_RUN_MEMORY_MB):
+        self.cache = cache
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="codecrafter-tests")
+        self.flight = SingleFlight("tests")
+
+    def submit(self, code, tests, framework="pytest"):
+        """Start a run in the pool; returns a Future for its TestRunResult."""
+        return self.executor.submit(self.run, code, tests, framework)
+
+    def run_many(self, items):
+        """
+        Run many {code, tests, framework} items in parallel.
+
+        Returns:
+            A list of TestRunResult objects in the order of `items`
+        """
+        futures = [self.submit(item["code"], item["tests"], item.get("framework", "pytest")) for item in items]
+        return [future.result() for future in futures]
+
+    def run(self, code, tests, framework="pytest"):
+        """Run tests against code in a sandbox, or return the cached outcome of the same run."""
+        if framework not in FRAMEWORKS:
+            raise ValueError(f"Unsupported testing framework: {framework}")
+        code, tests = extract_code(code), extract_code(tests)
+        key = run_key(code, tests, framework, [self.timeout, self.cpu_seconds, self.memory_mb])
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                test_runs.inc(status=cached.status, cached="true")
+                return cached
+
+        result = self.flight.do(key, lambda: self._run_in_sandbox(code, tests, framework))
+        test_runs.inc(status=result.status, cached="false")
+        test_run_seconds.observe(result.duration, status=result.status)
+        # A timeout can be down to a busy machine, so it is tried again next time
+        if self.cache is not None and result.status != "timeout":
+            self.cache.set(key, result)
+        return result
+
+    def _command(self, framework, directory):
+        limits = [
+            str(self.cpu_seconds),
+            str(self.memory_mb * 1024 * 1024),
+            str(MAX_FILE_BYTES),
+        ]
+        if module_exists("pytest"):
+            report = os.path.join(directory, "report.xml")
+            runner = ["pytest", "-q", "-p", "no:cacheprovider", f"--junitxml={report}", TEST_FILE]
+        elif framework == "unittest":
+            report = None
+            runner = ["unittest", "-v", TEST_FILE[:-3]]
+        else:
+            return None, None
+        # -I: ignore PYTHON* variables and the user site directory
+        return [sys.executable, "-I", "-c", SANDBOX_BOOTSTRAP] + limits + runner, report
+
+    def _run_in_sandbox(self, code, tests, framework):
+        started = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix="codecrafter-tests-") as directory:
+            try:
+                write_sandbox(directory, code, tests)
+            except SyntaxError as e:
+                return TestRunResult("error", output=f"The tests are not valid Python: {e}")
+            command, report = self._command(framework, directory)
+            if command is None:
+                return TestRunResult("error", output="pytest is not installed")
+
+            process = subprocess.Popen(
+                command, cwd=directory, env=sandbox_env(directory), stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True
+            )
+            try:
+                output, _ = process.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                kill_process_group(process)
+                output, _ = process.communicate()
+                output = output.decode("utf-8", "replace")[-MAX_OUTPUT_CHARS:]
+                return TestRunResult(
+                    "timeout", duration=time.perf_counter() - started,
+                    output=output + f"\nTimed out after {self.timeout:g} seconds"
+                )
+            finally:
+                # Tests may leave processes behind even when they finish
+                kill_process_group(process)
+            duration = time.perf_counter() - started
+            output = output.decode("utf-8", "replace")[-MAX_OUTPUT_CHARS:]
+            counts = read_junit_report(report) if report else read_unittest_output(output)
+
+        if counts is None:
+            if process.returncode < 0:
+                output += f"\nKilled by signal {-process.returncode} (CPU, memory or file size limit)"
+            return TestRunResult("error", duration=duration, output=output)
+        passed, failed, errors, skipped = counts
+        return TestRunResult(outcome(passed, failed, errors), passed, failed, errors, skipped, duration, output)
+
+@lru_cache(maxsize=None)
+def get_test_runner():
+    """Get the shared test runner, started on first use; None when TEST_RUN_ENABLED is off."""
+    if not TEST_RUN_ENABLED:
+        return None
+    return TestRunner(cache=TestRunCache(TEST_RUN_CACHE_PATH, ttl=TEST_RUN_CACHE_TTL))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generated tests against generated code in sandboxes.")
+    parser.add_argument("input", help="JSONL file of {code, tests, framework} items")
+    parser.add_argument("--workers", type=int, default=TEST_RUN_WORKERS, help="Test runs at once")
+    parser.add_argument("--no-cache", action="store_true", help="Run every item even if its outcome is cached")
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    cache = None if args.no_cache else TestRunCache(TEST_RUN_CACHE_PATH, ttl=TEST_RUN_CACHE_TTL)
+    runner = TestRunner(workers=args.workers, cache=cache)
+    started = time.perf_counter()
+    results = runner.run_many(items)
+    for line_number, result in enumerate(results, 1):
+        print(json.dumps(dict(result.to_dict(), line=line_number, cached=result.cached, output=None)))
+    statuses = [result.status for result in results]
+    print(
+        f"{len(results)} runs in {time.perf_counter() - started:.1f}s: "
+        + ", ".join(f"{statuses.count(status)} {status}" for status in ("passed", "failed", "error", "timeout"))
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# utils/tokens.py
+from functools import lru_cache
+import tiktoken
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    """Get the tiktoken encoding for a model, falling back to cl100k_base."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads encodings on first use, which fails offline
+        print(f"Error loading tiktoken encoding, estimating token counts instead: {e}")
+        return None
+
+def count_tokens(text, model_name):
+    """Count the tokens in text for a model."""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        # Roughly four characters per token for English text and code
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
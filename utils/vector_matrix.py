@@ -0,0 +1,232 @@
+# utils/vector_matrix.py
+import os
+import json
+import numpy as np
+
+class EmbeddingMatrix:
+    """
+    Contiguous float32 matrix of normalised embeddings, one row per snippet.
+
+    Rows are kept densely packed (deletes move the last row into the hole),
+    so a query is a single matrix-vector product followed by an
+    `argpartition` for the top k. With `path` set, the matrix lives in a
+    memory-mapped file and a small JSON sidecar records which snippet each
+    row belongs to, so restarts do not need to re-embed the store. Rows
+    added and moved since the sidecar was written are appended to a log
+    next to it, which `load` replays, so the mapping survives a crash.
+    """
+
+    def __init__(self, dim, path=None, signature=""):
+        self.dim = dim
+        self.path = path
+        self.meta_path = path + ".json" if path else None
+        self.log_path = path + ".log" if path else None
+        self.signature = signature
+        self.ids = []
+        self.rows = {}
+        self.size = 0
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        # Bumped on every save; the log only applies to the sidecar of its generation
+        self.generation = 0
+        self._log = None
+        self._log_current = False
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, snippet_id):
+        return snippet_id in self.rows
+
+    def _allocate(self, capacity):
+        """Grow the backing storage to hold at least `capacity` rows."""
+        if self.path:
+            byte_size = capacity * self.dim * 4
+            mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+            with open(self.path, mode) as f:
+                if os.path.getsize(self.path) < byte_size:
+                    f.truncate(byte_size)
+            self.matrix = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        else:
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed > self.matrix.shape[0]:
+            self._allocate(max(needed, self.matrix.shape[0] * 2, 1024))
+
+    def load(self):
+        """
+        Attach to a previously persisted matrix.
+
+        Returns:
+            The list of snippet IDs that already have rows
+        """
+        if not self.path or not os.path.exists(self.path) or not os.path.exists(self.meta_path):
+            return []
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"Error loading embedding index: {e}")
+            return []
+        if meta.get("signature") != self.signature or meta.get("dim") != self.dim:
+            return []
+
+        self.generation = meta.get("generation", 0)
+        self.ids = list(meta.get("ids", []))
+        self.rows = {snippet_id: row for row, snippet_id in enumerate(self.ids)}
+        self.size = len(self.ids)
+        for op, snippet_id in self._read_log():
+            if op == "add" and snippet_id not in self.rows:
+                self._append_id(snippet_id)
+            elif op == "remove":
+                self._drop_id(snippet_id)
+
+        rows = os.path.getsize(self.path) // (self.dim * 4)
+        for snippet_id in self.ids[rows:]:
+            del self.rows[snippet_id]
+        self.ids = self.ids[:rows]
+        self.size = len(self.ids)
+        self._allocate(max(rows, 1024))
+        return list(self.ids)
+
+    def _read_log(self):
+        """
+        The (op, snippet ID) entries logged since the loaded sidecar was
+        written. A torn entry at the end of the log is cut off, so that
+        later entries are appended after the last complete one.
+        """
+        try:
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        lines = data.split(b"\n")
+        try:
+            header = json.loads(lines[0]) if len(lines) > 1 else {}
+        except ValueError:
+            header = {}
+        if header.get("generation") != self.generation:
+            return []
+
+        entries = []
+        good = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line) + 1
+        if good < len(data):
+            print("Discarding a torn write at the end of the embedding index log")
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(good)
+        self._log_current = True
+        return entries
+
+    def _journal(self, op, snippet_ids):
+        """Log row changes that the sidecar does not have yet."""
+        if not self.log_path or not snippet_ids:
+            return
+        if self._log is None:
+            if self._log_current:
+                self._log = open(self.log_path, 'a')
+            else:
+                self._log = open(self.log_path, 'w')
+                self._log.write(json.dumps({"generation": self.generation}) + "\n")
+                self._log_current = True
+        self._log.write("".join(json.dumps([op, snippet_id]) + "\n" for snippet_id in snippet_ids))
+        self._log.flush()
+
+    def save(self):
+        """Flush the memory map and write the row -> ID sidecar, starting a new log."""
+        if not self.path:
+            return
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+        self.generation += 1
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"signature": self.signature, "dim": self.dim, "generation": self.generation, "ids": self.ids}, f)
+        os.replace(tmp_path, self.meta_path)
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        self._log_current = False
+
+    def close(self):
+        """Flush the memory map and close the log."""
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def add(self, snippet_id, vector):
+        """Insert or replace the embedding for a snippet."""
+        self.add_many([snippet_id], np.asarray(vector, dtype=np.float32).reshape(1, self.dim))
+
+    def add_many(self, snippet_ids, vectors):
+        """Insert or replace embeddings for several snippets at once."""
+        self._reserve(len(snippet_ids))
+        self._journal("add", [snippet_id for snippet_id in dict.fromkeys(snippet_ids) if snippet_id not in self.rows])
+        for snippet_id, vector in zip(snippet_ids, vectors):
+            row = self.rows.get(snippet_id)
+            if row is None:
+                row = self._append_id(snippet_id)
+            self.matrix[row] = vector
+
+    def remove(self, snippet_id):
+        """Drop a snippet's row by moving the last row into its place."""
+        if snippet_id not in self.rows:
+            return
+        self._journal("remove", [snippet_id])
+        row, last = self._drop_id(snippet_id)
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+
+    def _append_id(self, snippet_id):
+        """Give a snippet the next free row."""
+        row = self.size
+        self.rows[snippet_id] = row
+        self.ids.append(snippet_id)
+        self.size += 1
+        return row
+
+    def _drop_id(self, snippet_id):
+        """
+        Free a snippet's row, moving the ID of the last row into it.
+
+        Returns:
+            A (row, last row) tuple, or None when the snippet has no row
+        """
+        row = self.rows.pop(snippet_id, None)
+        if row is None:
+            return None
+        last = self.size - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.rows[moved_id] = row
+        self.ids.pop()
+        self.size -= 1
+        return row, last
+
+    def search(self, query_vector, k=5):
+        """
+        Return the k rows most similar to the query by cosine similarity.
+
+        Returns:
+            A list of (snippet_id, score) tuples, best match first
+        """
+        if self.size == 0 or k <= 0:
+            return []
+        scores = self.matrix[:self.size] @ np.asarray(query_vector, dtype=np.float32)
+        if k < self.size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(self.size)
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[row], float(scores[row])) for row in top]